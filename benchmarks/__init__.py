@@ -0,0 +1,7 @@
+"""Benchmarks for the backup and restore pipeline on synthetic site data.
+
+Run from the app directory (no bench or database needed)::
+
+	python -m benchmarks run --output results.json
+	python -m benchmarks compare baseline.json results.json
+"""
@@ -0,0 +1,415 @@
+"""Benchmark cases for the backup and restore pipeline, and comparison of result files.
+
+Every case drives the same Frappe-free building blocks the app uses (see
+`erpnext_backup_manager.bundle`, ``filestore``, ``integrity``, ``transfer``,
+``catalog``, ``selective``, ``retention``, ``restore_engine``) on synthetic data, so
+no bench or database is needed. A case is a function that prepares its inputs and
+returns the callable to time; it is called again for every repetition, so setup
+(such as emptying a store) is never part of the measurement.
+
+Results are JSON: per case the best and median wall time plus the bytes read and
+written, MB/s and compression ratio in the same shape as the phase records on
+Backup Archive. ``compare`` flags cases that got slower than a threshold and exits
+non-zero, which makes it usable as a CI gate.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from benchmarks import synthetic
+from erpnext_backup_manager import catalog, retention
+from erpnext_backup_manager.bundle import stream_bundle, write_bundle
+from erpnext_backup_manager.compression import decompressor
+from erpnext_backup_manager.filestore import iter_tar, snapshot_directory
+from erpnext_backup_manager.integrity import CHUNK_SIZE, HashingWriter, copy_with_checksum, file_checksum
+from erpnext_backup_manager.metrics import phase_stats
+from erpnext_backup_manager.selective import iter_table_statements
+from erpnext_backup_manager.transfer import place_file
+
+RESULT_VERSION = 1
+DEFAULT_REPEAT = 3
+DEFAULT_ARCHIVES = 5000
+DEFAULT_THRESHOLD = 0.10
+CATALOG_LOOKUPS = 1000
+
+# A case returns the callable to time; the callable returns (bytes_in, bytes_out).
+Timed = Callable[[], tuple[Optional[int], Optional[int]]]
+CASES: Dict[str, Callable[[Context], Timed]] = {}
+
+
+class Context:
+	"""The data set and a scratch directory shared by the cases of one run."""
+
+	def __init__(self, data: Dict[str, Any], work: Path, archives: int) -> None:
+		self.data = data
+		self.site = Path(data["site"])
+		self.db = Path(data["db"])
+		self.work = work
+		self.archives = archives
+		self.archive_root = work / "archive"
+
+	def path(self, name: str) -> Path:
+		return self.work / name
+
+	def fresh_dir(self, name: str) -> Path:
+		path = self.path(name)
+		shutil.rmtree(path, ignore_errors=True)
+		path.mkdir(parents=True)
+		return path
+
+
+def case(name: str) -> Callable[[Callable[[Context], Timed]], Callable[[Context], Timed]]:
+	def register(function: Callable[[Context], Timed]) -> Callable[[Context], Timed]:
+		CASES[name] = function
+		return function
+
+	return register
+
+
+def _largest_file(root: Path) -> Path:
+	return max((path for path in root.rglob("*") if path.is_file()), key=lambda path: path.stat().st_size)
+
+
+def _drain(chunks) -> int:
+	return sum(len(chunk) for chunk in chunks)
+
+
+@case("hash_dump")
+def hash_dump(ctx: Context) -> Timed:
+	# What FileFollower and verification do to a database dump: sha256 plus the gzip check.
+	def run():
+		result = file_checksum(ctx.db, check_gzip=True)
+		return result["size"], None
+
+	return run
+
+
+@case("hash_huge_file")
+def hash_huge_file(ctx: Context) -> Timed:
+	path = _largest_file(ctx.site)
+
+	def run():
+		return file_checksum(path)["size"], None
+
+	return run
+
+
+@case("files_tar")
+def files_tar(ctx: Context) -> Timed:
+	# The "Full" file backup: tar piped through a hashing writer, as the backup job does.
+	target = ctx.path("public-files.tar")
+
+	def run():
+		with open(target, "wb") as raw:
+			writer = HashingWriter(raw)
+			process = subprocess.Popen(
+				["tar", "-cf", "-", "public/files"], cwd=ctx.site, stdout=subprocess.PIPE
+			)
+			with process.stdout:
+				shutil.copyfileobj(process.stdout, writer, CHUNK_SIZE)
+			if process.wait() not in (0, 1):
+				raise RuntimeError("tar failed")
+		return ctx.data["files"]["public"], writer.size
+
+	return run
+
+
+@case("files_dedup_first")
+def files_dedup_first(ctx: Context) -> Timed:
+	# A first deduplicated backup: every file is hashed and copied into an empty store.
+	store_root = ctx.fresh_dir("dedup-first")
+
+	def run():
+		result = snapshot_directory(
+			"public/files", store_root / "public.manifest.json.gz", store_root, cwd=str(ctx.site)
+		)
+		return result["bytes"], result["new_bytes"]
+
+	return run
+
+
+def _dedup_base(ctx: Context) -> Path:
+	"""A deduplicated backup of the public files in the shared store, taken once per run."""
+	manifest = ctx.archive_root / "base.manifest.json.gz"
+	if not manifest.exists():
+		ctx.archive_root.mkdir(parents=True, exist_ok=True)
+		snapshot_directory("public/files", manifest, ctx.archive_root, cwd=str(ctx.site))
+	return manifest
+
+
+@case("files_dedup_unchanged")
+def files_dedup_unchanged(ctx: Context) -> Timed:
+	# The nightly case: nothing changed since the previous manifest.
+	previous = _dedup_base(ctx)
+	manifest = ctx.archive_root / "next.manifest.json.gz"
+
+	def run():
+		result = snapshot_directory(
+			"public/files", manifest, ctx.archive_root, cwd=str(ctx.site), previous_manifest=previous
+		)
+		return result["bytes"], result["new_bytes"]
+
+	return run
+
+
+@case("import_copy")
+def import_copy(ctx: Context) -> Timed:
+	# Upload import when no zero-copy method works: one pass that copies and hashes.
+	target_dir = ctx.fresh_dir("import-copy")
+
+	def run():
+		result = copy_with_checksum(ctx.db, target_dir / ctx.db.name)
+		return result["size"], result["size"]
+
+	return run
+
+
+@case("import_link")
+def import_link(ctx: Context) -> Timed:
+	# Upload import on one filesystem: hardlink (or reflink), then a read pass to hash.
+	target_dir = ctx.fresh_dir("import-link")
+
+	def run():
+		target = target_dir / ctx.db.name
+		if not place_file(ctx.db, target):
+			copy_with_checksum(ctx.db, target)
+		return file_checksum(target, check_gzip=True)["size"], None
+
+	return run
+
+
+def _bundle_members(ctx: Context) -> list[Path]:
+	tar_path = ctx.path("public-files.tar")
+	if not tar_path.exists():
+		files_tar(ctx)()
+	return [ctx.db, tar_path]
+
+
+@case("bundle_write")
+def bundle_write(ctx: Context) -> Timed:
+	members = _bundle_members(ctx)
+	bundle_path = ctx.path("bundle.zip")
+
+	def run():
+		result = write_bundle(bundle_path, members)
+		return sum(path.stat().st_size for path in members), result["size"]
+
+	return run
+
+
+@case("bundle_stream")
+def bundle_stream(ctx: Context) -> Timed:
+	# download_archive_bundle in stream mode: the ZIP is built as it is sent.
+	members = _bundle_members(ctx)
+
+	def run():
+		return sum(path.stat().st_size for path in members), _drain(stream_bundle(members))
+
+	return run
+
+
+@case("tar_stream")
+def tar_stream(ctx: Context) -> Timed:
+	# Downloading a deduplicated file backup: the tar is rebuilt from the store on the fly.
+	manifest = _dedup_base(ctx)
+
+	def run():
+		return None, _drain(iter_tar(manifest, ctx.archive_root))
+
+	return run
+
+
+@case("restore_read")
+def restore_read(ctx: Context) -> Timed:
+	# The fast restore engine's side of the pipe: decompressing the dump (pigz when installed).
+	def run():
+		process, stream = decompressor(ctx.db, os.cpu_count() or 1)
+		with stream:
+			total = _drain(iter(lambda: stream.read(CHUNK_SIZE), b""))
+		if process and process.wait() != 0:
+			raise RuntimeError("decompression failed")
+		return ctx.db.stat().st_size, total
+
+	return run
+
+
+@case("selective_extract")
+def selective_extract(ctx: Context) -> Timed:
+	# The last table of the dump: the worst case, a scan of the whole stream.
+	table = ctx.data["tables"][-1]["name"]
+
+	def run():
+		size = sum(len(statement) for _table, statement in iter_table_statements(ctx.db, [table]))
+		return ctx.data["sql_bytes"], size
+
+	return run
+
+
+@case("catalog_build")
+def catalog_build(ctx: Context) -> Timed:
+	members = _bundle_members(ctx)
+	output = ctx.path(catalog.CATALOG_NAME)
+
+	def run():
+		catalog.build_catalog(output, ctx.db, {"public": members[1]})
+		return ctx.data["sql_bytes"] + members[1].stat().st_size, None
+
+	return run
+
+
+@case("catalog_search")
+def catalog_search(ctx: Context) -> Timed:
+	path = ctx.path(catalog.CATALOG_NAME)
+	if not path.exists():
+		catalog_build(ctx)()
+	names = [f"note-{index:06d}.txt" for index in range(1, CATALOG_LOOKUPS * 2, 2)]
+
+	def run():
+		for name in names:
+			catalog.search(path, file=name)
+		return None, None
+
+	return run
+
+
+@case("retention_plan")
+def retention_plan(ctx: Context) -> Timed:
+	# Planning over thousands of Backup Archive rows, as the nightly retention job does.
+	started = datetime.datetime(2025, 1, 1)
+	archives = [
+		{
+			"name": f"BAK-{index:06d}",
+			"created": started + datetime.timedelta(hours=index * 6),
+			"bytes": 1024 * 1024 * (100 + index % 50),
+			"valid": index % 20 != 0,
+			"previous": None,
+		}
+		for index in range(ctx.archives)
+	]
+
+	def run():
+		retention.plan(
+			archives, keep_last=3, keep_daily=7, keep_weekly=4, keep_monthly=12, max_total_bytes=10**12
+		)
+		return None, None
+
+	return run
+
+
+def _time_case(ctx: Context, name: str, repeat: int) -> Dict[str, Any]:
+	runs = []
+	sizes: tuple[Optional[int], Optional[int]] = (None, None)
+	for _ in range(repeat):
+		timed = CASES[name](ctx)
+		started = time.perf_counter()
+		sizes = timed()
+		runs.append(time.perf_counter() - started)
+	stats = phase_stats(name, min(runs), bytes_in=sizes[0], bytes_out=sizes[1])
+	del stats["phase"], stats["started_at"]
+	return {**stats, "median": round(statistics.median(runs), 3), "runs": [round(run, 3) for run in runs]}
+
+
+def run_benchmarks(
+	data_dir: Path,
+	params: Dict[str, Any],
+	*,
+	cases: Optional[list[str]] = None,
+	repeat: int = DEFAULT_REPEAT,
+	archives: int = DEFAULT_ARCHIVES,
+) -> Dict[str, Any]:
+	started = time.perf_counter()
+	data = synthetic.prepare(data_dir, params)
+	setup_seconds = time.perf_counter() - started
+	results = {}
+	with tempfile.TemporaryDirectory(prefix="backup-bench-", dir=data_dir) as work:
+		ctx = Context(data, Path(work), archives)
+		for name in cases or list(CASES):
+			print(f"[benchmarks] {name}", file=sys.stderr, flush=True)
+			results[name] = _time_case(ctx, name, repeat)
+	return {
+		"version": RESULT_VERSION,
+		"created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+		"host": {
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"cpus": os.cpu_count(),
+			"pigz": bool(shutil.which("pigz")),
+		},
+		"params": {**data["params"], "repeat": repeat, "archives": archives},
+		"setup_seconds": round(setup_seconds, 3),
+		"cases": results,
+	}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> tuple[list[str], bool]:
+	"""Report lines for the cases both runs have, and whether any got slower than `threshold`."""
+	lines = [f"{'case':<24} {'baseline':>10} {'current':>10} {'change':>8}"]
+	regressed = False
+	if baseline.get("params") != current.get("params"):
+		lines.append("warning: the runs used different parameters")
+	for name, old in baseline["cases"].items():
+		new = current["cases"].get(name)
+		if not new:
+			continue
+		change = new["seconds"] / old["seconds"] - 1 if old["seconds"] else 0.0
+		flag = ""
+		if change > threshold:
+			regressed = True
+			flag = "  REGRESSION"
+		lines.append(f"{name:<24} {old['seconds']:>9.3f}s {new['seconds']:>9.3f}s {change:>+7.1%}{flag}")
+	return lines, regressed
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m benchmarks")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	run = commands.add_parser("run", help="generate synthetic data and time every case")
+	run.add_argument("--data", type=Path, default=Path(tempfile.gettempdir()) / "backup-manager-bench")
+	run.add_argument("--output", type=Path, help="write the JSON results here instead of stdout")
+	run.add_argument("--case", action="append", dest="cases", choices=sorted(CASES))
+	run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+	run.add_argument("--archives", type=int, default=DEFAULT_ARCHIVES, help="rows for retention_plan")
+	for key, default in synthetic.DEFAULTS.items():
+		run.add_argument(f"--{key.replace('_', '-')}", type=int, dest=key, help=f"default {default}")
+
+	check = commands.add_parser("compare", help="compare two result files")
+	check.add_argument("baseline", type=Path)
+	check.add_argument("current", type=Path)
+	check.add_argument(
+		"--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown (0.1 = 10%%)"
+	)
+	args = parser.parse_args(argv)
+
+	if args.command == "run":
+		params = {key: getattr(args, key) for key in synthetic.DEFAULTS}
+		result = run_benchmarks(
+			args.data, params, cases=args.cases, repeat=args.repeat, archives=args.archives
+		)
+		text = json.dumps(result, indent=1)
+		if args.output:
+			args.output.write_text(text + "\n", encoding="utf-8")
+		else:
+			print(text)
+		return
+
+	lines, regressed = compare(
+		json.loads(args.baseline.read_text(encoding="utf-8")),
+		json.loads(args.current.read_text(encoding="utf-8")),
+		args.threshold,
+	)
+	print("\n".join(lines))
+	raise SystemExit(1 if regressed else 0)
@@ -0,0 +1,149 @@
+"""Synthetic site data: a files tree and a database dump of configurable size.
+
+Everything is generated from a seed, so runs with the same parameters benchmark the
+same bytes. Attachments mix compressible text with random bytes (images and PDFs
+barely compress); a few huge random files stand in for scans and videos. The dump
+is a ``.sql.gz`` laid out like ``mysqldump`` output: one ``DROP``/``CREATE``/
+``INSERT`` block per table, rows batched into multi-row ``INSERT`` statements.
+
+A data directory is reused while its ``params.json`` matches, since generating a
+large site takes longer than most of the benchmarks.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import random
+import shutil
+from pathlib import Path
+from typing import Any, Dict
+
+DEFAULTS: Dict[str, Any] = {
+	"seed": 1,
+	"small_files": 2000,
+	"small_max_kb": 64,
+	"huge_files": 2,
+	"huge_mb": 64,
+	"sql_mb": 128,
+	"tables": 20,
+}
+SITE_DIRNAME = "site"
+DUMP_NAME = "20250101_000000-bench_local-database.sql.gz"
+PARAMS_FILE = "params.json"
+FILES_PER_DIR = 100
+WRITE_CHUNK = 4 * 1024 * 1024
+ROWS_PER_INSERT = 500
+WORDS = (
+	"invoice customer supplier payment ledger stock warehouse item batch serial "
+	"account journal entry posting amount currency tax discount address contact "
+	"delivery note order quotation project task timesheet employee salary asset"
+).split()
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+	words = []
+	length = 0
+	while length < size:
+		word = rng.choice(WORDS)
+		words.append(word)
+		length += len(word) + 1
+	return " ".join(words).encode()[:size]
+
+
+def _write_random(path: Path, rng: random.Random, size: int) -> None:
+	with open(path, "wb") as handle:
+		while size > 0:
+			chunk = min(size, WRITE_CHUNK)
+			handle.write(rng.randbytes(chunk))
+			size -= chunk
+
+
+def write_files(site: Path, params: Dict[str, Any]) -> Dict[str, int]:
+	"""Fill ``public/files`` and ``private/files`` below `site`; returns bytes per root."""
+	rng = random.Random(params["seed"])
+	sizes = {"public": 0, "private": 0}
+	for index in range(params["small_files"]):
+		# Two thirds public, like the attachments of a typical site.
+		kind = "private" if index % 3 == 2 else "public"
+		directory = site / kind / "files" / f"batch{index // FILES_PER_DIR:04d}"
+		directory.mkdir(parents=True, exist_ok=True)
+		size = rng.randint(1, params["small_max_kb"] * 1024)
+		if index % 2:
+			(directory / f"note-{index:06d}.txt").write_bytes(_text(rng, size))
+		else:
+			(directory / f"scan-{index:06d}.pdf").write_bytes(rng.randbytes(size))
+		sizes[kind] += size
+	for index in range(params["huge_files"]):
+		kind = "private" if index % 2 else "public"
+		directory = site / kind / "files"
+		directory.mkdir(parents=True, exist_ok=True)
+		size = params["huge_mb"] * 1024 * 1024
+		_write_random(directory / f"huge-{index:02d}.bin", rng, size)
+		sizes[kind] += size
+	return sizes
+
+
+def write_dump(path: Path, params: Dict[str, Any]) -> Dict[str, Any]:
+	"""Write a gzip-compressed dump of about ``sql_mb`` MB of SQL; returns its tables and size."""
+	rng = random.Random(params["seed"])
+	# Row values come from a fixed pool; generating every row afresh would dominate setup.
+	notes = [_text(rng, rng.randint(20, 400)).decode() for _ in range(1000)]
+	per_table = params["sql_mb"] * 1024 * 1024 // params["tables"]
+	tables = []
+	written = 0
+	with gzip.open(path, "wb", compresslevel=1) as output:
+		output.write(b"/*!40101 SET NAMES utf8mb4 */;\n")
+		for number in range(params["tables"]):
+			table = f"tabBench {number:02d}"
+			ddl = (
+				f"DROP TABLE IF EXISTS `{table}`;\n"
+				f"CREATE TABLE `{table}` (\n"
+				"  `name` varchar(140) NOT NULL,\n"
+				"  `creation` datetime(6) DEFAULT NULL,\n"
+				"  `amount` decimal(21,9) NOT NULL DEFAULT 0.000000000,\n"
+				"  `notes` text DEFAULT NULL,\n"
+				"  PRIMARY KEY (`name`)\n"
+				") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;\n"
+			).encode()
+			output.write(ddl)
+			size = len(ddl)
+			rows = 0
+			while size < per_table:
+				values = []
+				for _ in range(ROWS_PER_INSERT):
+					rows += 1
+					values.append(
+						f"('BENCH-{number:02d}-{rows:08d}','2025-01-01 00:00:00.000000',"
+						f"{rng.randint(0, 10**7) / 100:.9f},'{rng.choice(notes)}')"
+					)
+				statement = f"INSERT INTO `{table}` VALUES {','.join(values)};\n".encode()
+				output.write(statement)
+				size += len(statement)
+			tables.append({"name": table, "rows": rows})
+			written += size
+	return {"tables": tables, "sql_bytes": written}
+
+
+def prepare(directory: Path, overrides: Dict[str, Any]) -> Dict[str, Any]:
+	"""Generate the data set in `directory`, or reuse it when it was made with the same parameters."""
+	params = {**DEFAULTS, **{key: value for key, value in overrides.items() if value is not None}}
+	params_path = directory / PARAMS_FILE
+	if params_path.exists():
+		recorded = json.loads(params_path.read_text(encoding="utf-8"))
+		if recorded["params"] == params:
+			return recorded
+		shutil.rmtree(directory)
+
+	directory.mkdir(parents=True, exist_ok=True)
+	site = directory / SITE_DIRNAME
+	db_path = directory / DUMP_NAME
+	recorded = {
+		"params": params,
+		"site": str(site),
+		"db": str(db_path),
+		"files": write_files(site, params),
+		**write_dump(db_path, params),
+	}
+	params_path.write_text(json.dumps(recorded, indent=1), encoding="utf-8")
+	return recorded
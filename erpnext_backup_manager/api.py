@@ -1,23 +1,213 @@
 from __future__ import annotations
 
+import base64
+import contextlib
+import contextvars
+import datetime
+import hashlib
+import itertools
+import json
+import mimetypes
 import os
+import re
 import shlex
 import shutil
+import signal
 import subprocess
-import zipfile
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zoneinfo
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional
 from urllib.parse import quote, urlparse
 
 import frappe
 from frappe import _
+from frappe.core.doctype.access_log.access_log import make_access_log
+from frappe.query_builder.functions import Count, Max, Sum
 from frappe.utils import get_bench_path, get_site_path, now_datetime
+from frappe.utils.background_jobs import get_job
 from frappe.utils.backups import new_backup
-from frappe.utils.response import download_backup
-
+from werkzeug.utils import send_file
+from werkzeug.wrappers import Response
+
+from erpnext_backup_manager import (
+	appstate,
+	catalog,
+	compression,
+	estimate,
+	metrics,
+	orchestrator,
+	replication,
+	retention,
+	schedule,
+	shadow,
+)
+from erpnext_backup_manager.bundle import BUNDLE_COMPRESSIONS, stream_bundle, write_bundle
+from erpnext_backup_manager.dump import (
+	DUMP_MANIFEST_SUFFIX,
+	connect,
+	dump_size,
+	is_dump_manifest,
+	iter_sql,
+	sql_name,
+	sql_size,
+	verify_dump,
+	wants_data,
+)
+from erpnext_backup_manager.filestore import (
+	MANIFEST_SUFFIX,
+	STORE_DIRNAME,
+	content_paths,
+	delta_tar_path,
+	incremental_snapshot,
+	is_manifest,
+	iter_tar,
+	missing_content,
+	read_manifest_header,
+	referenced_blobs,
+	snapshot_directory,
+	tar_name,
+)
+from erpnext_backup_manager.integrity import (
+	CHUNK_SIZE,
+	FileFollower,
+	HashingWriter,
+	copy_with_checksum,
+	file_checksum,
+	verify_checksum,
+)
+from erpnext_backup_manager.metrics import PhaseTimer
+from erpnext_backup_manager.restore_supervisor import (
+	READ_CHUNK_SIZE,
+	LogTail,
+	phase_command,
+	read_status,
+	status_path,
+	write_status,
+)
+from erpnext_backup_manager.selective import count_rows, drop_tables, load_tables, scratch_table
+from erpnext_backup_manager.transfer import place_file
 
 ARCHIVE_DIRNAME = "backup_manager/archive"
-ALLOWED_DB_EXTENSIONS = (".sql", ".sql.gz", ".gz")
+ALLOWED_DB_EXTENSIONS = (".sql", ".sql.gz", ".gz", ".sql.zst", ".zst")
+PROGRESS_CACHE_KEY = "backup_manager:progress"
+PROGRESS_TTL = 24 * 60 * 60
+DEFAULT_JOB_TIMEOUT = 6 * 60 * 60
+DEFAULT_BACKUP_WORKERS = 3
+DEFAULT_INCREMENTAL_FULL_EVERY = 7
+DEFAULT_VERIFY_RATE_MB = 20
+BACKUP_LOCK_KEY = "backup_manager:lock"
+# Lua compare-and-delete, so a holder whose lock expired cannot drop its successor's lock.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+	return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# Lua compare-and-extend; takes the lock back if it expired while the job was queued.
+RENEW_LOCK_SCRIPT = """
+local holder = redis.call("get", KEYS[1])
+if holder and holder ~= ARGV[1] then
+	return 0
+end
+redis.call("set", KEYS[1], ARGV[1], "EX", ARGV[3])
+redis.call("set", KEYS[2], ARGV[2], "EX", ARGV[3])
+return 1
+"""
+# A running backup renews its heartbeat and the lock every interval; both lapse after the TTL.
+HEARTBEAT_CACHE_KEY = "backup_manager:heartbeat"
+HEARTBEAT_INTERVAL = 60
+HEARTBEAT_TTL = 10 * 60
+DB_DUMP_SUFFIX = "-database.sql.gz"
+ARCHIVE_LIST_CACHE_KEY = "backup_manager:archive_list"
+DEFAULT_ARCHIVE_PAGE = 50
+MAX_ARCHIVE_PAGE = 200
+ARCHIVE_SORT_FIELDS = ("creation", "title", "status", "source", "db_size", "bundle_size")
+ARCHIVE_LIST_FIELDS = (
+	"name",
+	"title",
+	"source",
+	"status",
+	"creation",
+	"created_on",
+	"created_by",
+	"db_file_path",
+	"db_size",
+	"public_file_path",
+	"public_size",
+	"private_file_path",
+	"private_size",
+	"files_mode",
+	"db_dump_mode",
+	"verification_status",
+	"verified_on",
+	"bundle_file_path",
+	"bundle_size",
+	"config_file_path",
+	"restore_log_path",
+	"restore_phase",
+)
+# Realtime events for Backup Center, sent to the Backup Archive doctype room.
+ARCHIVE_EVENT = "backup_manager_archive"
+PROGRESS_EVENT = "backup_manager_progress"
+PROGRESS_PUSH_INTERVAL = 2
+SCHEDULE_STATE_KEY = "backup_manager:schedule"
+SCHEDULE_DEFAULTS = {
+	"max_load_per_cpu": 1.5,
+	"max_db_threads": 16,
+	"max_iowait": 25.0,
+	"retry_base": 5 * 60,
+	"retry_cap": 30 * 60,
+	"max_delay": 4 * 60 * 60,
+}
+RETENTION_RULES = ("keep_last", "keep_daily", "keep_weekly", "keep_monthly")
+TRASH_DIRNAME = ".trash"
+# Blobs younger than this may belong to a manifest that is still being written.
+STORE_GC_GRACE = 24 * 60 * 60
+ARCHIVE_SIZE_FIELDS = ("db_size", "public_size", "private_size", "bundle_size", "files_stored_size")
+RESTORE_ENGINES = ("bench", "fast", "shadow")
+UPLOADS_DIRNAME = ".uploads"
+UPLOAD_STATE_FILE = "upload.json"
+UPLOAD_KINDS = ("db", "public", "private")
+UPLOAD_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# Chunked uploads left unfinished this long are removed by the daily cleanup.
+STALE_UPLOAD_AGE = 2 * 24 * 60 * 60
+FILE_BACKUP_MODES = {"tar": "Full", "dedup": "Deduplicated", "incremental": "Incremental"}
+DB_DUMP_MODES = {"single": "Single File", "tables": "Per Table"}
+DEFAULT_DUMP_WORKERS = 8
+SELECTIVE_DIRNAME = ".selective"
+SELECTIVE_ID_PATTERN = re.compile(r"[0-9a-f]{10}")
+SELECTIVE_TARGETS = ("scratch", "live")
+SELECTIVE_RUNNING_STATES = ("Queued", "Loading", "Applying")
+REPLICATION_STATE_DIRNAME = ".replication"
+DEFAULT_REPLICATION_ATTEMPTS = 5
+# Archives this recent are picked up by the hourly job when a target has no copy yet.
+REPLICATION_CATCHUP_DAYS = 7
+# Seconds between progress writes to the Backup Archive while replicating.
+REPLICATION_PROGRESS_INTERVAL = 10
+# What happens to rows whose primary or unique key already exists in the live table.
+CONFLICT_POLICIES = {"skip": "INSERT IGNORE", "overwrite": "REPLACE", "fail": "INSERT"}
+FILTER_OPERATORS = ("=", "!=", "<", ">", "<=", ">=", "in", "not in", "like", "not like", "between", "is")
+PHASE_METRIC_FIELDS = ("seconds", "bytes_in", "bytes_out", "mb_per_sec", "compression_ratio")
+DEFAULT_METRICS_HISTORY = 30
+# Most recent phase rows scanned for the latest record of every phase.
+METRICS_PHASE_ROWS = 500
+# Cached size index of the site's file trees, used by the backup size estimate.
+ESTIMATE_DIRNAME = ".estimate"
+DEFAULT_DISK_RESERVE_MB = 1024
+# Kept in the sites folder: the bench-wide schedule belongs to no single site.
+BENCH_SCHEDULE_STATE_FILE = ".backup_manager_bench_schedule.json"
+# Kept in the database (tabDefaultValue), so every dump carries the code it was migrated to.
+MIGRATED_CODE_KEY = "backup_manager_migrated_code"
+RESTORE_MIGRATE_MODES = ("auto", "always")
+# Set while a retention run waits for a backup or restore to finish.
+RETENTION_PENDING_KEY = "backup_manager_retention_pending"
 
 
 def _ensure_system_manager() -> None:
@@ -71,6 +261,200 @@ def _file_size(path: Optional[Path]) -> int:
 	return int(path.stat().st_size)
 
 
+def _component_size(path: Optional[Path]) -> int:
+	"""Logical size of a backup component; manifests report the size of the files they list."""
+	if is_manifest(path) and path.exists():
+		return int(read_manifest_header(path).get("bytes") or 0)
+	if is_dump_manifest(path) and path.exists():
+		return dump_size(path)
+	return _file_size(path)
+
+
+def _stored_size(path: Optional[Path]) -> int:
+	"""Bytes a backup component added to disk."""
+	if is_manifest(path) and path.exists():
+		header = read_manifest_header(path)
+		if header.get("kind") == "incremental":
+			return _file_size(delta_tar_path(path)) + _file_size(path)
+		return int(header.get("new_bytes") or 0) + _file_size(path)
+	if is_dump_manifest(path) and path.exists():
+		return dump_size(path) + _file_size(path)
+	return _file_size(path)
+
+
+def _dir_size(path: Optional[Path]) -> int:
+	if not path or not path.is_dir():
+		return 0
+	total = 0
+	with os.scandir(path) as entries:
+		for entry in entries:
+			if entry.is_file(follow_symlinks=False):
+				total += entry.stat(follow_symlinks=False).st_size
+			elif entry.is_dir(follow_symlinks=False):
+				# Per-table dumps keep their table files in a subdirectory.
+				total += _dir_size(Path(entry.path))
+	return total
+
+
+def _cache():
+	# `frappe.cache` is an object on v15+ and a factory function on older releases.
+	cache = frappe.cache
+	return cache if hasattr(cache, "get_value") else cache()
+
+
+def _progress_key(archive_name: str) -> str:
+	return f"{PROGRESS_CACHE_KEY}:{archive_name}"
+
+
+def _get_progress(archive_name: str) -> Optional[Dict[str, Any]]:
+	return _cache().get_value(_progress_key(archive_name))
+
+
+def _set_progress(archive_name: str, **values: Any) -> Dict[str, Any]:
+	progress = _get_progress(archive_name) or {}
+	progress.update(values)
+	progress["updated_at"] = time.time()
+	_cache().set_value(_progress_key(archive_name), progress, expires_in_sec=PROGRESS_TTL)
+	return progress
+
+
+class BackupLockedError(frappe.ValidationError):
+	pass
+
+
+class InsufficientSpaceError(frappe.ValidationError):
+	pass
+
+
+class BackupStoppedError(Exception):
+	"""Raised in a bench-wide site backup when the orchestrator stops it."""
+
+
+def _lock_key(suffix: str = "") -> str:
+	return _cache().make_key(BACKUP_LOCK_KEY + suffix)
+
+
+def _backup_lock_holder() -> Optional[str]:
+	owner = _cache().get(_lock_key(":owner"))
+	return owner.decode() if isinstance(owner, bytes) else owner
+
+
+def _acquire_backup_lock(owner: str, ttl: int) -> str:
+	"""Take the site-wide lock that keeps backups and restores from overlapping.
+
+	The lock expires after `ttl` seconds so a crashed worker cannot hold it forever.
+	"""
+	token = frappe.generate_hash(length=16)
+	if not _cache().set(_lock_key(), token, nx=True, ex=ttl):
+		frappe.throw(
+			_("Another backup or restore is running: {0}.").format(_backup_lock_holder() or _("unknown")),
+			BackupLockedError,
+		)
+	# Informational only, for the error above and the schedule status.
+	_cache().set(_lock_key(":owner"), owner, ex=ttl)
+	return token
+
+
+def _release_backup_lock(token: Optional[str]) -> None:
+	if token and _cache().eval(RELEASE_LOCK_SCRIPT, 1, _lock_key(), token):
+		_cache().delete(_lock_key(":owner"))
+
+
+def _renew_backup_lock(token: str, owner: str, ttl: int) -> bool:
+	"""Extend the lock `token` holds to `ttl` seconds; False if another holder has it."""
+	return bool(_cache().eval(RENEW_LOCK_SCRIPT, 2, _lock_key(), _lock_key(":owner"), token, owner, ttl))
+
+
+def _heartbeat_key(archive_name: str) -> str:
+	return _cache().make_key(f"{HEARTBEAT_CACHE_KEY}:{archive_name}")
+
+
+@contextlib.contextmanager
+def _backup_heartbeat(archive_name: str, lock_token: Optional[str], owner: str) -> Iterator[None]:
+	"""Renew the archive's heartbeat and the backup lock every minute while the block runs.
+
+	The lock cannot expire under a backup that runs long, yet lapses soon after its process
+	dies; the heartbeat tells `fail_interrupted_backups` the process is still there.
+	"""
+
+	def beat() -> bool:
+		_cache().set(_heartbeat_key(archive_name), time.time(), ex=HEARTBEAT_TTL)
+		return not lock_token or _renew_backup_lock(lock_token, owner, HEARTBEAT_TTL)
+
+	if not beat():
+		# The lock expired while the job was queued and another backup or restore took it.
+		frappe.throw(
+			_("Another backup or restore is running: {0}.").format(_backup_lock_holder() or _("unknown")),
+			BackupLockedError,
+		)
+	stop = threading.Event()
+
+	def run() -> None:
+		while not stop.wait(HEARTBEAT_INTERVAL):
+			try:
+				beat()
+			except Exception:
+				# A missed beat only matters if they stop for HEARTBEAT_TTL.
+				pass
+
+	# frappe.local lives in context variables; the copy gives the thread the site.
+	thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+	thread.start()
+	try:
+		yield
+	finally:
+		stop.set()
+		thread.join()
+		_cache().delete(_heartbeat_key(archive_name))
+
+
+def release_backup_lock(token: str) -> None:
+	"""Called by the restore script (`bench execute`) once it has finished."""
+	_release_backup_lock(token)
+
+
+def _job_timeout() -> int:
+	return int(frappe.conf.get("backup_manager_job_timeout") or DEFAULT_JOB_TIMEOUT)
+
+
+def _restore_lock_ttl() -> int:
+	return int(frappe.conf.get("backup_manager_restore_lock_ttl") or DEFAULT_JOB_TIMEOUT)
+
+
+def clear_archive_list_cache() -> None:
+	_cache().delete_value(ARCHIVE_LIST_CACHE_KEY)
+
+
+def _publish_archive_event(op: str, name: str, values: Dict[str, Any], after_commit: bool = True) -> None:
+	"""Send one archive row change ("insert", "update" or "delete") to open Backup Centers.
+
+	Pages patch that row instead of listing every archive again. The archive totals come
+	along when the change affects them.
+	"""
+	message = {"op": op, "name": name, "values": values}
+	if op != "update" or any(field in values for field in ARCHIVE_SIZE_FIELDS):
+		message["totals"] = _archive_totals([])
+	frappe.publish_realtime(ARCHIVE_EVENT, message, doctype="Backup Archive", after_commit=after_commit)
+
+
+def publish_archive_change(doc: frappe.model.document.Document, removed: bool = False) -> None:
+	"""Publish the list fields of `doc` that changed in this save; called by its controller.
+
+	Rows changed with `frappe.db.set_value` or deleted in bulk skip the controller and
+	call `_publish_archive_event` themselves.
+	"""
+	if removed:
+		_publish_archive_event("delete", doc.name, {})
+		return
+	before = doc.get_doc_before_save()
+	if before is None:
+		_publish_archive_event("insert", doc.name, {field: doc.get(field) for field in ARCHIVE_LIST_FIELDS})
+		return
+	values = {field: doc.get(field) for field in ARCHIVE_LIST_FIELDS if doc.get(field) != before.get(field)}
+	if values:
+		_publish_archive_event("update", doc.name, values)
+
+
 def _download_url(rel_path: Optional[str]) -> Optional[str]:
 	if not rel_path:
 		return None
@@ -79,12 +463,90 @@ def _download_url(rel_path: Optional[str]) -> Optional[str]:
 	)
 
 
-def _build_bundle(bundle_path: Path, files: list[Optional[Path]]) -> None:
-	with zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_DEFLATED) as bundle:
-		for file_path in files:
-			if not file_path or not file_path.exists():
-				continue
-			bundle.write(file_path, arcname=file_path.name)
+def _bundle_streamed() -> bool:
+	return (frappe.conf.get("backup_manager_bundle_mode") or "file") == "stream"
+
+
+def _bundle_options() -> Dict[str, Any]:
+	compression = frappe.conf.get("backup_manager_bundle_compression") or "auto"
+	if compression not in BUNDLE_COMPRESSIONS:
+		frappe.throw(
+			_("Unsupported bundle compression {0}.").format(compression),
+			frappe.ValidationError,
+		)
+	return {
+		"compression": compression,
+		"compresslevel": int(frappe.conf.get("backup_manager_bundle_compresslevel") or 1),
+	}
+
+
+def _build_bundle(bundle_path: Path, files: Iterable[Optional[Path]]) -> Dict[str, Any]:
+	return write_bundle(bundle_path, files, **_bundle_options())
+
+
+def _bundle_download_url(
+	archive_name: str,
+	bundle_file_path: Optional[str],
+	files_mode: Optional[str] = None,
+	db_dump_mode: Optional[str] = None,
+) -> Optional[str]:
+	if bundle_file_path:
+		return _download_url(bundle_file_path)
+	single_files = files_mode in (None, FILE_BACKUP_MODES["tar"]) and db_dump_mode != DB_DUMP_MODES["tables"]
+	if not _bundle_streamed() and single_files:
+		return None
+	return frappe.utils.get_url(
+		f"/api/method/erpnext_backup_manager.api.download_archive_bundle?archive_name={quote(archive_name)}"
+	)
+
+
+def _set_archive_files(
+	doc: frappe.model.document.Document,
+	*,
+	db_path: Optional[Path],
+	public_path: Optional[Path],
+	private_path: Optional[Path],
+	bundle_path: Optional[Path],
+	config_path: Optional[Path],
+) -> None:
+	doc.db_file_path = _to_private_relative(db_path)
+	doc.db_size = _component_size(db_path)
+	doc.public_file_path = _to_private_relative(public_path)
+	doc.public_size = _component_size(public_path)
+	doc.private_file_path = _to_private_relative(private_path)
+	doc.private_size = _component_size(private_path)
+	doc.bundle_file_path = _to_private_relative(bundle_path)
+	doc.bundle_size = _file_size(bundle_path)
+	doc.config_file_path = _to_private_relative(config_path)
+
+
+def _timestamp_datetime(value: Optional[float]) -> Optional[datetime.datetime]:
+	"""A Unix timestamp as a naive datetime in the system time zone, like `now_datetime()`."""
+	if value is None:
+		return None
+	moment = datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+	return frappe.utils.convert_utc_to_system_timezone(moment).replace(tzinfo=None)
+
+
+def _add_phase_rows(
+	doc: frappe.model.document.Document, operation: str, phases: Iterable[Dict[str, Any]]
+) -> None:
+	"""Append phase records (see `metrics.phase_stats`) to the archive's Phases table."""
+	for stats in sorted(phases, key=lambda stats: stats["started_at"] or 0):
+		doc.append(
+			"phases",
+			{
+				"operation": operation,
+				"phase": stats["phase"],
+				"started_on": _timestamp_datetime(stats["started_at"]),
+				**{field: stats[field] for field in PHASE_METRIC_FIELDS},
+			},
+		)
+
+
+def _datetime_timestamp(value: datetime.datetime) -> float:
+	"""Inverse of `_timestamp_datetime`."""
+	return value.replace(tzinfo=zoneinfo.ZoneInfo(frappe.utils.get_system_timezone())).timestamp()
 
 
 def _create_archive_record(
@@ -99,6 +561,8 @@ def _create_archive_record(
 	config_path: Optional[Path],
 	restore_log_path: Optional[Path] = None,
 	notes: Optional[str] = None,
+	checksums: Optional[Dict[str, Any]] = None,
+	phases: Optional[list[Dict[str, Any]]] = None,
 ) -> frappe.model.document.Document:
 	doc = frappe.new_doc("Backup Archive")
 	doc.title = title
@@ -106,18 +570,26 @@ def _create_archive_record(
 	doc.status = status
 	doc.created_on = now_datetime()
 	doc.created_by = frappe.session.user
-	doc.db_file_path = _to_private_relative(db_path)
-	doc.db_size = _file_size(db_path)
-	doc.public_file_path = _to_private_relative(public_path)
-	doc.public_size = _file_size(public_path)
-	doc.private_file_path = _to_private_relative(private_path)
-	doc.private_size = _file_size(private_path)
-	doc.bundle_file_path = _to_private_relative(bundle_path)
-	doc.bundle_size = _file_size(bundle_path)
-	doc.config_file_path = _to_private_relative(config_path)
+	_set_archive_files(
+		doc,
+		db_path=db_path,
+		public_path=public_path,
+		private_path=private_path,
+		bundle_path=bundle_path,
+		config_path=config_path,
+	)
 	doc.restore_log_path = _to_private_relative(restore_log_path)
+	# Uploaded files carry their codec in their names.
+	if db_path and not is_dump_manifest(db_path):
+		doc.db_compression = compression.format_of(db_path)
+	if public_path and not is_manifest(public_path):
+		doc.files_compression = compression.format_of(public_path)
+	if checksums:
+		doc.checksums = json.dumps(checksums)
 	if notes:
 		doc.notes = notes
+	if phases:
+		_add_phase_rows(doc, "Restore", phases)
 	doc.insert(ignore_permissions=True)
 	frappe.db.commit()
 	return doc
@@ -126,9 +598,11 @@ def _create_archive_record(
 def _validate_db_file(path: Path) -> None:
 	if not path.exists():
 		frappe.throw(_("Database backup file not found."), frappe.ValidationError)
+	if is_dump_manifest(path):
+		return
 	lowered = path.name.lower()
 	if not any(lowered.endswith(ext) for ext in ALLOWED_DB_EXTENSIONS):
-		frappe.throw(_("Database backup must be a .sql or .sql.gz file."), frappe.ValidationError)
+		frappe.throw(_("Database backup must be a .sql, .sql.gz or .sql.zst file."), frappe.ValidationError)
 
 
 def _resolve_uploaded_file(file_url: str) -> Path:
@@ -149,11 +623,46 @@ def _resolve_uploaded_file(file_url: str) -> Path:
 	return abs_path
 
 
-def _copy_to_archive(source_path: Path, target_dir: Path) -> Path:
+def _import_to_archive(
+	source_path: Path, target_dir: Path, move: bool = False
+) -> tuple[Path, Dict[str, Any], str]:
+	"""Put an uploaded file into the archive, by rename/hardlink/reflink where the filesystem allows.
+
+	Only when none of those work are the bytes copied, hashing them on the way; otherwise
+	the placed file is hashed with a read pass, which needs no extra disk space. Returns
+	the archive path, its checksum and the method used.
+	"""
 	target_dir.mkdir(parents=True, exist_ok=True)
 	destination = target_dir / source_path.name
-	shutil.copy2(source_path, destination)
-	return destination
+	method = place_file(source_path, destination, move=move)
+	if method:
+		checksum = file_checksum(destination, check_gzip=True)
+	else:
+		method = "copy"
+		checksum = copy_with_checksum(source_path, destination)
+	if method in ("copy", "reflink", "copy_range"):
+		shutil.copystat(source_path, destination)
+	if checksum.get("error"):
+		if method == "rename":
+			os.rename(destination, source_path)
+		else:
+			destination.unlink()
+		frappe.throw(
+			_("Uploaded file {0} is damaged: {1}").format(source_path.name, checksum["error"]),
+			frappe.ValidationError,
+		)
+	return destination, checksum, method
+
+
+def _decompress_command(source: Path, output: Path) -> list[str]:
+	return [
+		sys.executable,
+		"-m",
+		"erpnext_backup_manager.compression",
+		"decompress",
+		str(source),
+		str(output),
+	]
 
 
 def _build_restore_script(
@@ -168,29 +677,157 @@ def _build_restore_script(
 	db_root_password: Optional[str],
 	admin_password: Optional[str],
 	script_path: Path,
+	archive_root: Optional[Path] = None,
+	release_lock_cmd: Optional[list[str]] = None,
+	engine: str = "bench",
+	shadow_state_path: Optional[Path] = None,
+	read_only: bool = False,
+	migrate: bool = True,
+	migrate_reason: Optional[str] = None,
 ) -> None:
-	restore_cmd = [
-		bench_cmd,
-		"--site",
-		site,
-		"restore",
-		str(db_path),
-		"--force",
-	]
+	# Deduplicated and incremental file backups are rebuilt into full tars before
+	# maintenance mode starts.
+	prepare_cmds = []
+	staged_files = []
+	file_tars = []
+	for option, path in (("--with-public-files", public_path), ("--with-private-files", private_path)):
+		if not path:
+			continue
+		if is_manifest(path):
+			tar_path = script_path.with_name(f"{script_path.stem}-{tar_name(path)}")
+			prepare_cmds.append(
+				[
+					sys.executable,
+					"-m",
+					"erpnext_backup_manager.filestore",
+					"build-tar",
+					str(path),
+					str(archive_root),
+					str(tar_path),
+				]
+			)
+			staged_files.append(str(tar_path))
+			path = tar_path
+		elif engine == "bench" and compression.format_of(path) == "zstd":
+			# `bench restore` extracts .tar and .tgz only.
+			tar_path = script_path.with_name(f"{script_path.stem}-{path.name.removesuffix('.zst')}")
+			prepare_cmds.append(_decompress_command(path, tar_path))
+			staged_files.append(str(tar_path))
+			path = tar_path
+		file_tars.append((option, path))
+
+	if engine == "bench" and is_dump_manifest(db_path):
+		# `bench restore` wants one file; the table files concatenate into a valid .sql.gz
+		# (or plain .sql), while Zstandard tables are unpacked since bench cannot read them.
+		plain = compression.format_of(Path(sql_name(db_path))) == "zstd"
+		sql_path = script_path.with_name(f"{script_path.stem}-{sql_name(db_path, plain)}")
+		prepare_cmds.append(
+			[
+				sys.executable,
+				"-m",
+				"erpnext_backup_manager.dump",
+				"build-sql",
+				str(db_path),
+				str(sql_path),
+				*(["--plain"] if plain else []),
+			]
+		)
+		staged_files.append(str(sql_path))
+		db_path = sql_path
+	elif engine == "bench" and compression.format_of(db_path) == "zstd":
+		sql_path = script_path.with_name(f"{script_path.stem}-{db_path.name.removesuffix('.zst')}")
+		prepare_cmds.append(_decompress_command(db_path, sql_path))
+		staged_files.append(str(sql_path))
+		db_path = sql_path
+
+	credentials = []
 	if db_root_username:
-		restore_cmd.extend(["--db-root-username", db_root_username])
+		credentials.extend(["--db-root-username", db_root_username])
 	if db_root_password:
-		restore_cmd.extend(["--db-root-password", db_root_password])
-	if admin_password:
-		restore_cmd.extend(["--admin-password", admin_password])
-	if public_path:
-		restore_cmd.extend(["--with-public-files", str(public_path)])
-	if private_path:
-		restore_cmd.extend(["--with-private-files", str(private_path)])
+		credentials.extend(["--db-root-password", db_root_password])
+
+	# The shadow engine restores into a new database and a staging folder through a
+	# temporary site, and only takes the site down to switch over.
+	target_site = site
+	engine_args = []
+	shadow_cmds: Dict[str, list[str]] = {}
+	if engine == "shadow":
+		state = shadow.read_state(shadow_state_path)
+		target_site = os.path.basename(state["shadow_site_path"])
+		engine_args = ["--db-name", state["shadow_db"], "--files-dir", state["staging_dir"]]
+		shadow_cmds = {
+			command: [
+				sys.executable,
+				"-m",
+				"erpnext_backup_manager.shadow",
+				command,
+				"--state",
+				str(shadow_state_path),
+			]
+			for command in ("prepare", "swap", "abort")
+		}
+
+	if engine in ("fast", "shadow"):
+		restore_cmds = [
+			*([shadow_cmds["prepare"]] if shadow_cmds else []),
+			[
+				sys.executable,
+				"-m",
+				"erpnext_backup_manager.restore_engine",
+				"--site-path",
+				os.path.join(bench_path, "sites", site),
+				"--db",
+				str(db_path),
+				*itertools.chain.from_iterable(("--files", str(path)) for _option, path in file_tars),
+				*credentials,
+				*engine_args,
+			],
+			# The rest of what `bench restore` does once the data is in place.
+			[bench_cmd, "--site", target_site, "execute", "frappe.installer.remove_missing_apps"],
+		]
+		if admin_password:
+			restore_cmds.append([bench_cmd, "--site", target_site, "set-admin-password", admin_password])
+	else:
+		restore_cmd = [bench_cmd, "--site", site, "restore", str(db_path), "--force", *credentials]
+		if admin_password:
+			restore_cmd.extend(["--admin-password", admin_password])
+		for option, path in file_tars:
+			restore_cmd.extend([option, str(path)])
+		restore_cmds = [restore_cmd]
 
 	maintenance_on = [bench_cmd, "--site", site, "set-maintenance-mode", "on"]
 	maintenance_off = [bench_cmd, "--site", site, "set-maintenance-mode", "off"]
-	migrate_cmd = [bench_cmd, "--site", site, "migrate"]
+	migrate_cmd = [bench_cmd, "--site", target_site, "migrate"]
+	reads_cmd = [bench_cmd, "--site", site, "set-config", "-p", "allow_reads_during_maintenance"]
+	read_only = read_only and engine == "shadow"
+	# Without a migrate, only what it does for the restored content is left: the cache and
+	# the website search index.
+	migrate_phases = [("migrate", [migrate_cmd])] if migrate else []
+	search_index_cmd = [bench_cmd, "--site", site, "execute", "erpnext_backup_manager.api.queue_search_index"]
+	index_cmds = [] if migrate else [search_index_cmd]
+
+	if engine == "shadow":
+		phases = [
+			# Read-only mode (maintenance that still serves reads) keeps writes from being
+			# made to a database that is about to be replaced.
+			("restore", [*([[*reads_cmd, "1"], maintenance_on] if read_only else []), *restore_cmds]),
+			*migrate_phases,
+			# Lock and cache keys are prefixed with the database name, so the lock is released
+			# while the site still runs on the database it was taken in.
+			("maintenance", [maintenance_on, *([release_lock_cmd] if release_lock_cmd else [])]),
+			("swap", [shadow_cmds["swap"], [bench_cmd, "--site", site, "clear-cache"]]),
+			("finalize", [maintenance_off, *([[*reads_cmd, "0"]] if read_only else []), *index_cmds]),
+		]
+	else:
+		clear_cache = [] if migrate else [[bench_cmd, "--site", site, "clear-cache"]]
+		phases = [
+			("maintenance", [maintenance_on]),
+			("restore", restore_cmds),
+			*migrate_phases,
+			("finalize", [*clear_cache, maintenance_off, *index_cmds]),
+		]
+	if prepare_cmds:
+		phases.insert(0, ("prepare", prepare_cmds))
 
 	lines = [
 		"#!/usr/bin/env bash",
@@ -198,18 +835,124 @@ def _build_restore_script(
 		f"cd {shlex.quote(bench_path)}",
 		"cleanup() {",
 		f"  {shlex.join(maintenance_off)} || true",
+		*([f"  {shlex.join(shadow_cmds['abort'])} || true"] if shadow_cmds else []),
+		*([f"  {shlex.join([*reads_cmd, '0'])} || true"] if read_only else []),
+		*([f"  rm -f {shlex.join(staged_files)}"] if staged_files else []),
+		*([f"  {shlex.join(release_lock_cmd)} || true"] if release_lock_cmd else []),
 		"}",
 		"trap cleanup EXIT",
-		shlex.join(maintenance_on),
-		shlex.join(restore_cmd),
-		shlex.join(migrate_cmd),
-		shlex.join(maintenance_off),
 	]
+	if migrate_reason:
+		decision = "running migrate" if migrate else "skipping migrate"
+		lines.append(f"echo {shlex.quote(f'[restore] {decision}: {migrate_reason}')}")
+	for phase, cmds in phases:
+		# The markers are picked up from the log by the restore supervisor.
+		lines.append(phase_command(phase))
+		lines.extend(shlex.join(cmd) for cmd in cmds)
 
 	script_path.write_text("\n".join(lines), encoding="utf-8")
 	os.chmod(script_path, 0o700)
 
 
+def _verify_rate() -> int:
+	"""Read budget of the background verifier in bytes per second."""
+	return int(
+		float(frappe.conf.get("backup_manager_verify_rate_mb") or DEFAULT_VERIFY_RATE_MB) * 1024 * 1024
+	)
+
+
+def _archive_components(doc: frappe.model.document.Document) -> Dict[str, Path]:
+	paths = {
+		"db": doc.db_file_path,
+		"public": doc.public_file_path,
+		"private": doc.private_file_path,
+		"bundle": doc.bundle_file_path,
+		"config": doc.config_file_path,
+	}
+	return {component: _private_abs(path) for component, path in paths.items() if path}
+
+
+def _verify_archive(doc: frappe.model.document.Document, rate: Optional[int] = None) -> list[str]:
+	"""Re-hash every artifact of `doc` against its recorded checksum and store the outcome.
+
+	Archives written before checksums were recorded get them on their first verification.
+	"""
+	recorded = frappe.parse_json(doc.checksums) if doc.checksums else {}
+	archive_root = _archive_root()
+	errors = []
+	for component, path in _archive_components(doc).items():
+		expected = recorded.get(component)
+		if expected:
+			problem = verify_checksum(path, expected, rate)
+		elif not path.exists():
+			problem = f"{path.name}: file is missing"
+		else:
+			actual = file_checksum(path, rate, check_gzip=True)
+			problem = f"{path.name}: {actual['error']}" if actual.get("error") else None
+			if not problem:
+				recorded[component] = {key: value for key, value in actual.items() if key != "error"}
+		if problem:
+			errors.append(problem)
+			continue
+
+		if is_manifest(path):
+			tar_checksum = read_manifest_header(path).get("tar_checksum")
+			if tar_checksum:
+				problem = verify_checksum(delta_tar_path(path), tar_checksum, rate)
+				if problem:
+					errors.append(problem)
+			missing = missing_content(path, archive_root)
+			if missing:
+				errors.append(f"{path.name}: {len(missing)} stored items are missing")
+		elif is_dump_manifest(path):
+			errors.extend(verify_dump(path, rate))
+
+	doc.checksums = json.dumps(recorded)
+	doc.verification_status = "Failed" if errors else "Verified"
+	doc.verified_on = now_datetime()
+	doc.verification_notes = "\n".join(errors)
+	doc.save(ignore_permissions=True)
+	frappe.db.commit()
+	return errors
+
+
+def _ensure_archive_intact(doc: frappe.model.document.Document, timer: Optional[PhaseTimer] = None) -> None:
+	if frappe.conf.get("backup_manager_verify_before_restore", 1):
+		with (timer or PhaseTimer()).measure("checksum") as sizes:
+			errors = _verify_archive(doc)
+			sizes["bytes_in"] = sum(_stored_size(path) for path in _archive_components(doc).values())
+	elif doc.verification_status == "Failed":
+		errors = (doc.verification_notes or "").splitlines()
+	else:
+		return
+	if errors:
+		frappe.throw(
+			_("Archive {0} failed verification: {1}").format(doc.name, "; ".join(errors[:3])),
+			frappe.ValidationError,
+		)
+
+
+def _restore_engine(requested: Optional[str] = None) -> str:
+	engine = requested or frappe.conf.get("backup_manager_restore_engine") or "bench"
+	if engine not in RESTORE_ENGINES:
+		frappe.throw(
+			_("Restore engine must be one of: {0}").format(", ".join(RESTORE_ENGINES)),
+			frappe.ValidationError,
+		)
+	if engine == "fast" and frappe.conf.db_type == "postgres":
+		frappe.throw(_("The fast restore engine supports MariaDB sites only."), frappe.ValidationError)
+	if engine == "shadow" and frappe.conf.db_type == "postgres":
+		frappe.throw(_("The shadow restore engine supports MariaDB sites only."), frappe.ValidationError)
+	return engine
+
+
+def _bench_command() -> str:
+	bench_cmd = shutil.which("bench") or os.path.join(get_bench_path(), "env", "bin", "bench")
+	if not os.path.exists(bench_cmd):
+		frappe.throw(_("Bench command not found in PATH."), frappe.ValidationError)
+	return bench_cmd
+
+
 def _start_restore(
 	*,
 	archive_doc: frappe.model.document.Document,
@@ -219,202 +962,2568 @@ def _start_restore(
 	db_root_username: Optional[str],
 	db_root_password: Optional[str],
 	admin_password: Optional[str],
+	verify: bool = True,
+	restore_engine: Optional[str] = None,
 ) -> Dict[str, Any]:
 	_validate_db_file(db_path)
+	engine = _restore_engine(restore_engine)
+	if engine == "shadow" and not (db_root_password or frappe.conf.get("root_password")):
+		frappe.throw(
+			_("The shadow restore engine needs the database root password to create the new database."),
+			frappe.ValidationError,
+		)
+	# Decided against the live site before the pre-restore backup or the restore change anything.
+	migrate, migrate_reason = _restore_migrate(archive_doc)
+	# Held until the restore script exits; its cleanup trap releases it.
+	lock_token = _acquire_backup_lock(f"restore of {archive_doc.name}", _restore_lock_ttl())
+	previous_status = archive_doc.status
+	try:
+		if verify:
+			# Checked before the pre-restore backup and maintenance mode, so a bad archive
+			# leaves the site untouched.
+			timer = PhaseTimer()
+			_ensure_archive_intact(archive_doc, timer)
+			# Saved with the "Restoring" status below.
+			_add_phase_rows(archive_doc, "Restore", timer.phases)
+
+		# The pre-restore backup and the restore script both need room; checked together so
+		# a full disk stops the restore before the site is touched.
+		pre_bundle, pre_notes = _check_backup_space(
+			True,
+			True,
+			extra_needs=_restore_space_needs(archive_doc, db_path, public_path, private_path, engine),
+		)
+		# The pre-restore snapshot must be complete before the restore script runs, so it is
+		# taken in-process rather than through the background queue.
+		pre_backup, pre_backup_dir = _prepare_backup(
+			f"Pre-restore backup ({archive_doc.name})", "Pre-Restore", pre_notes
+		)
+		try:
+			_run_backup(pre_backup, pre_backup_dir, include_files=True, bundle=pre_bundle)
+		except Exception as exc:
+			_mark_backup_failed(pre_backup.name, exc)
+			raise
+
+		bench_path = get_bench_path()
+		bench_cmd = _bench_command()
+
+		backup_dir = _private_abs(archive_doc.db_file_path).parent
+		started = now_datetime()
+		timestamp = started.strftime("%Y%m%d_%H%M%S")
+		log_path = backup_dir / f"restore_{timestamp}.log"
+		script_path = backup_dir / f"restore_{timestamp}.sh"
+		shadow_state_path = None
+		if engine == "shadow":
+			shadow_state_path = shadow.state_path(log_path)
+			shadow.write_state(
+				shadow_state_path,
+				shadow.new_state(
+					Path(get_site_path()).resolve(), frappe.conf, started.strftime("%Y%m%d%H%M%S")
+				),
+			)
+
+		_build_restore_script(
+			bench_path=bench_path,
+			bench_cmd=bench_cmd,
+			site=frappe.local.site,
+			db_path=db_path,
+			public_path=public_path,
+			private_path=private_path,
+			db_root_username=db_root_username,
+			db_root_password=db_root_password,
+			admin_password=admin_password,
+			script_path=script_path,
+			archive_root=_archive_root(),
+			engine=engine,
+			shadow_state_path=shadow_state_path,
+			read_only=bool(int(frappe.conf.get("backup_manager_shadow_read_only") or 0)),
+			migrate=migrate,
+			migrate_reason=migrate_reason,
+			release_lock_cmd=[
+				bench_cmd,
+				"--site",
+				frappe.local.site,
+				"execute",
+				"erpnext_backup_manager.api.release_backup_lock",
+				"--kwargs",
+				json.dumps({"token": lock_token}),
+			],
+		)
 
-	pre_backup = create_backup(
-		label=f"Pre-restore backup ({archive_doc.name})",
-		include_files=1,
-		bundle=1,
-		source="Pre-Restore",
-	)
-
-	bench_path = get_bench_path()
-	bench_cmd = shutil.which("bench")
-	if not bench_cmd:
-		bench_cmd = os.path.join(bench_path, "env", "bin", "bench")
-	if not os.path.exists(bench_cmd):
-		frappe.throw(_("Bench command not found in PATH."), frappe.ValidationError)
-
-	backup_dir = _private_abs(archive_doc.db_file_path).parent
-	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
-	log_path = backup_dir / f"restore_{timestamp}.log"
-	script_path = backup_dir / f"restore_{timestamp}.sh"
-
-	_build_restore_script(
-		bench_path=bench_path,
-		bench_cmd=bench_cmd,
-		site=frappe.local.site,
-		db_path=db_path,
-		public_path=public_path,
-		private_path=private_path,
-		db_root_username=db_root_username,
-		db_root_password=db_root_password,
-		admin_password=admin_password,
-		script_path=script_path,
-	)
-
-	with open(log_path, "a", encoding="utf-8") as log_file:
+		archive_doc.status = "Restoring"
+		archive_doc.restore_log_path = _to_private_relative(log_path)
+		archive_doc.restore_phase = "starting"
+		archive_doc.restore_started_on = now_datetime()
+		archive_doc.restore_elapsed = 0
+		archive_doc.restore_exit_code = None
+		archive_doc.save(ignore_permissions=True)
+		frappe.db.commit()
+
+		# The restore rolls the Backup Archive table back to the dump's contents; this copy
+		# of the catalog lets finish_restore put the current rows back afterwards.
+		_catalog_path(log_path).write_text(
+			frappe.as_json(
+				[
+					frappe.get_doc("Backup Archive", name).as_dict()
+					for name in frappe.get_all("Backup Archive", pluck="name")
+				]
+			),
+			encoding="utf-8",
+		)
+		finish_cmd, notify_cmd = (
+			[
+				bench_cmd,
+				"--site",
+				frappe.local.site,
+				"execute",
+				f"erpnext_backup_manager.api.{method}",
+				"--kwargs",
+				json.dumps({"archive_name": archive_doc.name, "log_path": str(log_path)}),
+			]
+			for method in ("finish_restore", "publish_restore_progress")
+		)
 		subprocess.Popen(
-			["bash", str(script_path)],
-			stdout=log_file,
-			stderr=log_file,
+			[
+				sys.executable,
+				"-m",
+				"erpnext_backup_manager.restore_supervisor",
+				"--script",
+				str(script_path),
+				"--log",
+				str(log_path),
+				"--cwd",
+				bench_path,
+				"--finish",
+				json.dumps(finish_cmd),
+				"--notify",
+				json.dumps(notify_cmd),
+			],
+			stdin=subprocess.DEVNULL,
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL,
 			cwd=bench_path,
 			start_new_session=True,
 		)
-
-	archive_doc.status = "Restoring"
-	archive_doc.restore_log_path = _to_private_relative(log_path)
-	archive_doc.save(ignore_permissions=True)
-	frappe.db.commit()
+	except Exception:
+		_release_backup_lock(lock_token)
+		if archive_doc.status == "Restoring":
+			# The supervisor never started, so nothing was restored.
+			frappe.db.rollback()
+			frappe.db.set_value("Backup Archive", archive_doc.name, "status", previous_status)
+			_publish_archive_event("update", archive_doc.name, {"status": previous_status})
+			frappe.db.commit()
+			clear_archive_list_cache()
+		raise
 
 	return {
 		"status": "started",
 		"archive": archive_doc.name,
 		"restore_log_path": archive_doc.restore_log_path,
 		"restore_log_url": _download_url(archive_doc.restore_log_path),
-		"pre_restore_backup": pre_backup.get("name"),
+		"pre_restore_backup": pre_backup.name,
+		"migrate": migrate,
+		"migrate_reason": migrate_reason,
 	}
 
 
-@frappe.whitelist()
-def create_backup(
-	label: Optional[str] = None,
-	include_files: int = 1,
-	bundle: int = 1,
-	source: str = "Manual",
-) -> Dict[str, Any]:
-	_ensure_system_manager()
+def _schema_fingerprint() -> Optional[str]:
+	"""`appstate.schema_fingerprint` of the site's tables; MariaDB only."""
+	if frappe.conf.db_type == "postgres":
+		return None
+	return appstate.schema_fingerprint(
+		frappe.db.sql(
+			"SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT "
+			"FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()"
+		)
+	)
 
-	include_files = bool(int(include_files or 0))
-	bundle = bool(int(bundle or 0))
 
-	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
-	stamp = f"{timestamp}_{frappe.local.site.replace('.', '_')}"
-	backup_dir = _archive_root() / stamp
-	backup_dir.mkdir(parents=True, exist_ok=True)
+def _app_state() -> Dict[str, Any]:
+	"""The installed apps' code and whether the database has been migrated to it."""
+	apps = appstate.code_state(frappe.get_installed_apps())
+	migrated = frappe.db.get_global(MIGRATED_CODE_KEY)
+	# None when no migrate has run since this app was installed.
+	return {"apps": apps, "migrated": appstate.same_code(json.loads(migrated), apps) if migrated else None}
 
-	odb = new_backup(
-		ignore_files=not include_files,
-		force=True,
-		backup_path=str(backup_dir),
-	)
 
-	db_path = Path(odb.backup_path_db) if odb.backup_path_db else None
-	public_path = Path(odb.backup_path_files) if include_files and odb.backup_path_files else None
-	private_path = (
-		Path(odb.backup_path_private_files)
-		if include_files and odb.backup_path_private_files
-		else None
-	)
-	config_path = Path(odb.backup_path_conf) if odb.backup_path_conf else None
+def record_migration() -> None:
+	"""after_migrate hook: remember the code the database now matches."""
+	frappe.db.set_global(MIGRATED_CODE_KEY, json.dumps(appstate.code_state(frappe.get_installed_apps())))
+
+
+def queue_search_index() -> None:
+	"""The website search index rebuild `bench migrate` queues; run by restores that leave migrate out."""
+	frappe.enqueue("frappe.search.website_search.build_index_for_all_routes", queue="long")
 
-	bundle_path = None
+
+def _restore_migrate(archive_doc: frappe.model.document.Document) -> tuple[bool, str]:
+	"""Whether restoring `archive_doc` needs `bench migrate`, and why; see `appstate.migrate_decision`."""
+	mode = frappe.conf.get("backup_manager_restore_migrate") or "auto"
+	if mode not in RESTORE_MIGRATE_MODES:
+		frappe.throw(
+			_("Restore migrate mode must be one of: {0}").format(", ".join(RESTORE_MIGRATE_MODES)),
+			frappe.ValidationError,
+		)
+	if mode == "always":
+		return True, "backup_manager_restore_migrate is set to always"
+	recorded = frappe.parse_json(archive_doc.app_versions) if archive_doc.app_versions else None
+	if recorded:
+		recorded["schema_fingerprint"] = archive_doc.schema_fingerprint
+	current = appstate.code_state(row["app"] for row in (recorded or {}).get("apps") or [])
+	return appstate.migrate_decision(recorded, current, _schema_fingerprint())
+
+
+def _expected_backup_bytes(include_files: bool, bundle: bool) -> int:
+	previous = frappe.get_all(
+		"Backup Archive",
+		filters={"status": "Ready", "source": ("!=", "Uploaded")},
+		fields=["db_size", "public_size", "private_size", "bundle_size"],
+		order_by="creation desc",
+		limit=1,
+	)
+	if not previous:
+		return 0
+	row = previous[0]
+	total = int(row.db_size or 0)
+	if include_files:
+		total += int(row.public_size or 0) + int(row.private_size or 0)
 	if bundle:
-		bundle_path = backup_dir / f"{stamp}_bundle.zip"
-		_build_bundle(bundle_path, [db_path, public_path, private_path, config_path])
+		total += int(row.bundle_size or 0)
+	return total
 
-	doc = _create_archive_record(
-		title=label or f"Backup {timestamp}",
-		source=source or "Manual",
-		status="Ready",
-		db_path=db_path,
-		public_path=public_path,
-		private_path=private_path,
-		bundle_path=bundle_path,
-		config_path=config_path,
+
+def _stores_bundle(bundle: bool, files_mode: str, per_table: bool) -> bool:
+	# In stream mode the bundle is assembled on download instead of being stored, and a
+	# stored bundle would copy every deduplicated or carried-over file, or every table
+	# file, back out again.
+	return bundle and not _bundle_streamed() and files_mode == "tar" and not per_table
+
+
+def _table_bytes(db_options: Dict[str, Any]) -> Optional[int]:
+	"""Data size of the tables whose rows the dump includes; MariaDB only."""
+	if frappe.conf.db_type == "postgres":
+		return None
+	rows = frappe.db.sql(
+		"SELECT TABLE_NAME, DATA_LENGTH FROM information_schema.TABLES "
+		"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'"
+	)
+	return sum(
+		int(size or 0)
+		for table, size in rows
+		if wants_data(table, db_options["exclude_data"], db_options["include_data"])
 	)
 
-	return {
-		"name": doc.name,
-		"title": doc.title,
-		"source": doc.source,
-		"files": {
-			"bundle": {
-				"path": doc.bundle_file_path,
-				"url": _download_url(doc.bundle_file_path),
-			},
-			"db": {
-				"path": doc.db_file_path,
-				"url": _download_url(doc.db_file_path),
-			},
-			"public": {
-				"path": doc.public_file_path,
-				"url": _download_url(doc.public_file_path),
-			},
-			"private": {
-				"path": doc.private_file_path,
-				"url": _download_url(doc.private_file_path),
-			},
-			"config": {
-				"path": doc.config_file_path,
-				"url": _download_url(doc.config_file_path),
-			},
-		},
-	}
 
+def _site_tree_size(kind: str) -> Dict[str, int]:
+	"""Bytes and file count of the site's public or private files, through the cached index."""
+	root = Path(get_site_path(kind, "files")).resolve()
+	return estimate.tree_size(root, _archive_root() / ESTIMATE_DIRNAME / f"{kind}.json")
 
-@frappe.whitelist()
-def list_archives() -> list[dict]:
-	_ensure_system_manager()
-	rows = frappe.get_all(
+
+def _tar_bytes(row: Dict[str, Any]) -> Optional[int]:
+	"""Size of an archive's compressed file tars before compression, from their checksums."""
+	checksums = json.loads(row.checksums or "{}")
+	sizes = [(checksums.get(kind) or {}).get("uncompressed_size") for kind in ("public", "private")]
+	return sum(sizes) if all(sizes) else None
+
+
+def _estimate_backup(
+	include_files: bool, bundle: bool, db_options: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+	db_options = db_options or _db_dump_options()
+	files_mode = _file_backup_mode()
+	modes = {label: mode for mode, label in FILE_BACKUP_MODES.items()}
+	history = frappe.get_all(
 		"Backup Archive",
+		filters={"status": "Ready", "source": ("!=", "Uploaded")},
 		fields=[
-			"name",
-			"title",
-			"source",
-			"status",
-			"created_on",
-			"created_by",
-			"db_file_path",
-			"db_size",
-			"public_file_path",
-			"public_size",
-			"private_file_path",
-			"private_size",
-			"bundle_file_path",
-			"bundle_size",
-			"config_file_path",
-			"restore_log_path",
+			"db_table_bytes",
+			"files_mode",
+			"db_compression",
+			"files_compression",
+			"checksums",
+			*ARCHIVE_SIZE_FIELDS,
 		],
 		order_by="creation desc",
+		limit=estimate.HISTORY_SIZE,
+	)
+	return estimate.estimate_backup(
+		table_bytes=_table_bytes(db_options),
+		trees={kind: _site_tree_size(kind) for kind in ("public", "private")} if include_files else {},
+		history=[
+			{**row, "files_mode": modes.get(row.files_mode), "files_tar_bytes": _tar_bytes(row)}
+			for row in history
+		],
+		files_mode=files_mode,
+		bundle=_stores_bundle(bundle, files_mode, db_options["mode"] == "tables"),
+		db_compression=db_options["compression"]["codec"],
+		files_compression=_files_compression()["codec"] if files_mode == "tar" else "none",
 	)
-	for row in rows:
-		row["downloads"] = {
-			"bundle": _download_url(row.get("bundle_file_path")),
-			"db": _download_url(row.get("db_file_path")),
-			"public": _download_url(row.get("public_file_path")),
-			"private": _download_url(row.get("private_file_path")),
-			"config": _download_url(row.get("config_file_path")),
-		}
-		row["restore_log_url"] = _download_url(row.get("restore_log_path"))
-	return rows
 
 
-@frappe.whitelist()
-def download_archive_file(path: str):
-	_ensure_system_manager()
-	resolved = _private_abs(path)
-	rel_path = _to_private_relative(resolved)
-	return download_backup(rel_path or path)
+def _disk_preflight_enabled() -> bool:
+	return bool(int(frappe.conf.get("backup_manager_disk_preflight", 1)))
 
 
-@frappe.whitelist()
-def restore_from_archive(
-	archive_name: str,
-	db_root_username: Optional[str] = None,
-	db_root_password: Optional[str] = None,
-	admin_password: Optional[str] = None,
-) -> Dict[str, Any]:
-	_ensure_system_manager()
-	archive_doc = frappe.get_doc("Backup Archive", archive_name)
-	archive_doc.check_permission("write")
-	if not archive_doc.db_file_path:
-		frappe.throw(_("Archive is missing a database backup file."), frappe.ValidationError)
+def _disk_reserve() -> int:
+	reserve = frappe.conf.get("backup_manager_disk_reserve_mb")
+	return int(float(DEFAULT_DISK_RESERVE_MB if reserve is None else reserve) * 1024 * 1024)
 
-	db_path = _private_abs(archive_doc.db_file_path)
+
+def _space_message(problems: list[Dict[str, Any]]) -> str:
+	mb = 1024 * 1024
+	return "; ".join(
+		_("{0} needs {1} MB and {2} MB kept free, {3} MB available").format(
+			entry["path"], entry["needed"] // mb, _disk_reserve() // mb, entry["free"] // mb
+		)
+		for entry in problems
+	)
+
+
+def _ensure_space(needs: list[tuple[Path, int]]) -> None:
+	problems = estimate.shortfalls(needs, _disk_reserve())
+	if problems:
+		frappe.throw(_("Not enough disk space: {0}").format(_space_message(problems)), InsufficientSpaceError)
+
+
+def _space_plan(
+	estimated: Dict[str, Any], extra_needs: Optional[list[tuple[Path, int]]] = None
+) -> Dict[str, Any]:
+	"""Whether an estimated backup fits, and whether it only fits without its stored bundle."""
+	root = _archive_root()
+	extra_needs = extra_needs or []
+	reserve = _disk_reserve()
+	problems = estimate.shortfalls([(root, estimated["total"]), *extra_needs], reserve)
+	skip_bundle = bool(problems and estimated["bundle"]) and not estimate.shortfalls(
+		[(root, estimated["total"] - estimated["bundle"]), *extra_needs], reserve
+	)
+	return {"fits": not problems, "skip_bundle": skip_bundle, "problems": problems}
+
+
+def _check_backup_space(
+	include_files: bool,
+	bundle: bool,
+	db_options: Optional[Dict[str, Any]] = None,
+	extra_needs: Optional[list[tuple[Path, int]]] = None,
+) -> tuple[bool, Optional[str]]:
+	"""Refuse a backup the disk cannot take; a stored bundle is dropped first when that is enough.
+
+	`extra_needs` are written by whatever follows the backup (a restore). Returns whether
+	to build the bundle and a note for the archive when it was dropped.
+	"""
+	if not _disk_preflight_enabled():
+		return bundle, None
+	plan = _space_plan(_estimate_backup(include_files, bundle, db_options), extra_needs)
+	if plan["skip_bundle"]:
+		return False, f"Bundle skipped, not enough disk space: {_space_message(plan['problems'])}"
+	if not plan["fits"]:
+		frappe.throw(
+			_("Not enough disk space: {0}").format(_space_message(plan["problems"])), InsufficientSpaceError
+		)
+	return bundle, None
+
+
+def _restore_space_needs(
+	archive_doc: frappe.model.document.Document,
+	db_path: Path,
+	public_path: Optional[Path],
+	private_path: Optional[Path],
+	engine: str,
+) -> list[tuple[Path, int]]:
+	"""Bytes the restore script writes: staged tars and SQL beside the archive, files into the site.
+
+	The database's own growth is left out; its data directory may live on another host.
+	"""
+	staging = _private_abs(archive_doc.db_file_path).parent
+	site_path = Path(get_site_path()).resolve()
+	needs = []
+	for kind, path in (("public", public_path), ("private", private_path)):
+		if not path:
+			continue
+		size = _component_size(path)
+		if is_manifest(path):
+			needs.append((staging, size))
+		if engine == "bench":
+			# `bench restore` copies each tar into the site folder before extracting it.
+			needs.append((site_path, size))
+			if compression.format_of(path) == "zstd":
+				# ...after it has been unpacked beside the archive.
+				tar_checksum = json.loads(archive_doc.checksums or "{}").get(kind) or {}
+				needs.append((staging, int(tar_checksum.get("uncompressed_size") or size)))
+		if engine == "shadow":
+			# Extracted into a staging folder next to the current files, which are kept.
+			needs.append((site_path, size))
+		else:
+			# Extracted over the current files, so only the difference takes new space.
+			needs.append((site_path, max(size - _site_tree_size(kind)["bytes"], 0)))
+	if engine == "bench":
+		# `bench restore` decompresses the dump next to it; a per-table dump is first
+		# concatenated into one.
+		if is_dump_manifest(db_path):
+			needs.append((staging, dump_size(db_path) + (sql_size(db_path) or 0)))
+		else:
+			db_checksum = json.loads(archive_doc.checksums or "{}").get("db") or {}
+			needs.append((staging, int(db_checksum.get("uncompressed_size") or 0)))
+	return needs
+
+
+def _archive_files_payload(doc: frappe.model.document.Document) -> Dict[str, Any]:
+	return {
+		"bundle": {
+			"path": doc.bundle_file_path,
+			"url": _bundle_download_url(doc.name, doc.bundle_file_path, doc.files_mode, doc.db_dump_mode),
+		},
+		"db": {
+			"path": doc.db_file_path,
+			"url": _download_url(doc.db_file_path),
+		},
+		"public": {
+			"path": doc.public_file_path,
+			"url": _download_url(doc.public_file_path),
+		},
+		"private": {
+			"path": doc.private_file_path,
+			"url": _download_url(doc.private_file_path),
+		},
+		"config": {
+			"path": doc.config_file_path,
+			"url": _download_url(doc.config_file_path),
+		},
+	}
+
+
+def _prepare_backup(
+	label: Optional[str], source: str, notes: Optional[str] = None
+) -> tuple[frappe.model.document.Document, Path]:
+	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
+	stamp = f"{timestamp}_{frappe.local.site.replace('.', '_')}"
+	backup_dir = _archive_root() / stamp
+	backup_dir.mkdir(parents=True, exist_ok=True)
+
+	doc = _create_archive_record(
+		title=label or f"Backup {timestamp}",
+		source=source or "Manual",
+		status="Running",
+		db_path=None,
+		public_path=None,
+		private_path=None,
+		bundle_path=None,
+		config_path=None,
+		notes=notes,
+	)
+	return doc, backup_dir
+
+
+def _backup_workers() -> int:
+	return max(int(frappe.conf.get("backup_manager_max_workers") or DEFAULT_BACKUP_WORKERS), 1)
+
+
+def _file_backup_mode() -> str:
+	mode = frappe.conf.get("backup_manager_file_backup_mode") or "tar"
+	if mode not in FILE_BACKUP_MODES:
+		frappe.throw(_("Unsupported file backup mode {0}.").format(mode), frappe.ValidationError)
+	return mode
+
+
+def _incremental_full_every() -> int:
+	return max(
+		int(frappe.conf.get("backup_manager_incremental_full_every") or DEFAULT_INCREMENTAL_FULL_EVERY), 1
+	)
+
+
+def _previous_manifests(mode: str) -> Dict[str, Any]:
+	"""Manifests of the newest complete archive taken in `mode`; they seed the next scan.
+
+	A restored archive is still complete, so it serves as a base like a Ready one.
+	"""
+	previous = frappe.get_all(
+		"Backup Archive",
+		filters={"status": ("in", ["Ready", "Restored"]), "files_mode": FILE_BACKUP_MODES[mode]},
+		fields=["name", "public_file_path", "private_file_path"],
+		order_by="creation desc",
+		limit=1,
+	)
+	row = previous[0] if previous else {}
+	return {
+		"archive": row.get("name"),
+		"public": _private_abs(row["public_file_path"]) if row.get("public_file_path") else None,
+		"private": _private_abs(row["private_file_path"]) if row.get("private_file_path") else None,
+	}
+
+
+def _file_backup_targets(
+	backup_dir: Path, mode: str, previous: Dict[str, Any], codec: str = "none"
+) -> list[tuple[str, Path, Optional[Path]]]:
+	# Same names as frappe.utils.backups.BackupGenerator so `bench restore` accepts the tars.
+	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
+	site_slug = frappe.local.site.replace(".", "_")
+	suffix = compression.TAR_SUFFIXES[codec] if mode == "tar" else MANIFEST_SUFFIX
+	return [
+		(
+			get_site_path("public", "files"),
+			backup_dir / f"{timestamp}-{site_slug}-files{suffix}",
+			previous.get("public"),
+		),
+		(
+			get_site_path("private", "files"),
+			backup_dir / f"{timestamp}-{site_slug}-private-files{suffix}",
+			previous.get("private"),
+		),
+	]
+
+
+def _tar_directory(source: str, target: Path, cwd: str, codec: Dict[str, Any]) -> Dict[str, Any]:
+	# Runs outside the request context (worker threads), so it must not touch frappe.local.
+	# tar writes to stdout so the archive is compressed and hashed on its way to disk.
+	cmd = ["tar", "-cf", "-", source]
+	if shutil.which("nice"):
+		cmd = ["nice", "-n", "10", *cmd]
+	with open(target, "wb") as raw, tempfile.TemporaryFile() as errors:
+		writer = HashingWriter(raw)
+		process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=errors)
+		with (
+			process.stdout,
+			compression.open_writer(writer, codec["codec"], codec["level"], codec["threads"]) as packed,
+		):
+			shutil.copyfileobj(process.stdout, packed, CHUNK_SIZE)
+			tar_bytes = packed.tell()
+		returncode = process.wait()
+		# GNU tar exits with 1 when a file changed while it was read; the archive is still usable.
+		if returncode not in (0, 1):
+			errors.seek(0)
+			message = errors.read().decode(errors="replace").strip()
+			raise RuntimeError(f"tar failed for {source}: {message}")
+	result = writer.checksum()
+	if codec["codec"] != "none":
+		result["uncompressed_size"] = tar_bytes
+	return result
+
+
+def _backup_file_component(
+	source: str,
+	target: Path,
+	previous_manifest: Optional[Path],
+	cwd: str,
+	mode: str,
+	archive_root: Path,
+	full_every: int,
+	checksums: Dict[str, Dict[str, Any]],
+	timer: PhaseTimer,
+	codec: Dict[str, Any],
+) -> Path:
+	# Runs in worker threads like `_tar_directory`; settings are resolved by the caller.
+	# Timed as "public" or "private", after the directory that holds the files.
+	with timer.measure(Path(source).parent.name) as sizes:
+		if mode == "tar":
+			checksums[target.name] = _tar_directory(source, target, cwd, codec)
+			sizes["bytes_in"] = (
+				checksums[target.name].get("uncompressed_size") or checksums[target.name]["size"]
+			)
+		elif mode == "incremental":
+			result = incremental_snapshot(
+				source,
+				target,
+				delta_tar_path(target),
+				archive_root,
+				cwd=cwd,
+				previous_manifest=previous_manifest,
+				full_every=full_every,
+			)
+			checksums[target.name] = result["manifest"]
+			sizes["bytes_in"] = result["bytes"]
+		else:
+			result = snapshot_directory(
+				source, target, archive_root, cwd=cwd, previous_manifest=previous_manifest
+			)
+			checksums[target.name] = result["manifest"]
+			sizes["bytes_in"] = result["bytes"]
+		sizes["bytes_out"] = _stored_size(target)
+	return target
+
+
+def _db_dump_options(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+	"""Dump settings from site_config; a schedule entry may override them with `db_*` keys."""
+	overrides = overrides or {}
+
+	def setting(name: str) -> Any:
+		value = overrides.get(f"db_{name}")
+		return value if value is not None else frappe.conf.get(f"backup_manager_db_{name}")
+
+	mode = setting("dump_mode") or "single"
+	if mode not in DB_DUMP_MODES:
+		frappe.throw(
+			_("Database dump mode must be one of: {0}").format(", ".join(DB_DUMP_MODES)),
+			frappe.ValidationError,
+		)
+	return {
+		"mode": mode,
+		"workers": int(setting("dump_workers") or min(os.cpu_count() or 1, DEFAULT_DUMP_WORKERS)),
+		"exclude_data": list(setting("exclude_data") or []),
+		"include_data": list(setting("include_data") or []),
+		"compression": _compression(setting("compression") or "gzip", setting("compresslevel")),
+	}
+
+
+def _compression(codec: str, level: Any) -> Dict[str, Any]:
+	try:
+		level = compression.check(codec, level)
+	except ValueError as exc:
+		frappe.throw(str(exc), frappe.ValidationError)
+	threads = int(frappe.conf.get("backup_manager_compress_threads") or os.cpu_count() or 1)
+	return {"codec": codec, "level": level, "threads": threads}
+
+
+def _files_compression() -> Dict[str, Any]:
+	"""Codec of full file tars; deduplicated and incremental backups store files as they are."""
+	return _compression(
+		frappe.conf.get("backup_manager_files_compression") or "none",
+		frappe.conf.get("backup_manager_files_compresslevel"),
+	)
+
+
+def _dump_prefix() -> str:
+	# Same naming as frappe.utils.backups.BackupGenerator.
+	return f"{now_datetime().strftime('%Y%m%d_%H%M%S')}-{frappe.local.site.replace('.', '_')}"
+
+
+def _dump_single(backup_dir: Path, codec: Dict[str, Any]) -> tuple[Path, Path, Dict[str, Any]]:
+	"""Dump the database into one file with a codec `new_backup()` does not offer.
+
+	Returns the dump, the config copy and the dump's checksum.
+	"""
+	prefix = _dump_prefix()
+	db_path = backup_dir / f"{prefix}-database{compression.SQL_SUFFIXES[codec['codec']]}"
+	result = subprocess.run(
+		[
+			sys.executable,
+			"-m",
+			"erpnext_backup_manager.dump",
+			"dump-single",
+			"--site-path",
+			os.path.abspath(get_site_path()),
+			"--output",
+			str(db_path),
+			"--compression",
+			codec["codec"],
+			"--compresslevel",
+			str(codec["level"]),
+			"--threads",
+			str(codec["threads"]),
+		],
+		capture_output=True,
+		text=True,
+	)
+	if result.returncode:
+		raise RuntimeError(f"Database dump failed: {result.stderr.strip()[-2000:]}")
+
+	config_path = backup_dir / f"{prefix}-site_config_backup.json"
+	shutil.copy2(get_site_path("site_config.json"), config_path)
+	return db_path, config_path, json.loads(result.stdout.splitlines()[-1])
+
+
+def _dump_tables(backup_dir: Path, options: Dict[str, Any]) -> tuple[Path, Path]:
+	"""Dump the database table by table in a separate process; returns the manifest and config copy."""
+	prefix = _dump_prefix()
+	manifest_path = backup_dir / f"{prefix}{DUMP_MANIFEST_SUFFIX}"
+	cmd = [
+		sys.executable,
+		"-m",
+		"erpnext_backup_manager.dump",
+		"dump",
+		"--site-path",
+		os.path.abspath(get_site_path()),
+		"--output",
+		str(manifest_path),
+		"--workers",
+		str(options["workers"]),
+		"--compression",
+		options["compression"]["codec"],
+		"--compresslevel",
+		str(options["compression"]["level"]),
+	]
+	for pattern in options["exclude_data"]:
+		cmd.extend(["--exclude-data", pattern])
+	for pattern in options["include_data"]:
+		cmd.extend(["--include-data", pattern])
+	result = subprocess.run(cmd, capture_output=True, text=True)
+	if result.returncode:
+		raise RuntimeError(f"Table dump failed: {result.stderr.strip()[-2000:]}")
+
+	config_path = backup_dir / f"{prefix}-site_config_backup.json"
+	shutil.copy2(get_site_path("site_config.json"), config_path)
+	return manifest_path, config_path
+
+
+def _run_backup(
+	doc: frappe.model.document.Document,
+	backup_dir: Path,
+	include_files: bool,
+	bundle: bool,
+	db_options: Optional[Dict[str, Any]] = None,
+) -> frappe.model.document.Document:
+	db_options = db_options or _db_dump_options()
+	per_table = db_options["mode"] == "tables"
+	# Read as the dump starts; the dumped tables have this schema.
+	app_state = _app_state()
+	fingerprint = _schema_fingerprint()
+	db_codec = db_options["compression"]
+	files_mode = _file_backup_mode()
+	files_codec = _files_compression() if files_mode == "tar" else None
+	previous = _previous_manifests(files_mode) if include_files and files_mode != "tar" else {}
+	if files_mode == "incremental" and previous.get("archive"):
+		# Recorded up front so retention keeps the base while the increment is written.
+		doc.previous_archive = previous["archive"]
+		frappe.db.set_value(
+			"Backup Archive", doc.name, "previous_archive", doc.previous_archive, update_modified=False
+		)
+		frappe.db.commit()
+	targets = (
+		_file_backup_targets(backup_dir, files_mode, previous, (files_codec or {}).get("codec", "none"))
+		if include_files
+		else []
+	)
+	file_checksums: Dict[str, Dict[str, Any]] = {}
+	timer = PhaseTimer()
+	component_args = (
+		os.getcwd(),
+		files_mode,
+		_archive_root(),
+		_incremental_full_every(),
+		file_checksums,
+		timer,
+		files_codec,
+	)
+	workers = _backup_workers()
+	parallel = workers > 1 and bool(targets)
+
+	_set_progress(
+		doc.name,
+		status="Running",
+		phase="db",
+		active_phases=["db", "files"] if parallel else ["db"],
+		backup_dir=_to_private_relative(backup_dir),
+		started_at=time.time(),
+		expected_bytes=_expected_backup_bytes(include_files, bundle),
+	)
+
+	# The database dump needs the site context and stays on this thread; the file tars are
+	# plain subprocesses and run next to it, bounded by `backup_manager_max_workers`.
+	with _pushing_progress(doc.name), ThreadPoolExecutor(max_workers=max(workers - 1, 1)) as pool:
+		futures = (
+			[pool.submit(_backup_file_component, *target, *component_args) for target in targets]
+			if parallel
+			else []
+		)
+
+		with timer.measure("db") as db_sizes:
+			if per_table:
+				# Table files are hashed by the dumper; the manifest records their checksums.
+				db_path, config_path = _dump_tables(backup_dir, db_options)
+				db_checksum = file_checksum(db_path)
+				db_sizes["bytes_in"] = sql_size(db_path)
+			elif db_codec["codec"] != "gzip":
+				db_path, config_path, db_checksum = _dump_single(backup_dir, db_codec)
+				db_sizes["bytes_in"] = db_checksum["uncompressed_size"]
+			else:
+				# The dump is written by `mysqldump | gzip`; follow it to hash it as it grows.
+				follower = FileFollower(backup_dir, DB_DUMP_SUFFIX)
+				follower.start()
+				try:
+					odb = new_backup(
+						ignore_files=True,
+						force=True,
+						backup_path=str(backup_dir),
+					)
+				finally:
+					db_checksum = follower.finish()
+				db_path = Path(odb.backup_path_db) if odb.backup_path_db else None
+				config_path = Path(odb.backup_path_conf) if odb.backup_path_conf else None
+				if db_path and (not db_checksum or follower.path != db_path):
+					db_checksum = file_checksum(db_path, check_gzip=True)
+				if db_checksum and db_checksum.get("error"):
+					raise RuntimeError(f"Database dump is damaged: {db_checksum['error']}")
+				# The gzip check decompresses the dump anyway, which measures the SQL behind it.
+				db_sizes["bytes_in"] = (db_checksum or {}).get("uncompressed_size")
+			db_sizes["bytes_out"] = _component_size(db_path)
+
+		if targets and not parallel:
+			_set_progress(doc.name, phase="files", active_phases=["files"])
+			for target in targets:
+				_backup_file_component(*target, *component_args)
+
+		bundle_path = None
+		bundle_checksum = None
+		if _stores_bundle(bundle, files_mode, per_table):
+			active = ["files", "bundle"] if futures else ["bundle"]
+			_set_progress(doc.name, phase="bundle", active_phases=active)
+			bundle_path = backup_dir / f"{backup_dir.name}_bundle.zip"
+			# Members are appended as soon as each tar finishes, overlapping the bundle pass
+			# with whichever component is still running; the bundle time includes that wait.
+			members = [db_path, config_path, *(target for _source, target, _previous in targets)]
+			with timer.measure("bundle") as bundle_sizes:
+				bundle_checksum = _build_bundle(
+					bundle_path,
+					itertools.chain(
+						[db_path, config_path],
+						(future.result() for future in as_completed(futures)),
+					),
+				)
+				bundle_sizes["bytes_in"] = sum(_file_size(path) for path in members)
+				bundle_sizes["bytes_out"] = bundle_checksum["size"]
+		elif futures:
+			_set_progress(doc.name, phase="files", active_phases=["files"])
+
+		for future in futures:
+			future.result()
+
+	public_path = targets[0][1] if targets else None
+	private_path = targets[1][1] if targets else None
+	_set_progress(doc.name, phase="catalog", active_phases=["catalog"])
+	with timer.measure("catalog"):
+		_write_archive_catalog(backup_dir, doc.name, db_path, public_path, private_path)
+	checksums = {
+		"db": db_checksum,
+		"public": file_checksums.get(public_path.name) if public_path else None,
+		"private": file_checksums.get(private_path.name) if private_path else None,
+		"bundle": bundle_checksum,
+		# The site config is a few hundred bytes; hashing it afterwards costs nothing.
+		"config": file_checksum(config_path) if config_path and config_path.exists() else None,
+	}
+
+	_set_archive_files(
+		doc,
+		db_path=db_path,
+		public_path=public_path,
+		private_path=private_path,
+		bundle_path=bundle_path,
+		config_path=config_path,
+	)
+	if targets:
+		doc.files_mode = FILE_BACKUP_MODES[files_mode]
+		doc.files_stored_size = sum(_stored_size(target) for _, target, _ in targets)
+		if files_mode == "incremental" and previous.get("archive"):
+			# A new base restarts the chain; only increments point back at an earlier archive.
+			chain_length = read_manifest_header(targets[0][1]).get("chain_length") or 0
+			doc.previous_archive = previous["archive"] if chain_length else None
+	doc.db_dump_mode = DB_DUMP_MODES[db_options["mode"]]
+	doc.db_compression = db_codec["codec"]
+	doc.files_compression = files_codec["codec"] if targets and files_codec else None
+	doc.db_table_bytes = _table_bytes(db_options)
+	doc.app_versions = json.dumps(app_state)
+	doc.schema_fingerprint = fingerprint
+	doc.checksums = json.dumps({key: value for key, value in checksums.items() if value})
+	_add_phase_rows(doc, "Backup", timer.phases)
+	doc.status = "Ready"
+	doc.save(ignore_permissions=True)
+	frappe.db.commit()
+
+	_set_progress(
+		doc.name, status="Ready", phase="done", active_phases=[], bytes_written=_dir_size(backup_dir)
+	)
+	_publish_progress(doc.name)
+	return doc
+
+
+def _catalog_files(public_path: Optional[Path], private_path: Optional[Path]) -> Dict[str, Path]:
+	return {kind: path for kind, path in (("public", public_path), ("private", private_path)) if path}
+
+
+def _write_archive_catalog(
+	directory: Path,
+	archive_name: str,
+	db_path: Optional[Path],
+	public_path: Optional[Path],
+	private_path: Optional[Path],
+) -> Optional[Dict[str, Any]]:
+	"""Catalog an archive's contents; a failure is only logged, the backup itself is fine."""
+	try:
+		return catalog.build_catalog(
+			catalog.catalog_path(directory), db_path, _catalog_files(public_path, private_path), archive_name
+		)
+	except Exception:
+		frappe.log_error(title=f"Backup archive catalog failed: {archive_name}")
+		return None
+
+
+def _spawn_catalog_build(
+	directory: Path,
+	archive_name: str,
+	db_path: Path,
+	public_path: Optional[Path],
+	private_path: Optional[Path],
+) -> None:
+	# The restore that follows replaces the database, so uploads are catalogued by a
+	# detached process that needs no site connection.
+	cmd = [
+		sys.executable,
+		"-m",
+		"erpnext_backup_manager.catalog",
+		"build",
+		"--output",
+		str(catalog.catalog_path(directory)),
+		"--archive",
+		archive_name,
+		"--db",
+		str(db_path),
+	]
+	for kind, path in _catalog_files(public_path, private_path).items():
+		cmd.extend([f"--{kind}", str(path)])
+	subprocess.Popen(
+		cmd,
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+		start_new_session=True,
+	)
+
+
+def _mark_backup_failed(archive_name: str, exc: Exception) -> None:
+	frappe.db.rollback()
+	frappe.db.set_value("Backup Archive", archive_name, {"status": "Failed", "notes": str(exc)})
+	# set_value skips the controller hooks that normally drop the cached listing and publish the row.
+	_publish_archive_event("update", archive_name, {"status": "Failed"})
+	frappe.db.commit()
+	clear_archive_list_cache()
+	_set_progress(archive_name, status="Failed", phase=None, error=str(exc))
+	_publish_progress(archive_name)
+
+
+def run_backup_job(
+	archive_name: str,
+	backup_dir: str,
+	include_files: int = 1,
+	bundle: int = 1,
+	lock_token: Optional[str] = None,
+	db_options: Optional[Dict[str, Any]] = None,
+) -> None:
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	try:
+		with _backup_heartbeat(archive_name, lock_token, f"backup ({doc.source})"):
+			_run_backup(doc, Path(backup_dir), bool(include_files), bool(bundle), db_options)
+	except Exception as exc:
+		_mark_backup_failed(archive_name, exc)
+		raise
+	finally:
+		_release_backup_lock(lock_token)
+	_start_replication(doc)
+
+
+def _raise_stopped(signum: int, frame: Any) -> None:
+	# Once is enough: the failure is being recorded.
+	signal.signal(signum, signal.SIG_IGN)
+	raise BackupStoppedError(f"Stopped by {signal.Signals(signum).name}")
+
+
+def run_site_backup(result_path: str, include_files: int = 1, bundle: int = 1) -> None:
+	"""Back up this site in the calling process, for the bench-wide orchestrator.
+
+	The outcome is written to `result_path` as JSON rather than printed, since `bench
+	execute` mixes its own output into stdout.
+	"""
+	started = time.monotonic()
+	result: Dict[str, Any] = {"site": frappe.local.site}
+	# `--site-timeout` stops the process with SIGTERM; raising here lets the archive be
+	# marked Failed and the lock released on the way out.
+	signal.signal(signal.SIGTERM, _raise_stopped)
+	try:
+		lock_token = _acquire_backup_lock("bench-wide backup", _job_timeout())
+	except BackupLockedError as exc:
+		result.update(status="Skipped", error=str(exc))
+	else:
+		doc = None
+		try:
+			db_options = _db_dump_options()
+			keep_bundle, notes = _check_backup_space(bool(int(include_files)), bool(int(bundle)), db_options)
+			doc, backup_dir = _prepare_backup(
+				f"Bench backup {now_datetime().strftime('%Y-%m-%d %H:%M')}", "Scheduled", notes
+			)
+			with _backup_heartbeat(doc.name, lock_token, "bench-wide backup"):
+				_run_backup(doc, backup_dir, bool(int(include_files)), keep_bundle, db_options)
+		except Exception as exc:
+			if doc:
+				_mark_backup_failed(doc.name, exc)
+			result.update(status="Failed", error=str(exc))
+		finally:
+			_release_backup_lock(lock_token)
+		if doc:
+			result["archive"] = doc.name
+		if doc and "error" not in result:
+			result.update(
+				status="Ready",
+				notes=doc.notes,
+				db_size=doc.db_size,
+				files_size=(doc.public_size or 0) + (doc.private_size or 0),
+				bundle_size=doc.bundle_size,
+			)
+			_start_replication(doc)
+	result["seconds"] = round(time.monotonic() - started, 1)
+	frappe.clear_messages()
+	Path(result_path).write_text(json.dumps(result), encoding="utf-8")
+
+
+def _backup_job_id(archive_name: str) -> str:
+	return f"backup_manager_backup::{archive_name}"
+
+
+def _job_pending(job_id: str) -> bool:
+	"""True while the RQ job waits in its queue or has started too recently to have beaten."""
+	job = get_job(job_id)
+	if not job:
+		return False
+	status = job.get_status()
+	if status == "started" and job.started_at:
+		# RQ records UTC, naive or aware depending on its version.
+		started = job.started_at.replace(tzinfo=datetime.timezone.utc)
+		return (datetime.datetime.now(datetime.timezone.utc) - started).total_seconds() < HEARTBEAT_TTL
+	return status in ("queued", "deferred", "scheduled")
+
+
+def _backup_alive(archive_name: str, created: datetime.datetime) -> bool:
+	if _cache().get(_heartbeat_key(archive_name)):
+		return True
+	# A bench-wide backup creates its row just before its first heartbeat.
+	if (now_datetime() - created).total_seconds() < HEARTBEAT_TTL:
+		return True
+	return _job_pending(_backup_job_id(archive_name))
+
+
+def fail_interrupted_backups() -> list[str]:
+	"""Mark Running archives Failed once the process writing them has gone.
+
+	A running backup renews its heartbeat every minute and a queued one still has its RQ
+	job waiting; a Running row with neither was left by a process killed before it could
+	record the failure.
+	"""
+	rows = frappe.get_all("Backup Archive", filters={"status": "Running"}, fields=["name", "creation"])
+	names = [row.name for row in rows if not _backup_alive(row.name, row.creation)]
+	for name in names:
+		_mark_backup_failed(name, RuntimeError("Interrupted: the backup process was killed."))
+	return names
+
+
+def start_bench_backup() -> bool:
+	"""Start `bench backup-all-sites` when the bench-wide schedule is due; True if started."""
+	expression = frappe.conf.get("backup_manager_bench_schedule")
+	if not expression:
+		return False
+	if not schedule.validate_cron(expression):
+		frappe.log_error(title=f"Invalid bench backup schedule: {expression}")
+		return False
+	sites_path = os.path.abspath(frappe.local.sites_path)
+	state_path = Path(sites_path) / BENCH_SCHEDULE_STATE_FILE
+	if not orchestrator.claim_due_run(state_path, expression, now_datetime()):
+		return False
+	# Detached, so the run outlives this scheduler job; it is not tied to any one site.
+	subprocess.Popen(
+		[sys.executable, "-m", "frappe.utils.bench_helper", "frappe", "backup-all-sites"],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+		cwd=sites_path,
+		start_new_session=True,
+	)
+	return True
+
+
+def _queue_backup(
+	label: Optional[str],
+	include_files: bool,
+	bundle: bool,
+	source: str,
+	db_options: Optional[Dict[str, Any]] = None,
+) -> frappe.model.document.Document:
+	# Taken here rather than in the job so a second request fails at once instead of
+	# queueing behind the first; the job releases it when it ends.
+	lock_token = _acquire_backup_lock(f"backup ({source})", _job_timeout())
+	try:
+		db_options = db_options or _db_dump_options()
+		bundle, notes = _check_backup_space(include_files, bundle, db_options)
+		doc, backup_dir = _prepare_backup(label, source, notes)
+		_set_progress(
+			doc.name,
+			status="Running",
+			phase="queued",
+			backup_dir=_to_private_relative(backup_dir),
+			started_at=time.time(),
+		)
+
+		frappe.enqueue(
+			"erpnext_backup_manager.api.run_backup_job",
+			queue="long",
+			timeout=_job_timeout(),
+			# Lets the interrupted-backup sweep tell a job still queued from a lost one.
+			job_id=_backup_job_id(doc.name),
+			archive_name=doc.name,
+			backup_dir=str(backup_dir),
+			include_files=int(include_files),
+			bundle=int(bundle),
+			lock_token=lock_token,
+			db_options=db_options,
+		)
+	except Exception:
+		_release_backup_lock(lock_token)
+		raise
+	return doc
+
+
+@frappe.whitelist()
+def create_backup(
+	label: Optional[str] = None,
+	include_files: int = 1,
+	bundle: int = 1,
+	source: str = "Manual",
+) -> Dict[str, Any]:
+	_ensure_system_manager()
+
+	include_files = bool(int(include_files or 0))
+	bundle = bool(int(bundle or 0))
+	doc = _queue_backup(label, include_files, bundle, source)
+
+	return {
+		"name": doc.name,
+		"title": doc.title,
+		"source": doc.source,
+		"status": doc.status,
+		"notes": doc.notes,
+	}
+
+
+@frappe.whitelist()
+def estimate_backup(include_files: int = 1, bundle: int = 1) -> Dict[str, Any]:
+	"""Predicted size of a backup taken now, and whether the archive disk can take it."""
+	_ensure_system_manager()
+	estimated = _estimate_backup(bool(int(include_files or 0)), bool(int(bundle or 0)))
+	plan = _space_plan(estimated)
+	return {
+		**estimated,
+		"free": shutil.disk_usage(_archive_root()).free,
+		"reserve": _disk_reserve(),
+		"margin": estimate.ESTIMATE_MARGIN,
+		"preflight": _disk_preflight_enabled(),
+		"fits": plan["fits"],
+		"skip_bundle": plan["skip_bundle"],
+		"message": _space_message(plan["problems"]) if plan["problems"] else None,
+	}
+
+
+@frappe.whitelist()
+def get_backup_status(archive_name: str) -> Dict[str, Any]:
+	_ensure_system_manager()
+	return _backup_status(archive_name)
+
+
+def _backup_status(archive_name: str) -> Dict[str, Any]:
+	progress = _get_progress(archive_name) or {}
+	status = progress.get("status")
+	if not status:
+		status = frappe.db.get_value("Backup Archive", archive_name, "status")
+		if not status:
+			frappe.throw(_("Backup Archive {0} not found.").format(archive_name), frappe.DoesNotExistError)
+
+	result = {
+		"name": archive_name,
+		"status": status,
+		"phase": progress.get("phase"),
+		"active_phases": progress.get("active_phases") or [],
+		"bytes_written": progress.get("bytes_written") or 0,
+		"expected_bytes": progress.get("expected_bytes") or 0,
+		"elapsed": None,
+		"eta": None,
+		"error": progress.get("error"),
+	}
+
+	if status == "Running":
+		if progress.get("backup_dir"):
+			result["bytes_written"] = _dir_size(_private_abs(progress["backup_dir"]))
+		if progress.get("started_at"):
+			elapsed = max(time.time() - progress["started_at"], 0)
+			result["elapsed"] = int(elapsed)
+			written = result["bytes_written"]
+			expected = result["expected_bytes"]
+			if written and expected > written:
+				result["eta"] = int(elapsed * (expected - written) / written)
+	elif status == "Ready":
+		doc = frappe.get_doc("Backup Archive", archive_name)
+		result["files"] = _archive_files_payload(doc)
+
+	return result
+
+
+def _publish_progress(archive_name: str) -> None:
+	frappe.publish_realtime(PROGRESS_EVENT, _backup_status(archive_name), doctype="Backup Archive")
+
+
+@contextlib.contextmanager
+def _pushing_progress(archive_name: str) -> Iterator[None]:
+	"""Publish the backup's progress every few seconds while the block runs.
+
+	One push per backup replaces a status poll from every open Backup Center.
+	"""
+	stop = threading.Event()
+
+	def push() -> None:
+		while not stop.wait(PROGRESS_PUSH_INTERVAL):
+			try:
+				_publish_progress(archive_name)
+			except Exception:
+				# Progress is cosmetic; the backup must not notice.
+				pass
+
+	# frappe.local lives in context variables; the copy gives the thread the site.
+	thread = threading.Thread(target=contextvars.copy_context().run, args=(push,), daemon=True)
+	thread.start()
+	try:
+		yield
+	finally:
+		stop.set()
+		thread.join()
+
+
+def _catalog_path(log_path: Path) -> Path:
+	return log_path.with_name(f"{log_path.stem}.catalog.json")
+
+
+def _sync_archive_catalog(catalog_path: Path) -> None:
+	"""Put the Backup Archive rows saved before a restore back into the restored database.
+
+	The archive catalog describes files on disk, not site data, so it must survive the
+	database being rolled back to an older dump.
+	"""
+	rows = json.loads(catalog_path.read_text(encoding="utf-8"))
+	if not rows:
+		return
+	existing = set(frappe.get_all("Backup Archive", pluck="name"))
+	for table in frappe.get_meta("Backup Archive").get_table_fields():
+		frappe.db.delete(table.options, {"parenttype": "Backup Archive"})
+	for row in rows:
+		doc = frappe.get_doc({**row, "doctype": "Backup Archive"})
+		if row["name"] in existing:
+			doc.db_update()
+		else:
+			doc.db_insert()
+		for child in doc.get_all_children():
+			child.db_insert()
+	# Rows only the dump knows about point at archives that have since been pruned.
+	frappe.db.delete("Backup Archive", {"name": ("not in", [row["name"] for row in rows])})
+
+
+def finish_restore(archive_name: str, log_path: str) -> None:
+	"""Record the outcome of a restore; run by the restore supervisor via `bench execute`."""
+	log = Path(log_path)
+	status = read_status(status_path(log))
+	catalog_path = _catalog_path(log)
+	if catalog_path.exists():
+		_sync_archive_catalog(catalog_path)
+		catalog_path.unlink()
+
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	restored = status.get("state") == "Restored"
+	if status.get("phases"):
+		# The data import reads the archived database dump and file backups.
+		restored_bytes = sum(
+			_component_size(path)
+			for component, path in _archive_components(doc).items()
+			if component in ("db", "public", "private")
+		)
+		_add_phase_rows(
+			doc,
+			"Restore",
+			metrics.timeline_phases(
+				status["phases"], status.get("finished_at") or time.time(), {"restore": restored_bytes}
+			),
+		)
+	doc.status = "Restored" if restored else "Failed"
+	doc.restore_phase = "done" if restored else status.get("phase")
+	doc.restore_elapsed = int(status.get("elapsed") or 0)
+	doc.restore_exit_code = status.get("exit_code")
+	if not restored:
+		doc.notes = (
+			f"Restore failed during {status.get('phase') or 'startup'} "
+			f"(exit code {status.get('exit_code')}); see the restore log."
+		)
+	doc.save(ignore_permissions=True)
+	frappe.db.commit()
+	clear_archive_list_cache()
+
+
+def publish_restore_progress(archive_name: str, log_path: str) -> None:
+	"""Publish the phase a restore has entered; started by the restore supervisor via `bench execute`.
+
+	Reads only the supervisor's status file: the database may be halfway through its import.
+	"""
+	status = read_status(status_path(Path(log_path)))
+	if status.get("phase"):
+		_publish_archive_event("update", archive_name, {"restore_phase": status["phase"]}, after_commit=False)
+
+
+@frappe.whitelist()
+def get_restore_status(archive_name: str, offset: int = 0) -> Dict[str, Any]:
+	"""Restore phase and the log bytes written since `offset`, for live progress."""
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	if not doc.restore_log_path:
+		frappe.throw(_("Archive {0} has not been restored.").format(archive_name), frappe.ValidationError)
+
+	log_path = _private_abs(doc.restore_log_path)
+	status = read_status(status_path(log_path))
+	tail = LogTail(log_path, offset=max(int(offset or 0), 0))
+	chunk = tail.read(READ_CHUNK_SIZE)
+	# The status file is ahead of the DocType until finish_restore has written the outcome,
+	# and is all there is when a failed restore left no usable database to write it to.
+	if doc.status == "Restoring" and status:
+		running = status.get("state") == "Running"
+		state = "Restoring" if running else status.get("state")
+		phase = status.get("phase")
+		elapsed = int(time.time() - status["started_at"]) if running else status.get("elapsed")
+		exit_code = status.get("exit_code")
+	else:
+		state, phase = doc.status, doc.restore_phase
+		elapsed, exit_code = doc.restore_elapsed, doc.restore_exit_code
+	return {
+		"archive": archive_name,
+		"status": state,
+		"phase": phase,
+		"elapsed": elapsed,
+		"exit_code": exit_code,
+		"log": chunk.decode(errors="replace"),
+		"offset": tail.offset,
+		"log_size": _file_size(log_path),
+		"shadow": _shadow_summary(shadow.state_path(log_path)),
+	}
+
+
+def _shadow_summary(state_file: Path) -> Optional[Dict[str, Any]]:
+	if not state_file.exists():
+		return None
+	state = shadow.read_state(state_file)
+	return {key: state[key] for key in ("state", "live_db", "shadow_db")}
+
+
+def _shadow_state_file(doc: frappe.model.document.Document) -> Path:
+	state_file = shadow.state_path(_private_abs(doc.restore_log_path)) if doc.restore_log_path else None
+	if not state_file or not state_file.exists():
+		frappe.throw(
+			_("Archive {0} was not restored with the shadow engine.").format(doc.name), frappe.ValidationError
+		)
+	return state_file
+
+
+@frappe.whitelist(methods=["POST"])
+def rollback_shadow_restore(archive_name: str) -> Dict[str, Any]:
+	"""Queue the switch back to the database and files the site had before a shadow restore."""
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	doc.check_permission("write")
+	state = shadow.read_state(_shadow_state_file(doc))
+	if state["state"] != "swapped":
+		frappe.throw(
+			_("Nothing to roll back: the restore is {0}.").format(state["state"]), frappe.ValidationError
+		)
+	# Held by the job until the rollback is recorded in the database the site is back on.
+	lock_token = _acquire_backup_lock(f"rollback of {archive_name}", _restore_lock_ttl())
+	try:
+		frappe.db.set_value("Backup Archive", archive_name, "restore_phase", "rolling back")
+		_publish_archive_event("update", archive_name, {"restore_phase": "rolling back"})
+		frappe.db.commit()
+		clear_archive_list_cache()
+		frappe.enqueue(
+			"erpnext_backup_manager.api.run_shadow_rollback_job",
+			queue="long",
+			timeout=_restore_lock_ttl(),
+			archive_name=archive_name,
+			lock_token=lock_token,
+		)
+	except Exception:
+		_release_backup_lock(lock_token)
+		raise
+	return {"status": "queued", "archive": archive_name, "live_db": state["live_db"]}
+
+
+def _reconnect_site_database() -> None:
+	# site_config was read when this process started; a switch-over changes the database it names.
+	frappe.db.close()
+	frappe.local.conf = frappe._dict(frappe.get_site_config())
+	frappe.connect()
+
+
+def run_shadow_rollback_job(archive_name: str, lock_token: Optional[str] = None) -> None:
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	state_file = _shadow_state_file(doc)
+	log_path = _private_abs(doc.restore_log_path)
+	try:
+		# Archives created since the restore are recorded in this database only.
+		_catalog_path(log_path).write_text(
+			frappe.as_json(
+				[
+					frappe.get_doc("Backup Archive", name).as_dict()
+					for name in frappe.get_all("Backup Archive", pluck="name")
+				]
+			),
+			encoding="utf-8",
+		)
+		try:
+			state = shadow.rollback(state_file)
+		except ValueError as exc:
+			frappe.throw(str(exc), frappe.ValidationError)
+
+		# This process still holds the restored database; the outcome belongs in the one
+		# the site is back on.
+		result = subprocess.run(
+			[
+				_bench_command(),
+				"--site",
+				frappe.local.site,
+				"execute",
+				"erpnext_backup_manager.api.finish_shadow_rollback",
+				"--kwargs",
+				json.dumps({"archive_name": archive_name, "log_path": str(log_path)}),
+			],
+			cwd=os.path.join(get_bench_path(), "sites"),
+			capture_output=True,
+			text=True,
+		)
+		if result.returncode:
+			output = (result.stdout + result.stderr).strip()
+			with open(log_path, "a", encoding="utf-8") as log:
+				log.write(f"\n[rollback] finish_shadow_rollback exited with {result.returncode}:\n{output}\n")
+			_reconnect_site_database()
+			frappe.log_error(title=f"Shadow rollback not recorded: {archive_name}", message=output)
+			# Committed here: the job's failure rolls back whatever is still open.
+			frappe.db.commit()
+			frappe.throw(
+				_(
+					"The site is back on database {0}, but the rollback of {1} could not be recorded; see the Error Log."
+				).format(state["live_db"], archive_name),
+				frappe.ValidationError,
+			)
+	finally:
+		_release_backup_lock(lock_token)
+
+
+def finish_shadow_rollback(archive_name: str, log_path: str) -> None:
+	"""Record a rollback in the database the site is back on; run via `bench execute`."""
+	catalog_path = _catalog_path(Path(log_path))
+	if catalog_path.exists():
+		_sync_archive_catalog(catalog_path)
+		catalog_path.unlink()
+	frappe.db.set_value(
+		"Backup Archive",
+		archive_name,
+		{
+			"status": "Ready",
+			"restore_phase": "rolled back",
+			"notes": "Shadow restore rolled back to the previous database.",
+		},
+	)
+	_publish_archive_event("update", archive_name, {"status": "Ready", "restore_phase": "rolled back"})
+	frappe.db.commit()
+	clear_archive_list_cache()
+
+
+@frappe.whitelist(methods=["POST"])
+def discard_shadow_restore(archive_name: str) -> Dict[str, Any]:
+	"""Queue dropping the database and files a shadow restore left unused."""
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	doc.check_permission("write")
+	if doc.restore_phase == "rolling back":
+		# The queued rollback switches the site to the side a discard would drop.
+		frappe.throw(_("A rollback of {0} is in progress.").format(archive_name), frappe.ValidationError)
+	state = shadow.read_state(_shadow_state_file(doc))
+	if state["state"] not in ("swapped", "rolled_back"):
+		frappe.throw(
+			_("Nothing to discard: the restore is {0}.").format(state["state"]), frappe.ValidationError
+		)
+	# Also keeps a rollback from being queued while the discard is pending.
+	lock_token = _acquire_backup_lock(f"discard of {archive_name}", _restore_lock_ttl())
+	try:
+		frappe.enqueue(
+			"erpnext_backup_manager.api.run_shadow_discard_job",
+			queue="long",
+			timeout=_restore_lock_ttl(),
+			archive_name=archive_name,
+			lock_token=lock_token,
+		)
+	except Exception:
+		_release_backup_lock(lock_token)
+		raise
+	return {"status": "queued", "archive": archive_name}
+
+
+def run_shadow_discard_job(archive_name: str, lock_token: Optional[str] = None) -> None:
+	state_file = _shadow_state_file(frappe.get_doc("Backup Archive", archive_name))
+	try:
+		shadow.discard(state_file)
+	finally:
+		_release_backup_lock(lock_token)
+
+
+def run_verify_job(archive_name: str, throttled: int = 1) -> None:
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	_verify_archive(doc, _verify_rate() if throttled else None)
+
+
+@frappe.whitelist()
+def verify_archive(archive_name: str, background: int = 0) -> Dict[str, Any]:
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	doc.check_permission("write")
+	if doc.status == "Running":
+		frappe.throw(_("Backup {0} is still running.").format(archive_name), frappe.ValidationError)
+
+	if int(background or 0):
+		frappe.enqueue(
+			"erpnext_backup_manager.api.run_verify_job",
+			queue="long",
+			timeout=_job_timeout(),
+			archive_name=archive_name,
+		)
+		return {"archive": archive_name, "status": "queued"}
+
+	errors = _verify_archive(doc)
+	return {
+		"archive": archive_name,
+		"verification_status": doc.verification_status,
+		"verified_on": doc.verified_on,
+		"errors": errors,
+	}
+
+
+def run_catalog_job(archive_name: str) -> None:
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	directory = _archive_dir(doc)
+	if not directory:
+		return
+	paths = _archive_components(doc)
+	catalog.build_catalog(
+		catalog.catalog_path(directory),
+		paths.get("db"),
+		_catalog_files(paths.get("public"), paths.get("private")),
+		archive_name,
+	)
+
+
+@frappe.whitelist(methods=["POST"])
+def rebuild_archive_catalog(archive_name: str) -> Dict[str, Any]:
+	"""Catalog an archive again, e.g. one created before catalogs existed."""
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	doc.check_permission("write")
+	if doc.status == "Running":
+		frappe.throw(_("Backup {0} is still running.").format(archive_name), frappe.ValidationError)
+	if not _archive_dir(doc):
+		frappe.throw(
+			_("Archive {0} has no directory of its own.").format(archive_name), frappe.ValidationError
+		)
+	frappe.enqueue(
+		"erpnext_backup_manager.api.run_catalog_job",
+		queue="long",
+		timeout=_job_timeout(),
+		archive_name=archive_name,
+	)
+	return {"archive": archive_name, "status": "queued"}
+
+
+def _as_of(value: str) -> datetime.datetime:
+	"""Upper bound for `created_on`; a bare date covers that whole day."""
+	moment = frappe.utils.get_datetime(value)
+	if len(str(value).strip()) <= len("YYYY-MM-DD"):
+		moment += datetime.timedelta(days=1)
+	return moment
+
+
+@frappe.whitelist()
+def search_archives(
+	file: Optional[str] = None,
+	table: Optional[str] = None,
+	as_of: Optional[str] = None,
+	limit: int = 20,
+) -> Dict[str, Any]:
+	"""Archives that contain a file and/or a table, newest first.
+
+	`file` is a file URL (``/files/a.pdf``), a path pattern with ``*``/``?`` or a
+	file name; `as_of` limits the search to archives created up to that moment, so
+	the first match is the latest copy as of that date.
+	"""
+	_ensure_system_manager()
+	if not file and not table:
+		frappe.throw(_("Give a file or a table to search for."), frappe.ValidationError)
+	started = time.monotonic()
+	limit = max(1, min(int(limit or 20), MAX_ARCHIVE_PAGE))
+
+	archive = frappe.qb.DocType("Backup Archive")
+	query = (
+		frappe.qb.from_(archive)
+		.select(
+			archive.name,
+			archive.title,
+			archive.status,
+			archive.created_on,
+			archive.db_file_path,
+			archive.public_file_path,
+			archive.private_file_path,
+			archive.bundle_file_path,
+		)
+		.where(archive.status.notin(["Running", "Failed"]))
+		.orderby(archive.created_on, order=frappe.qb.desc)
+	)
+	if as_of:
+		query = query.where(archive.created_on < _as_of(as_of))
+
+	matches, uncatalogued = [], []
+	for row in query.run(as_dict=True):
+		directory = _archive_dir(row)
+		path = catalog.catalog_path(directory) if directory else None
+		if not path or not path.exists():
+			uncatalogued.append(row.name)
+			continue
+		found = catalog.search(path, file=file, table=table, limit=limit)
+		if found:
+			matches.append({"archive": row.name, "title": row.title, "created_on": row.created_on, **found})
+			if len(matches) >= limit:
+				break
+	return {
+		"matches": matches,
+		"uncatalogued": uncatalogued,
+		"elapsed_ms": int((time.monotonic() - started) * 1000),
+	}
+
+
+def _latest_phase_rows() -> list[Dict[str, Any]]:
+	"""The most recent record of every (operation, phase) pair."""
+	phase = frappe.qb.DocType("Backup Archive Phase")
+	rows = (
+		frappe.qb.from_(phase)
+		.select(
+			phase.operation,
+			phase.phase,
+			phase.started_on,
+			*(phase[field] for field in PHASE_METRIC_FIELDS),
+		)
+		.where(phase.parenttype == "Backup Archive")
+		.orderby(phase.started_on, order=frappe.qb.desc)
+		.limit(METRICS_PHASE_ROWS)
+		.run(as_dict=True)
+	)
+	latest: Dict[tuple[str, str], Dict[str, Any]] = {}
+	for row in rows:
+		latest.setdefault((row.operation, row.phase), row)
+	return list(latest.values())
+
+
+def _phase_families(rows: list[Dict[str, Any]]) -> list[metrics.Family]:
+	def labels(row: Dict[str, Any]) -> Dict[str, str]:
+		return {"operation": row.operation.lower(), "phase": row.phase}
+
+	def samples(field: str, scale: float = 1) -> list[tuple[Dict[str, str], float]]:
+		return [(labels(row), row[field] * scale) for row in rows if row[field] is not None]
+
+	return [
+		metrics.Family(
+			"backup_manager_phase_duration_seconds",
+			"gauge",
+			"Wall time of the latest run of each backup/restore phase.",
+			samples("seconds"),
+		),
+		metrics.Family(
+			"backup_manager_phase_input_bytes",
+			"gauge",
+			"Bytes read by the latest run of each phase.",
+			samples("bytes_in"),
+		),
+		metrics.Family(
+			"backup_manager_phase_output_bytes",
+			"gauge",
+			"Bytes written by the latest run of each phase.",
+			samples("bytes_out"),
+		),
+		metrics.Family(
+			"backup_manager_phase_throughput_bytes_per_second",
+			"gauge",
+			"Throughput of the latest run of each phase.",
+			samples("mb_per_sec", metrics.MB),
+		),
+		metrics.Family(
+			"backup_manager_phase_compression_ratio",
+			"gauge",
+			"Input bytes per output byte of the latest run of each phase.",
+			samples("compression_ratio"),
+		),
+		metrics.Family(
+			"backup_manager_phase_started_timestamp_seconds",
+			"gauge",
+			"When the latest run of each phase started.",
+			[(labels(row), _datetime_timestamp(row.started_on)) for row in rows if row.started_on],
+		),
+	]
+
+
+@frappe.whitelist(methods=["GET"])
+def prometheus_metrics() -> Response:
+	"""Archive, phase and replication metrics in the Prometheus text format.
+
+	Scrapers authenticate with the API key and secret of a System Manager user.
+	"""
+	_ensure_system_manager()
+	archive = frappe.qb.DocType("Backup Archive")
+	by_status = (
+		frappe.qb.from_(archive)
+		.select(archive.status, Count(archive.name).as_("count"))
+		.groupby(archive.status)
+		.run(as_dict=True)
+	)
+	sizes = (
+		frappe.qb.from_(archive)
+		.select(*(Sum(archive[field]).as_(field) for field in ARCHIVE_SIZE_FIELDS))
+		.run(as_dict=True)[0]
+	)
+	last_backups = (
+		frappe.qb.from_(archive)
+		.select(archive.source, Max(archive.created_on).as_("created_on"))
+		.where(archive.source != "Uploaded")
+		.where(archive.status.notin(["Running", "Failed"]))
+		.groupby(archive.source)
+		.run(as_dict=True)
+	)
+	replica = frappe.qb.DocType("Backup Archive Replication")
+	replications = (
+		frappe.qb.from_(replica)
+		.select(replica.target, replica.status, Count(replica.name).as_("count"))
+		.where(replica.parenttype == "Backup Archive")
+		.groupby(replica.target, replica.status)
+		.run(as_dict=True)
+	)
+
+	families = [
+		metrics.Family(
+			"backup_manager_archives",
+			"gauge",
+			"Backup archives by status.",
+			[({"status": row.status}, row.count) for row in by_status],
+		),
+		metrics.Family(
+			"backup_manager_archive_bytes",
+			"gauge",
+			"Total size of all archives by component.",
+			[
+				({"component": field.removesuffix("_size")}, int(sizes[field] or 0))
+				for field in ARCHIVE_SIZE_FIELDS
+			],
+		),
+		metrics.Family(
+			"backup_manager_last_backup_timestamp_seconds",
+			"gauge",
+			"When the newest completed backup of each source was taken.",
+			[
+				({"source": row.source}, _datetime_timestamp(row.created_on))
+				for row in last_backups
+				if row.created_on
+			],
+		),
+		*_phase_families(_latest_phase_rows()),
+		metrics.Family(
+			"backup_manager_replications",
+			"gauge",
+			"Archive copies by replication target and status.",
+			[({"target": row.target, "status": row.status}, row.count) for row in replications],
+		),
+	]
+	return Response(metrics.render(families), content_type=metrics.CONTENT_TYPE)
+
+
+@frappe.whitelist()
+def get_backup_metrics(limit: int = DEFAULT_METRICS_HISTORY) -> Dict[str, Any]:
+	"""Phase timings and sizes of the latest backups, oldest first, for the Backup Center trend."""
+	_ensure_system_manager()
+	limit = min(max(int(limit or DEFAULT_METRICS_HISTORY), 1), MAX_ARCHIVE_PAGE)
+	archives = frappe.get_all(
+		"Backup Archive",
+		filters={"source": ("!=", "Uploaded"), "status": ("not in", ["Running", "Failed"])},
+		fields=["name", "title", "created_on", "files_mode", *ARCHIVE_SIZE_FIELDS],
+		order_by="created_on desc",
+		limit=limit,
+	)
+	rows = frappe.get_all(
+		"Backup Archive Phase",
+		filters={
+			"parenttype": "Backup Archive",
+			"parent": ("in", [row.name for row in archives] or [""]),
+			"operation": "Backup",
+		},
+		fields=["parent", "phase", *PHASE_METRIC_FIELDS],
+	)
+	phases_by_archive: Dict[str, Dict[str, Any]] = {}
+	for row in rows:
+		phases_by_archive.setdefault(row.parent, {})[row.phase] = {
+			field: row[field] for field in PHASE_METRIC_FIELDS
+		}
+
+	history = [
+		{
+			"name": row.name,
+			"title": row.title,
+			"created_on": row.created_on,
+			"stored_bytes": _archive_disk_bytes(row),
+			"phases": phases_by_archive[row.name],
+		}
+		for row in reversed(archives)
+		if row.name in phases_by_archive
+	]
+	return {
+		"phases": sorted({phase for row in history for phase in row["phases"]}),
+		"archives": history,
+	}
+
+
+def _replication_targets() -> Dict[str, Dict[str, Any]]:
+	targets = {}
+	for config in frappe.conf.get("backup_manager_replication_targets") or []:
+		if not config.get("name") or config.get("type") not in replication.TARGET_TYPES:
+			frappe.log_error(title=f"Invalid replication target: {config.get('name')}")
+			continue
+		if int(config.get("enabled", 1)):
+			targets[config["name"]] = config
+	return targets
+
+
+def _replication_row(doc: frappe.model.document.Document, target: str):
+	for row in doc.replications:
+		if row.target == target:
+			return row
+	return doc.append("replications", {"target": target})
+
+
+def _queue_replication(doc: frappe.model.document.Document, targets: Optional[list[str]] = None) -> list[str]:
+	configured = _replication_targets()
+	names = [name for name in (targets or configured) if name in configured]
+	if not names:
+		return []
+	for name in names:
+		row = _replication_row(doc, name)
+		row.status = "Queued"
+		row.error = None
+	doc.save(ignore_permissions=True)
+	frappe.db.commit()
+	for name in names:
+		frappe.enqueue(
+			"erpnext_backup_manager.api.run_replication_job",
+			queue="long",
+			timeout=_job_timeout(),
+			job_id=f"backup_manager_replicate::{doc.name}::{name}",
+			deduplicate=True,
+			archive_name=doc.name,
+			target=name,
+		)
+	return names
+
+
+def _start_replication(doc: frappe.model.document.Document) -> None:
+	# Replication only gets queued here; it must never hold up or fail the backup.
+	try:
+		_queue_replication(doc)
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title=f"Queueing replication failed: {doc.name}")
+
+
+def _replication_files(doc: frappe.model.document.Document, directory: Path) -> list[tuple[Path, str]]:
+	"""Files to copy as (path, key relative to the archive root).
+
+	Besides the archive directory this includes the store blobs and earlier delta tars
+	its file manifests read from; keys are shared, so those are sent only once.
+	"""
+	archive_root = _archive_root()
+	keys = set()
+	for path in directory.rglob("*"):
+		rel_path = path.relative_to(directory)
+		# Resume state and temporary files stay local.
+		if rel_path.parts[0] == REPLICATION_STATE_DIRNAME or path.name.startswith("."):
+			continue
+		if path.is_file():
+			keys.add(path.relative_to(archive_root).as_posix())
+	components = _archive_components(doc)
+	for kind in ("public", "private"):
+		if is_manifest(components.get(kind)):
+			keys.update(content_paths(components[kind]))
+	return [(archive_root / key, key) for key in sorted(keys)]
+
+
+def run_replication_job(archive_name: str, target: str) -> None:
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	row = _replication_row(doc, target)
+	if row.is_new():
+		doc.save(ignore_permissions=True)
+
+	def update(**values: Any) -> None:
+		frappe.db.set_value(row.doctype, row.name, values, update_modified=False)
+		frappe.db.commit()
+
+	update(
+		status="Running",
+		attempts=(row.attempts or 0) + 1,
+		started_on=now_datetime(),
+		finished_on=None,
+		error=None,
+	)
+	last_update = [0.0]
+
+	def progress(done: int, total: int) -> None:
+		if time.monotonic() - last_update[0] >= REPLICATION_PROGRESS_INTERVAL:
+			last_update[0] = time.monotonic()
+			update(bytes_done=done, bytes_total=total)
+
+	try:
+		config = _replication_targets().get(target)
+		if not config:
+			frappe.throw(
+				_("Replication target {0} is not configured.").format(target), frappe.ValidationError
+			)
+		directory = _archive_dir(doc)
+		if not directory:
+			frappe.throw(
+				_("Archive {0} has no directory of its own.").format(archive_name), frappe.ValidationError
+			)
+		state = replication.ReplicationState(directory / REPLICATION_STATE_DIRNAME / f"{target}.json")
+		# Remote layout: <prefix>/<archive directory>/..., prefix defaulting to the site name.
+		remote = replication.make_target({"prefix": frappe.local.site, **config})
+		try:
+			result = replication.replicate(remote, _replication_files(doc, directory), state, progress)
+		finally:
+			remote.close()
+	except Exception as exc:
+		frappe.db.rollback()
+		update(status="Failed", error=str(exc), finished_on=now_datetime())
+		raise
+	update(
+		status="Replicated",
+		bytes_done=result["bytes"],
+		bytes_total=result["bytes"],
+		finished_on=now_datetime(),
+	)
+
+
+def queue_pending_replications() -> int:
+	"""Queue recent archives a target has no copy of yet, and failed replications to retry."""
+	targets = _replication_targets()
+	if not targets:
+		return 0
+	max_attempts = int(
+		frappe.conf.get("backup_manager_replication_max_attempts") or DEFAULT_REPLICATION_ATTEMPTS
+	)
+	since = frappe.utils.add_days(now_datetime(), -REPLICATION_CATCHUP_DAYS)
+	queued = 0
+	names = frappe.get_all(
+		"Backup Archive",
+		filters={"status": ("in", ["Ready", "Restored"]), "created_on": (">=", since)},
+		pluck="name",
+	)
+	for name in names:
+		doc = frappe.get_doc("Backup Archive", name)
+		rows = {row.target: row for row in doc.replications}
+		due = [
+			target
+			for target in targets
+			if target not in rows
+			or (rows[target].status == "Failed" and (rows[target].attempts or 0) < max_attempts)
+		]
+		if due:
+			queued += len(_queue_replication(doc, due))
+	return queued
+
+
+@frappe.whitelist(methods=["POST"])
+def replicate_archive(archive_name: str, target: Optional[str] = None) -> Dict[str, Any]:
+	"""Copy an archive to one or all replication targets in the background."""
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	doc.check_permission("write")
+	if doc.status not in ("Ready", "Restored"):
+		frappe.throw(_("Only finished archives can be replicated."), frappe.ValidationError)
+	configured = _replication_targets()
+	if not configured:
+		frappe.throw(_("No replication targets are configured."), frappe.ValidationError)
+	if target and target not in configured:
+		frappe.throw(_("Replication target {0} is not configured.").format(target), frappe.ValidationError)
+	return {"archive": archive_name, "targets": _queue_replication(doc, [target] if target else None)}
+
+
+def _retention_policy() -> Dict[str, Any]:
+	policy: Dict[str, Any] = {
+		rule: int(frappe.conf.get(f"backup_manager_retention_{rule}") or 0) for rule in RETENTION_RULES
+	}
+	max_gb = frappe.conf.get("backup_manager_retention_max_total_gb")
+	policy["max_total_bytes"] = int(float(max_gb) * 1024**3) if max_gb else None
+	return policy
+
+
+def _retention_enabled(policy: Dict[str, Any]) -> bool:
+	# With no rule configured nothing is pruned; an empty policy would otherwise keep only
+	# the newest archive.
+	return any(policy[rule] for rule in RETENTION_RULES) or policy["max_total_bytes"] is not None
+
+
+def _archive_disk_bytes(row: Dict[str, Any]) -> int:
+	if row.files_mode in (FILE_BACKUP_MODES["dedup"], FILE_BACKUP_MODES["incremental"]):
+		files = int(row.files_stored_size or 0)
+	else:
+		files = int(row.public_size or 0) + int(row.private_size or 0)
+	return int(row.db_size or 0) + int(row.bundle_size or 0) + files
+
+
+def _archive_dir(row: Dict[str, Any]) -> Optional[Path]:
+	"""The per-archive directory directly below the archive root, if the row has one."""
+	archive_root = _archive_root().resolve()
+	for field in ("db_file_path", "public_file_path", "private_file_path", "bundle_file_path"):
+		if row.get(field):
+			directory = _private_abs(row[field]).parent.resolve()
+			if directory.parent == archive_root and directory.name not in (STORE_DIRNAME, TRASH_DIRNAME):
+				return directory
+	return None
+
+
+def _retention_plan(policy: Dict[str, Any]) -> Dict[str, Any]:
+	rows = frappe.get_all(
+		"Backup Archive",
+		fields=[
+			"name",
+			"title",
+			"status",
+			"creation",
+			"db_file_path",
+			"db_size",
+			"public_file_path",
+			"public_size",
+			"private_file_path",
+			"private_size",
+			"bundle_file_path",
+			"bundle_size",
+			"files_mode",
+			"files_stored_size",
+			"previous_archive",
+			"restore_started_on",
+		],
+	)
+	archives = [
+		{
+			"name": row.name,
+			"title": row.title,
+			"status": row.status,
+			"created": row.creation,
+			"bytes": _archive_disk_bytes(row),
+			# A failed restore leaves the backup itself intact; a running backup is not one yet.
+			"valid": row.status not in ("Running", "Failed") or bool(row.restore_started_on),
+			"previous": row.previous_archive,
+			# Running backups and restores in progress are never pruned, nor is their chain.
+			"in_use": row.status in ("Running", "Restoring"),
+			"directory": _archive_dir(row),
+		}
+		for row in rows
+	]
+	return retention.plan(archives, **policy)
+
+
+def _collect_store_garbage() -> Dict[str, int]:
+	"""Delete deduplicated blobs no remaining manifest refers to."""
+	objects_dir = _archive_root() / STORE_DIRNAME / "objects"
+	if not objects_dir.is_dir() or frappe.db.exists("Backup Archive", {"status": "Running"}):
+		return {"blobs": 0, "bytes": 0}
+
+	manifests = []
+	for row in frappe.get_all(
+		"Backup Archive",
+		filters={"files_mode": FILE_BACKUP_MODES["dedup"]},
+		fields=["public_file_path", "private_file_path"],
+	):
+		manifests.extend(_private_abs(path) for path in (row.public_file_path, row.private_file_path) if path)
+	referenced = referenced_blobs(manifests)
+
+	removed = {"blobs": 0, "bytes": 0}
+	cutoff = time.time() - STORE_GC_GRACE
+	for bucket in objects_dir.iterdir():
+		for blob in bucket.iterdir():
+			if blob.name in referenced or blob.name.startswith("."):
+				continue
+			stat = blob.stat()
+			if stat.st_mtime > cutoff:
+				continue
+			blob.unlink()
+			removed["blobs"] += 1
+			removed["bytes"] += stat.st_size
+	return removed
+
+
+def _apply_retention(plan: Dict[str, Any]) -> Dict[str, int]:
+	"""Remove pruned archives.
+
+	Directories are first moved aside and the rows deleted in one transaction; the moved
+	data is only deleted from disk once that has committed.
+	"""
+	if not plan["prune"]:
+		return {"archives": 0}
+
+	kept_dirs = {archive["directory"] for archive in plan["keep"]}
+	trash = _archive_root() / TRASH_DIRNAME / now_datetime().strftime("%Y%m%d_%H%M%S_%f")
+	trash.mkdir(parents=True, exist_ok=True)
+	moved = []
+	try:
+		for archive in plan["prune"]:
+			directory = archive["directory"]
+			if directory and directory.is_dir() and directory not in kept_dirs:
+				# A rename within the archive filesystem, so this is quick even for large trees.
+				target = trash / directory.name
+				os.rename(directory, target)
+				moved.append((directory, target))
+		pruned = [archive["name"] for archive in plan["prune"]]
+		# frappe.db.delete does not cascade to the child tables (replications, phases).
+		for table in frappe.get_meta("Backup Archive").get_table_fields():
+			frappe.db.delete(table.options, {"parenttype": "Backup Archive", "parent": ("in", pruned)})
+		frappe.db.delete("Backup Archive", {"name": ("in", pruned)})
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		for directory, target in reversed(moved):
+			os.rename(target, directory)
+		raise
+
+	# frappe.db.delete skips the controller hooks that drop the cached listing and publish the rows.
+	clear_archive_list_cache()
+	for name in pruned:
+		_publish_archive_event("delete", name, {}, after_commit=False)
+	shutil.rmtree(trash, ignore_errors=True)
+	return {"archives": len(plan["prune"]), "directories": len(moved)}
+
+
+def run_retention(dry_run: bool = True) -> Dict[str, Any]:
+	policy = _retention_policy()
+	if not _retention_enabled(policy):
+		return {"enabled": False, "dry_run": dry_run, "policy": policy}
+
+	token = None
+	if not dry_run:
+		# Pruning holds the backup lock, so no backup can start from a base the plan drops
+		# and the blob collection never races a dedup backup.
+		try:
+			token = _acquire_backup_lock("retention", _job_timeout())
+		except BackupLockedError:
+			frappe.clear_messages()
+			frappe.db.set_global(RETENTION_PENDING_KEY, "1")
+			frappe.db.commit()
+			return {
+				"enabled": True,
+				"dry_run": dry_run,
+				"policy": policy,
+				"deferred": _backup_lock_holder() or _("unknown"),
+			}
+
+	try:
+		plan = _retention_plan(policy)
+		result: Dict[str, Any] = {
+			"enabled": True,
+			"dry_run": dry_run,
+			"policy": policy,
+			"bytes_freed": plan["bytes_freed"],
+			"bytes_kept": plan["bytes_kept"],
+			"prune": [
+				{key: archive[key] for key in ("name", "title", "status", "created", "bytes")}
+				for archive in plan["prune"]
+			],
+			"keep": [{"name": archive["name"], "reasons": archive["reasons"]} for archive in plan["keep"]],
+		}
+		if not dry_run:
+			result["removed"] = _apply_retention(plan)
+			result["store"] = _collect_store_garbage()
+			frappe.db.set_global(RETENTION_PENDING_KEY, None)
+			frappe.db.commit()
+	finally:
+		_release_backup_lock(token)
+	return result
+
+
+def run_deferred_retention() -> None:
+	"""Apply a retention run that found a backup or restore in progress."""
+	if frappe.db.get_global(RETENTION_PENDING_KEY):
+		run_retention(dry_run=False)
+
+
+@frappe.whitelist(methods=["POST"])
+def prune_archives(dry_run: int = 1) -> Dict[str, Any]:
+	_ensure_system_manager()
+	return run_retention(dry_run=bool(int(dry_run)))
+
+
+def _schedule_setting(name: str) -> Any:
+	value = frappe.conf.get(f"backup_manager_schedule_{name}")
+	return SCHEDULE_DEFAULTS[name] if value is None else value
+
+
+def _backup_schedules() -> list[Dict[str, Any]]:
+	schedules = []
+	for entry in frappe.conf.get("backup_manager_schedules") or []:
+		if not entry.get("cron") or not schedule.validate_cron(entry["cron"]):
+			frappe.log_error(title=f"Invalid backup schedule: {entry}")
+			continue
+		schedules.append({"name": entry.get("name") or entry["cron"], **entry})
+	return schedules
+
+
+def _db_threads_running() -> Optional[int]:
+	if frappe.conf.db_type == "postgres":
+		return None
+	row = frappe.db.sql("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+	return int(row[0][1]) if row else None
+
+
+def _load_reason() -> Optional[str]:
+	"""Why the host is too busy for a scheduled backup, or None when it is quiet enough.
+
+	A threshold set to 0 in site_config disables that check.
+	"""
+	checks = (
+		("load per CPU", schedule.load_per_cpu, "max_load_per_cpu"),
+		("database threads running", _db_threads_running, "max_db_threads"),
+		("I/O wait %", schedule.io_wait_percent, "max_iowait"),
+	)
+	for label, probe, setting in checks:
+		limit = float(_schedule_setting(setting) or 0)
+		if not limit:
+			continue
+		value = probe()
+		if value is not None and value > limit:
+			return f"{label} {value:.1f} > {limit:g}"
+	return None
+
+
+def _schedule_state_key(name: str) -> str:
+	return f"{SCHEDULE_STATE_KEY}:{name}"
+
+
+def _last_run_key(name: str) -> str:
+	return f"backup_manager_schedule_last_run:{name}"
+
+
+def _defer_schedule(name: str, state: Dict[str, Any], reason: str) -> None:
+	state["attempts"] += 1
+	state["retry_at"] = time.time() + schedule.backoff_delay(
+		state["attempts"], int(_schedule_setting("retry_base")), int(_schedule_setting("retry_cap"))
+	)
+	state["reason"] = reason
+	_cache().set_value(_schedule_state_key(name), state, expires_in_sec=PROGRESS_TTL)
+
+
+def _run_schedule(entry: Dict[str, Any], now: datetime.datetime) -> Optional[str]:
+	"""Start the backup of one schedule if it is due; returns the archive name if started."""
+	name = entry["name"]
+	# Pending deferrals live in Redis; the last start time is kept in the database so a
+	# cache flush does not re-run or skip a schedule.
+	state = _cache().get_value(_schedule_state_key(name))
+	if not state:
+		last_run = frappe.db.get_default(_last_run_key(name))
+		if not last_run:
+			# A new schedule starts counting from now: its first backup is at the next
+			# matching time, not on the tick it was added.
+			frappe.db.set_default(_last_run_key(name), str(now))
+			return None
+		due = schedule.next_run(entry["cron"], frappe.utils.get_datetime(last_run))
+		if due > now:
+			return None
+		state = {"due": _datetime_timestamp(due), "attempts": 0, "retry_at": 0}
+
+	if time.time() < state["retry_at"]:
+		return None
+
+	holder = _backup_lock_holder()
+	reason = f"busy: {holder}" if holder else _load_reason()
+	overdue = time.time() - state["due"] > int(_schedule_setting("max_delay"))
+	# Past the window a loaded host no longer blocks the backup; a running backup or
+	# restore still does, since the two must never overlap.
+	if reason and (holder or not overdue):
+		_defer_schedule(name, state, reason)
+		return None
+
+	try:
+		doc = _queue_backup(
+			entry.get("label") or f"Scheduled backup ({name})",
+			bool(int(entry.get("include_files", 1))),
+			bool(int(entry.get("bundle", 1))),
+			"Scheduled",
+			_db_dump_options(entry),
+		)
+	except BackupLockedError:
+		# Lost a race with a manual backup; retry on the next tick.
+		frappe.clear_messages()
+		return None
+	except InsufficientSpaceError as exc:
+		# Retention or an operator may free space; retried with the same backoff as a busy host.
+		frappe.clear_messages()
+		if not state["attempts"]:
+			frappe.log_error(title=f"Scheduled backup deferred: {name}", message=str(exc))
+		_defer_schedule(name, state, f"disk: {exc}")
+		return None
+	if reason:
+		doc.add_comment("Comment", f"Started after waiting {state['attempts']} times ({reason}).")
+	frappe.db.set_default(_last_run_key(name), str(now))
+	_cache().delete_value(_schedule_state_key(name))
+	frappe.db.commit()
+	return doc.name
+
+
+def run_scheduled_backups() -> None:
+	now = now_datetime()
+	for entry in _backup_schedules():
+		_run_schedule(entry, now)
+
+
+@frappe.whitelist()
+def get_schedule_status() -> Dict[str, Any]:
+	_ensure_system_manager()
+	now = now_datetime()
+	schedules = []
+	for entry in _backup_schedules():
+		last_run = frappe.db.get_default(_last_run_key(entry["name"]))
+		state = _cache().get_value(_schedule_state_key(entry["name"])) or {}
+		schedules.append(
+			{
+				"name": entry["name"],
+				"cron": entry["cron"],
+				"last_run": last_run,
+				"next_run": schedule.next_run(entry["cron"], frappe.utils.get_datetime(last_run) or now),
+				"deferrals": state.get("attempts", 0),
+				"deferred_reason": state.get("reason"),
+				"retry_at": state.get("retry_at") or None,
+			}
+		)
+	return {"lock_holder": _backup_lock_holder(), "schedules": schedules}
+
+
+def _encode_cursor(value: Any, name: str) -> str:
+	raw = json.dumps([str(value) if value is not None else None, name])
+	return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[Any, str]:
+	try:
+		value, name = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+	except ValueError:
+		frappe.throw(_("Invalid cursor."), frappe.ValidationError)
+	return value, name
+
+
+def _archive_conditions(table, filters: Dict[str, Any]) -> list:
+	conditions = []
+	if filters.get("source"):
+		conditions.append(table.source == filters["source"])
+	if filters.get("status"):
+		conditions.append(table.status == filters["status"])
+	if filters.get("from_date"):
+		conditions.append(table.creation >= frappe.utils.get_datetime(filters["from_date"]))
+	if filters.get("to_date"):
+		# A bare date includes the whole day.
+		to_date = frappe.utils.add_days(frappe.utils.getdate(filters["to_date"]), 1)
+		conditions.append(table.creation < to_date)
+	return conditions
+
+
+def _query_archive_page(
+	filters: Dict[str, Any], sort_by: str, descending: bool, limit: int, cursor: Optional[str]
+) -> Dict[str, Any]:
+	table = frappe.qb.DocType("Backup Archive")
+	conditions = _archive_conditions(table, filters)
+	sort_field = table[sort_by]
+
+	# Keyset pagination on (sort field, name): pages stay stable while new archives arrive
+	# and the database never skips over earlier rows the way OFFSET does.
+	page = frappe.qb.from_(table).select(*(table[field] for field in ARCHIVE_LIST_FIELDS))
+	for condition in conditions:
+		page = page.where(condition)
+	if cursor:
+		value, name = _decode_cursor(cursor)
+		if descending:
+			page = page.where((sort_field < value) | ((sort_field == value) & (table.name < name)))
+		else:
+			page = page.where((sort_field > value) | ((sort_field == value) & (table.name > name)))
+	order = frappe.qb.desc if descending else frappe.qb.asc
+	page = page.orderby(sort_field, order=order).orderby(table.name, order=order).limit(limit + 1)
+	rows = page.run(as_dict=True)
+
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = _encode_cursor(rows[-1][sort_by], rows[-1]["name"])
+
+	return {"archives": rows, "next_cursor": next_cursor, "totals": _archive_totals(conditions)}
+
+
+def _archive_totals(conditions: list) -> Dict[str, int]:
+	"""Archive count and summed sizes of the archives matching `conditions`."""
+	table = frappe.qb.DocType("Backup Archive")
+	totals_query = frappe.qb.from_(table).select(
+		Count(table.name).as_("count"),
+		*(Sum(table[field]).as_(field) for field in ARCHIVE_SIZE_FIELDS),
+	)
+	for condition in conditions:
+		totals_query = totals_query.where(condition)
+	totals = totals_query.run(as_dict=True)[0]
+	return {key: int(value or 0) for key, value in totals.items()}
+
+
+@frappe.whitelist()
+def list_archives(
+	limit: int = DEFAULT_ARCHIVE_PAGE,
+	cursor: Optional[str] = None,
+	source: Optional[str] = None,
+	status: Optional[str] = None,
+	from_date: Optional[str] = None,
+	to_date: Optional[str] = None,
+	sort_by: str = "creation",
+	sort_order: str = "desc",
+) -> Dict[str, Any]:
+	_ensure_system_manager()
+	limit = min(max(int(limit or DEFAULT_ARCHIVE_PAGE), 1), MAX_ARCHIVE_PAGE)
+	sort_by = sort_by or "creation"
+	if sort_by not in ARCHIVE_SORT_FIELDS:
+		frappe.throw(_("Cannot sort archives by {0}.").format(sort_by), frappe.ValidationError)
+	sort_order = (sort_order or "desc").lower()
+	if sort_order not in ("asc", "desc"):
+		frappe.throw(_("Sort order must be asc or desc."), frappe.ValidationError)
+
+	filters = {"source": source, "status": status, "from_date": from_date, "to_date": to_date}
+	params = json.dumps([filters, sort_by, sort_order, limit, cursor], sort_keys=True, default=str)
+	cache_key = hashlib.sha1(params.encode()).hexdigest()
+	page = _cache().hget(ARCHIVE_LIST_CACHE_KEY, cache_key)
+	if page is None:
+		page = _query_archive_page(filters, sort_by, sort_order == "desc", limit, cursor)
+		_cache().hset(ARCHIVE_LIST_CACHE_KEY, cache_key, page)
+
+	# Clients append the quoted relative path (or archive name) instead of receiving one
+	# absolute URL per file per row.
+	return {
+		**page,
+		"download_base_url": frappe.utils.get_url(
+			"/api/method/erpnext_backup_manager.api.download_archive_file?path="
+		),
+		"bundle_base_url": frappe.utils.get_url(
+			"/api/method/erpnext_backup_manager.api.download_archive_bundle?archive_name="
+		),
+		"bundle_streamed": _bundle_streamed(),
+	}
+
+
+def _x_accel_response(path: Path) -> Response:
+	# nginx serves "/protected/<private_path>/..." from the site folder for internal redirects,
+	# the same location Frappe uses for private files.
+	prefix = frappe.conf.get("backup_manager_x_accel_prefix") or "/protected/"
+	private_dir = frappe.conf.get("private_path") or "private"
+	internal_path = f"{prefix.rstrip('/')}/{private_dir.strip('/')}/{_to_private_relative(path)}"
+
+	response = Response(mimetype=mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+	response.headers["X-Accel-Redirect"] = quote(internal_path)
+	response.headers.set("Content-Disposition", "attachment", filename=path.name)
+	return response
+
+
+@frappe.whitelist()
+def download_archive_file(path: str):
+	_ensure_system_manager()
+	resolved = _private_abs(path)
+	if not resolved.is_file():
+		frappe.throw(_("Archive file not found."), frappe.DoesNotExistError)
+	make_access_log(report_name="Backup")
+
+	if is_manifest(resolved):
+		# Deduplicated file backups are rebuilt into the tar `bench restore` expects on the fly.
+		response = Response(
+			iter_tar(resolved, _archive_root()),
+			mimetype="application/x-tar",
+			direct_passthrough=True,
+		)
+		response.headers.set("Content-Disposition", "attachment", filename=tar_name(resolved))
+		return response
+	if is_dump_manifest(resolved):
+		# Per-table dumps are served as the single dump `bench restore` expects, like the bundle.
+		response = Response(iter_sql(resolved), mimetype="application/octet-stream", direct_passthrough=True)
+		response.headers.set("Content-Disposition", "attachment", filename=sql_name(resolved))
+		return response
+
+	# Only site_config turns this on: a request header would let any client ask for a
+	# redirect to a location nginx may not have configured.
+	if frappe.conf.get("backup_manager_use_x_accel_redirect"):
+		return _x_accel_response(resolved)
+
+	# send_file answers Range/If-Range and conditional requests from the file's size and
+	# mtime, and hands full-body transfers to the server's wsgi.file_wrapper (sendfile).
+	return send_file(
+		str(resolved),
+		frappe.request.environ,
+		as_attachment=True,
+		download_name=resolved.name,
+		conditional=True,
+		etag=True,
+	)
+
+
+@frappe.whitelist()
+def download_archive_bundle(archive_name: str):
+	_ensure_system_manager()
+	doc = frappe.get_doc("Backup Archive", archive_name)
+	members = []
+	for rel_path in (doc.db_file_path, doc.public_file_path, doc.private_file_path, doc.config_file_path):
+		if not rel_path:
+			continue
+		path = _private_abs(rel_path)
+		if is_manifest(path):
+			members.append((tar_name(path), iter_tar(path, _archive_root())))
+		elif is_dump_manifest(path):
+			members.append((sql_name(path), iter_sql(path)))
+		else:
+			members.append(path)
+	if not members:
+		frappe.throw(_("Archive has no files to bundle."), frappe.ValidationError)
+
+	response = Response(
+		stream_bundle(members, **_bundle_options()),
+		mimetype="application/zip",
+		direct_passthrough=True,
+	)
+	response.headers.set("Content-Disposition", "attachment", filename=f"{doc.name}_bundle.zip")
+	return response
+
+
+def _ensure_file_content(*paths: Optional[Path]) -> None:
+	"""Refuse a restore whose manifests point at blobs or increment tars that are gone."""
+	archive_root = _archive_root()
+	for path in paths:
+		if not is_manifest(path):
+			continue
+		if not path.exists():
+			frappe.throw(_("Archive file is missing: {0}").format(path.name), frappe.ValidationError)
+		missing = missing_content(path, archive_root)
+		if missing:
+			frappe.throw(
+				_("File backup {0} is incomplete; {1} stored items are missing, for example {2}.").format(
+					path.name, len(missing), missing[0]
+				),
+				frappe.ValidationError,
+			)
+
+
+@frappe.whitelist()
+def restore_from_archive(
+	archive_name: str,
+	db_root_username: Optional[str] = None,
+	db_root_password: Optional[str] = None,
+	admin_password: Optional[str] = None,
+	restore_engine: Optional[str] = None,
+) -> Dict[str, Any]:
+	_ensure_system_manager()
+	archive_doc = frappe.get_doc("Backup Archive", archive_name)
+	archive_doc.check_permission("write")
+	if not archive_doc.db_file_path:
+		frappe.throw(_("Archive is missing a database backup file."), frappe.ValidationError)
+
+	db_path = _private_abs(archive_doc.db_file_path)
 	public_path = _private_abs(archive_doc.public_file_path) if archive_doc.public_file_path else None
 	private_path = _private_abs(archive_doc.private_file_path) if archive_doc.private_file_path else None
+	_ensure_file_content(public_path, private_path)
 
 	return _start_restore(
 		archive_doc=archive_doc,
@@ -424,53 +3533,548 @@ def restore_from_archive(
 		db_root_username=db_root_username,
 		db_root_password=db_root_password,
 		admin_password=admin_password,
+		restore_engine=restore_engine,
 	)
 
 
+def _upload_dir(upload_id: str) -> Path:
+	if not UPLOAD_ID_PATTERN.fullmatch(upload_id or ""):
+		frappe.throw(_("Invalid upload id."), frappe.ValidationError)
+	upload_dir = _archive_root() / UPLOADS_DIRNAME / upload_id
+	if not upload_dir.is_dir():
+		frappe.throw(_("Upload {0} was not found or has expired.").format(upload_id), frappe.ValidationError)
+	return upload_dir
+
+
+def _read_upload_state(upload_dir: Path) -> Dict[str, Any]:
+	return json.loads((upload_dir / UPLOAD_STATE_FILE).read_text(encoding="utf-8"))
+
+
+def _write_upload_state(upload_dir: Path, state: Dict[str, Any]) -> None:
+	(upload_dir / UPLOAD_STATE_FILE).write_text(json.dumps(state), encoding="utf-8")
+
+
+def _upload_file_name(kind: str, filename: str) -> str:
+	if kind not in UPLOAD_KINDS:
+		frappe.throw(
+			_("Upload kind must be one of: {0}").format(", ".join(UPLOAD_KINDS)), frappe.ValidationError
+		)
+	name = Path(filename or "").name
+	if not name or name.startswith(".") or name == UPLOAD_STATE_FILE:
+		frappe.throw(_("Invalid file name."), frappe.ValidationError)
+	if kind == "db" and not any(name.lower().endswith(ext) for ext in ALLOWED_DB_EXTENSIONS):
+		frappe.throw(_("Database backup must be a .sql, .sql.gz or .sql.zst file."), frappe.ValidationError)
+	return name
+
+
+def _upload_payload(upload_id: str, upload_dir: Path, state: Dict[str, Any]) -> Dict[str, Any]:
+	files = {}
+	for kind, entry in state.items():
+		received = _file_size(upload_dir / entry["filename"])
+		files[kind] = {**entry, "received": received, "complete": received == entry["total_size"]}
+	return {"upload_id": upload_id, "files": files}
+
+
+@frappe.whitelist(methods=["POST"])
+def upload_backup_chunk(
+	kind: str,
+	filename: str,
+	offset: int,
+	total_size: int,
+	upload_id: Optional[str] = None,
+) -> Dict[str, Any]:
+	"""Append one chunk (multipart field ``chunk``) of a backup file to a resumable upload.
+
+	Files are written straight into the archive, skipping the site's File uploads. A chunk
+	is only written at the current end of its file; one sent for any other offset is
+	skipped and `received` in the response says where to continue, so retrying a chunk
+	or resuming an interrupted upload is always safe.
+	"""
+	_ensure_system_manager()
+	name = _upload_file_name(kind, filename)
+	offset, total_size = int(offset), int(total_size)
+	if total_size <= 0:
+		frappe.throw(_("File size must be greater than zero."), frappe.ValidationError)
+
+	if upload_id:
+		upload_dir = _upload_dir(upload_id)
+		state = _read_upload_state(upload_dir)
+	else:
+		upload_id = uuid.uuid4().hex
+		upload_dir = _archive_root() / UPLOADS_DIRNAME / upload_id
+		upload_dir.mkdir(parents=True)
+		state = {}
+
+	entry = {"filename": name, "total_size": total_size}
+	if state.get(kind) != entry:
+		if any(other["filename"] == name for other_kind, other in state.items() if other_kind != kind):
+			frappe.throw(_("File {0} is already part of this upload.").format(name), frappe.ValidationError)
+		if kind in state:
+			(upload_dir / state[kind]["filename"]).unlink(missing_ok=True)
+		state[kind] = entry
+		_write_upload_state(upload_dir, state)
+
+	path = upload_dir / name
+	received = _file_size(path)
+	if offset == received and received < total_size:
+		chunk = frappe.request.files.get("chunk")
+		if not chunk:
+			frappe.throw(_("Upload chunk is missing."), frappe.ValidationError)
+		with open(path, "ab") as handle:
+			shutil.copyfileobj(chunk.stream, handle, CHUNK_SIZE)
+		if _file_size(path) > total_size:
+			os.truncate(path, received)
+			frappe.throw(_("Upload chunk goes past the declared file size."), frappe.ValidationError)
+
+	return _upload_payload(upload_id, upload_dir, state)
+
+
+@frappe.whitelist()
+def get_upload_status(upload_id: str) -> Dict[str, Any]:
+	_ensure_system_manager()
+	upload_dir = _upload_dir(upload_id)
+	return _upload_payload(upload_id, upload_dir, _read_upload_state(upload_dir))
+
+
+@frappe.whitelist(methods=["POST"])
+def discard_upload(upload_id: str) -> None:
+	_ensure_system_manager()
+	shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
+
+
+def _completed_upload(upload_id: str) -> tuple[Path, Dict[str, Path]]:
+	upload_dir = _upload_dir(upload_id)
+	files = _upload_payload(upload_id, upload_dir, _read_upload_state(upload_dir))["files"]
+	if "db" not in files:
+		frappe.throw(_("DB backup file is required."), frappe.ValidationError)
+	incomplete = [entry["filename"] for entry in files.values() if not entry["complete"]]
+	if incomplete:
+		frappe.throw(
+			_("Upload is not complete yet: {0}").format(", ".join(incomplete)), frappe.ValidationError
+		)
+	return upload_dir, {kind: upload_dir / entry["filename"] for kind, entry in files.items()}
+
+
+def remove_stale_uploads() -> int:
+	"""Delete chunked uploads nobody has written to for `STALE_UPLOAD_AGE` seconds."""
+	uploads = _archive_root() / UPLOADS_DIRNAME
+	if not uploads.is_dir():
+		return 0
+	cutoff = time.time() - STALE_UPLOAD_AGE
+	removed = 0
+	for upload_dir in uploads.iterdir():
+		if not upload_dir.is_dir():
+			continue
+		# Appending to a file does not touch the directory mtime, so look at the files.
+		last_write = max(
+			(path.stat().st_mtime for path in upload_dir.iterdir()), default=upload_dir.stat().st_mtime
+		)
+		if last_write < cutoff:
+			shutil.rmtree(upload_dir, ignore_errors=True)
+			removed += 1
+	return removed
+
+
+def _delete_uploaded_files(file_urls: Iterable[str]) -> None:
+	for file_url in file_urls:
+		path = urlparse(file_url).path or file_url
+		for name in frappe.get_all("File", filters={"file_url": path}, pluck="name"):
+			frappe.delete_doc("File", name)
+	frappe.db.commit()
+
+
 @frappe.whitelist()
 def restore_from_upload(
-	db_file: str,
+	db_file: Optional[str] = None,
 	public_file: Optional[str] = None,
 	private_file: Optional[str] = None,
 	db_root_username: Optional[str] = None,
 	db_root_password: Optional[str] = None,
 	admin_password: Optional[str] = None,
+	upload_id: Optional[str] = None,
+	delete_uploaded: int = 0,
+	restore_engine: Optional[str] = None,
 ) -> Dict[str, Any]:
+	"""Restore from a chunked upload (`upload_id`) or from files uploaded to the site.
+
+	Either way the files are moved or linked into a new archive rather than copied where
+	the filesystem allows it; `delete_uploaded` also deletes the site File records.
+	"""
 	_ensure_system_manager()
-	if not db_file:
+	if upload_id:
+		chunked_dir, sources = _completed_upload(upload_id)
+	elif db_file:
+		uploaded = {"db": db_file, "public": public_file, "private": private_file}
+		sources = {kind: _resolve_uploaded_file(url) for kind, url in uploaded.items() if url}
+	else:
 		frappe.throw(_("DB backup file is required."), frappe.ValidationError)
 
-	uploaded_db = _resolve_uploaded_file(db_file)
-	uploaded_public = _resolve_uploaded_file(public_file) if public_file else None
-	uploaded_private = _resolve_uploaded_file(private_file) if private_file else None
+	if _disk_preflight_enabled():
+		# Files on the archive's filesystem are renamed or linked into place; the rest are copied.
+		device = _archive_root().stat().st_dev
+		_ensure_space(
+			[
+				(_archive_root(), source.stat().st_size)
+				for source in sources.values()
+				if source.stat().st_dev != device
+			]
+		)
 
 	timestamp = now_datetime().strftime("%Y%m%d_%H%M%S")
 	stamp = f"{timestamp}_{frappe.local.site.replace('.', '_')}"
-	upload_dir = _archive_root() / f"uploaded_{stamp}"
-	upload_dir.mkdir(parents=True, exist_ok=True)
-
-	db_path = _copy_to_archive(uploaded_db, upload_dir)
-	public_path = _copy_to_archive(uploaded_public, upload_dir) if uploaded_public else None
-	private_path = _copy_to_archive(uploaded_private, upload_dir) if uploaded_private else None
+	archive_dir = _archive_root() / f"uploaded_{stamp}"
+	archive_dir.mkdir(parents=True, exist_ok=True)
+
+	paths, checksums, methods = {}, {}, set()
+	timer = PhaseTimer()
+	with timer.measure("copy") as sizes:
+		for kind, source in sources.items():
+			# Chunked uploads already live in the archive, so they are simply renamed into place.
+			paths[kind], checksums[kind], method = _import_to_archive(
+				source, archive_dir, move=bool(upload_id)
+			)
+			methods.add(method)
+		sizes["bytes_in"] = sizes["bytes_out"] = sum(checksum["size"] for checksum in checksums.values())
+	if upload_id:
+		shutil.rmtree(chunked_dir, ignore_errors=True)
 
 	doc = _create_archive_record(
 		title=f"Uploaded Backup {timestamp}",
 		source="Uploaded",
 		status="Ready",
-		db_path=db_path,
-		public_path=public_path,
-		private_path=private_path,
+		db_path=paths["db"],
+		public_path=paths.get("public"),
+		private_path=paths.get("private"),
 		bundle_path=None,
 		config_path=None,
-		notes="Uploaded via Backup Center",
+		notes=f"Uploaded via Backup Center (imported by {', '.join(sorted(methods))})",
+		checksums=checksums,
+		phases=timer.phases,
 	)
+	if int(delete_uploaded or 0) and not upload_id:
+		_delete_uploaded_files(url for url in uploaded.values() if url)
+	_spawn_catalog_build(archive_dir, doc.name, paths["db"], paths.get("public"), paths.get("private"))
 
 	return _start_restore(
 		archive_doc=doc,
-		db_path=db_path,
-		public_path=public_path,
-		private_path=private_path,
+		db_path=paths["db"],
+		public_path=paths.get("public"),
+		private_path=paths.get("private"),
 		db_root_username=db_root_username,
 		db_root_password=db_root_password,
 		admin_password=admin_password,
+		# The uploads were hashed and gzip-checked while they were imported.
+		verify=False,
+		restore_engine=restore_engine,
+	)
+
+
+def _selective_state_path(restore_id: str) -> Path:
+	if not SELECTIVE_ID_PATTERN.fullmatch(restore_id or ""):
+		frappe.throw(_("Invalid selective restore id."), frappe.ValidationError)
+	return _archive_root() / SELECTIVE_DIRNAME / f"{restore_id}.json"
+
+
+def _read_selective_state(restore_id: str) -> Dict[str, Any]:
+	state = read_status(_selective_state_path(restore_id))
+	if not state:
+		frappe.throw(_("Selective restore {0} was not found.").format(restore_id), frappe.ValidationError)
+	return state
+
+
+def _quote_table(name: str) -> str:
+	return "`" + name.replace("`", "``") + "`"
+
+
+def _selective_tables(
+	doctype: Optional[str],
+	names: Optional[list[str]],
+	tables: Optional[list[str]],
+	filters: Optional[Dict[str, Any]],
+) -> tuple[list[str], Dict[str, Any]]:
+	"""Tables to restore and their row filters; a DocType brings its child tables along."""
+	tables = list(tables or [])
+	filters = dict(filters or {})
+	if doctype:
+		meta = frappe.get_meta(doctype)
+		if meta.issingle:
+			frappe.throw(_("Single DocTypes cannot be restored selectively."), frappe.ValidationError)
+		children = list(dict.fromkeys(df.options for df in meta.get_table_fields()))
+		tables += [f"tab{doctype}", *(f"tab{child}" for child in children)]
+		if names:
+			filters.setdefault(f"tab{doctype}", {"name": ["in", names]})
+			for child in children:
+				filters.setdefault(f"tab{child}", {"parent": ["in", names], "parenttype": doctype})
+	tables = list(dict.fromkeys(tables))
+	if not tables:
+		frappe.throw(_("Choose the tables or the DocType to restore."), frappe.ValidationError)
+	unknown = [table for table in filters if table not in tables]
+	if unknown:
+		frappe.throw(
+			_("Filters refer to tables that are not restored: {0}").format(", ".join(unknown)),
+			frappe.ValidationError,
+		)
+	return tables, filters
+
+
+def _validate_selective_options(target: str, conflict: str) -> None:
+	if target not in SELECTIVE_TARGETS:
+		frappe.throw(
+			_("Target must be one of: {0}").format(", ".join(SELECTIVE_TARGETS)), frappe.ValidationError
+		)
+	if conflict not in CONFLICT_POLICIES:
+		frappe.throw(
+			_("Conflict policy must be one of: {0}").format(", ".join(CONFLICT_POLICIES)),
+			frappe.ValidationError,
+		)
+
+
+def _filter_clause(filters: Optional[Dict[str, Any]], columns: list[str]) -> tuple[str, list[Any]]:
+	"""WHERE clause for `{column: value}` or `{column: [operator, value]}` filters."""
+	conditions: list[str] = []
+	values: list[Any] = []
+	for column, condition in (filters or {}).items():
+		if column not in columns:
+			frappe.throw(_("Unknown filter column: {0}").format(column), frappe.ValidationError)
+		if isinstance(condition, list | tuple):
+			operator, value = str(condition[0]).lower(), condition[1]
+		else:
+			operator, value = "=", condition
+		if operator not in FILTER_OPERATORS:
+			frappe.throw(_("Unsupported filter operator: {0}").format(operator), frappe.ValidationError)
+		quoted = _quote_table(column)
+		if operator in ("in", "not in"):
+			if not value:
+				frappe.throw(_("Filter on {0} has an empty list.").format(column), frappe.ValidationError)
+			conditions.append(f"{quoted} {operator} ({', '.join(['%s'] * len(value))})")
+			values.extend(value)
+		elif operator == "between":
+			conditions.append(f"{quoted} between %s and %s")
+			values.extend(value[:2])
+		elif operator == "is":
+			conditions.append(f"{quoted} is {'not null' if value == 'set' else 'null'}")
+		else:
+			conditions.append(f"{quoted} {operator} %s")
+			values.append(value)
+	return (f" where {' and '.join(conditions)}" if conditions else ""), values
+
+
+def _table_columns(table: str) -> list[str]:
+	try:
+		return frappe.db.sql(f"SHOW COLUMNS FROM {_quote_table(table)}", pluck=True)
+	except Exception as exc:
+		if frappe.db.is_table_missing(exc):
+			frappe.throw(_("Table {0} does not exist in the site.").format(table), frappe.ValidationError)
+		raise
+
+
+def _drop_scratch_tables(state: Dict[str, Any]) -> None:
+	connection = connect(frappe.conf)
+	try:
+		drop_tables(connection, [info["scratch"] for info in state["tables"].values()])
+	finally:
+		connection.close()
+
+
+def _load_scratch_tables(path: Path, state: Dict[str, Any]) -> Dict[str, Any]:
+	doc = frappe.get_doc("Backup Archive", state["archive"])
+	db_path = _private_abs(doc.db_file_path)
+	if not db_path.exists():
+		frappe.throw(_("Archive file is missing: {0}").format(db_path.name), frappe.ValidationError)
+	scratch = {table: info["scratch"] for table, info in state["tables"].items()}
+	write_status(path, state="Loading", started_at=time.time())
+
+	connection = connect(frappe.conf)
+	try:
+		loaded = load_tables(
+			connection, db_path, scratch, on_table=lambda table: write_status(path, table=table)
+		)
+		missing = [table for table in scratch if table not in loaded]
+		if missing:
+			frappe.throw(
+				_("Tables not found in the backup: {0}").format(", ".join(missing)), frappe.ValidationError
+			)
+		tables = {
+			table: {"scratch": name, "rows": count_rows(connection, name)} for table, name in scratch.items()
+		}
+	finally:
+		connection.close()
+	return write_status(
+		path, state="Loaded", table=None, tables=tables, scratch_ready=True, loaded_at=time.time()
+	)
+
+
+def _apply_scratch_tables(path: Path, state: Dict[str, Any]) -> Dict[str, Any]:
+	"""Copy the filtered scratch rows into the live tables, all in one transaction."""
+	write_status(path, state="Applying")
+	filters = state.get("filters") or {}
+	verb = CONFLICT_POLICIES[state["conflict"]]
+	doctype, names = state.get("doctype"), state.get("names")
+	if state["conflict"] == "overwrite" and doctype and names:
+		# REPLACE only rewrites the archived rows; child rows added since the backup would
+		# stay on the restored documents, mixed in with the old ones.
+		children = {f"tab{df.options}" for df in frappe.get_meta(doctype).get_table_fields()}
+		for table in children & set(state["tables"]):
+			frappe.db.sql(
+				f"DELETE FROM {_quote_table(table)} WHERE parenttype = %s AND parent IN %s",
+				(doctype, tuple(names)),
+			)
+	applied = {}
+	for table, info in state["tables"].items():
+		scratch_columns = _table_columns(info["scratch"])
+		live_columns = set(_table_columns(table))
+		# Columns added or removed by migrations since the backup are left to their defaults.
+		column_list = ", ".join(_quote_table(column) for column in scratch_columns if column in live_columns)
+		where, values = _filter_clause(filters.get(table), scratch_columns)
+		frappe.db.sql(
+			f"{verb} INTO {_quote_table(table)} ({column_list}) "
+			f"SELECT {column_list} FROM {_quote_table(info['scratch'])}{where}",
+			values or (),
+		)
+		# Rows written by the statement above; REPLACE counts a replaced row twice.
+		applied[table] = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+	frappe.db.commit()
+
+	if doctype:
+		for name in names or []:
+			frappe.clear_document_cache(doctype, name)
+	_drop_scratch_tables(state)
+	return write_status(path, state="Applied", scratch_ready=False, applied=applied, finished_at=time.time())
+
+
+def run_selective_restore_job(restore_id: str, load: int = 1, lock_token: Optional[str] = None) -> None:
+	path = _selective_state_path(restore_id)
+	state = read_status(path)
+	try:
+		if int(load):
+			try:
+				state = _load_scratch_tables(path, state)
+			except Exception:
+				# Half-loaded scratch tables are of no use; drop them with the failure.
+				_drop_scratch_tables(state)
+				raise
+		if state["target"] == "live":
+			state = _apply_scratch_tables(path, state)
+	except Exception as exc:
+		frappe.db.rollback()
+		write_status(path, state="Failed", table=None, error=str(exc), finished_at=time.time())
+		raise
+	finally:
+		_release_backup_lock(lock_token)
+
+
+def _enqueue_selective_restore(restore_id: str, load: bool) -> None:
+	lock_token = _acquire_backup_lock(f"selective restore {restore_id}", _job_timeout())
+	try:
+		frappe.enqueue(
+			"erpnext_backup_manager.api.run_selective_restore_job",
+			queue="long",
+			timeout=_job_timeout(),
+			restore_id=restore_id,
+			load=int(load),
+			lock_token=lock_token,
+		)
+	except Exception:
+		_release_backup_lock(lock_token)
+		raise
+
+
+@frappe.whitelist(methods=["POST"])
+def selective_restore(
+	archive_name: str,
+	tables: Optional[str] = None,
+	doctype: Optional[str] = None,
+	names: Optional[str] = None,
+	filters: Optional[str] = None,
+	target: str = "scratch",
+	conflict: str = "skip",
+) -> Dict[str, Any]:
+	"""Restore chosen tables, or documents of one DocType, without a full site restore.
+
+	The tables are streamed out of the archived dump into scratch tables in the site
+	database. With target "live", the scratch rows matching `filters` are copied into the
+	live tables under the `conflict` policy and the scratch tables dropped; with
+	"scratch" they stay for inspection until applied or discarded.
+	"""
+	_ensure_system_manager()
+	archive_doc = frappe.get_doc("Backup Archive", archive_name)
+	archive_doc.check_permission("write")
+	if not archive_doc.db_file_path:
+		frappe.throw(_("Archive is missing a database backup file."), frappe.ValidationError)
+	if (frappe.conf.get("db_type") or "mariadb") != "mariadb":
+		frappe.throw(_("Selective restore supports MariaDB sites only."), frappe.ValidationError)
+	_validate_selective_options(target, conflict)
+	names = frappe.parse_json(names)
+	tables, filters = _selective_tables(doctype, names, frappe.parse_json(tables), frappe.parse_json(filters))
+
+	restore_id = frappe.generate_hash(length=10)
+	path = _selective_state_path(restore_id)
+	path.parent.mkdir(parents=True, exist_ok=True)
+	state = write_status(
+		path,
+		id=restore_id,
+		archive=archive_name,
+		doctype=doctype,
+		names=names,
+		tables={table: {"scratch": scratch_table(restore_id, table)} for table in tables},
+		filters=filters,
+		target=target,
+		conflict=conflict,
+		state="Queued",
+		created_at=time.time(),
+		created_by=frappe.session.user,
+	)
+	_enqueue_selective_restore(restore_id, load=True)
+	return state
+
+
+@frappe.whitelist(methods=["POST"])
+def apply_selective_restore(
+	restore_id: str,
+	conflict: Optional[str] = None,
+	filters: Optional[str] = None,
+) -> Dict[str, Any]:
+	"""Copy the rows of loaded scratch tables into the live site."""
+	_ensure_system_manager()
+	state = _read_selective_state(restore_id)
+	if state["state"] in SELECTIVE_RUNNING_STATES or not state.get("scratch_ready"):
+		frappe.throw(
+			_("Selective restore {0} has no loaded tables.").format(restore_id), frappe.ValidationError
+		)
+	conflict = conflict or state["conflict"]
+	_validate_selective_options("live", conflict)
+	filters = frappe.parse_json(filters) if filters else state.get("filters")
+	_selective_tables(None, None, list(state["tables"]), filters)
+
+	state = write_status(
+		_selective_state_path(restore_id), target="live", conflict=conflict, filters=filters, state="Queued"
 	)
+	_enqueue_selective_restore(restore_id, load=False)
+	return state
+
+
+@frappe.whitelist()
+def get_selective_restore(restore_id: str) -> Dict[str, Any]:
+	_ensure_system_manager()
+	return _read_selective_state(restore_id)
+
+
+@frappe.whitelist()
+def list_selective_restores() -> list[Dict[str, Any]]:
+	_ensure_system_manager()
+	directory = _archive_root() / SELECTIVE_DIRNAME
+	if not directory.is_dir():
+		return []
+	states = [read_status(path) for path in directory.glob("*.json")]
+	return sorted((state for state in states if state), key=lambda state: state["created_at"], reverse=True)
+
+
+@frappe.whitelist(methods=["POST"])
+def discard_selective_restore(restore_id: str) -> None:
+	"""Drop the scratch tables of a selective restore and forget it."""
+	_ensure_system_manager()
+	state = _read_selective_state(restore_id)
+	if state["state"] in SELECTIVE_RUNNING_STATES:
+		frappe.throw(_("Selective restore {0} is still running.").format(restore_id), frappe.ValidationError)
+	_drop_scratch_tables(state)
+	_selective_state_path(restore_id).unlink(missing_ok=True)
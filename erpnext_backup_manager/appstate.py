@@ -0,0 +1,115 @@
+"""App versions and schema fingerprints, to tell whether a restore needs a migrate.
+
+Every backup records the code of each installed app (version, git commit and
+whether the checkout has local changes), whether the database had been migrated
+to that code, and a fingerprint of its table columns. A restore compares these
+with the bench it runs on: when the code is the same commit for commit, the dump
+was taken after a migrate to it and the columns match the current site's,
+`bench migrate` would find nothing to sync or patch and is left out.
+
+Anything unknown counts as a change: apps without a git checkout, local changes
+and archives without a record all keep the migrate.
+
+Kept free of Frappe imports; the caller lists the apps and reads the columns.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib
+import json
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+GIT_TIMEOUT = 30
+
+
+def _git(directory: Path, *args: str) -> Optional[str]:
+	try:
+		result = subprocess.run(
+			["git", "-C", str(directory), *args], capture_output=True, text=True, timeout=GIT_TIMEOUT
+		)
+	except (OSError, subprocess.TimeoutExpired):
+		return None
+	return result.stdout.strip() if result.returncode == 0 else None
+
+
+def app_revision(app: str) -> Dict[str, Any]:
+	"""Version, git commit and local-changes flag of an importable app."""
+	module = importlib.import_module(app)
+	directory = Path(module.__file__).parent
+	# Only the app's own checkout (apps/<app>/.git); not a repository that happens to contain it.
+	commit = _git(directory, "rev-parse", "HEAD") if (directory.parent / ".git").exists() else None
+	return {
+		"app": app,
+		"version": getattr(module, "__version__", None),
+		"commit": commit,
+		# Untracked files count too: a new DocType or patch is untracked until it is added.
+		"dirty": bool(_git(directory, "status", "--porcelain")) if commit else None,
+	}
+
+
+def code_state(apps: Iterable[str]) -> list[Dict[str, Any]]:
+	"""`app_revision` of each app; apps that cannot be imported are listed without a version."""
+	state = []
+	for app in apps:
+		try:
+			state.append(app_revision(app))
+		except ImportError:
+			state.append({"app": app, "version": None, "commit": None, "dirty": None, "missing": True})
+	return state
+
+
+def same_code(recorded: list[Dict[str, Any]], current: list[Dict[str, Any]]) -> bool:
+	"""True when `current` holds the same apps as `recorded`, at the same clean commits."""
+	same_apps = {row["app"] for row in recorded} == {row["app"] for row in current}
+	return same_apps and not code_changes(recorded, current)
+
+
+def code_changes(recorded: list[Dict[str, Any]], current: list[Dict[str, Any]]) -> list[str]:
+	"""Why the code of each app in `recorded` cannot be taken to match `current`."""
+	by_app = {row["app"]: row for row in current}
+	changes = []
+	for row in recorded:
+		now = by_app.get(row["app"])
+		if not now or now.get("missing"):
+			changes.append(f"{row['app']} is not installed on this bench")
+		elif not (row.get("commit") and now.get("commit")):
+			changes.append(f"{row['app']} has no git commit to compare")
+		elif row.get("dirty") or now.get("dirty"):
+			changes.append(f"{row['app']} has uncommitted changes")
+		elif (row.get("version"), row["commit"]) != (now.get("version"), now["commit"]):
+			changes.append(
+				f"{row['app']} {row.get('version')} ({row['commit'][:7]})"
+				f" -> {now.get('version')} ({now['commit'][:7]})"
+			)
+	return changes
+
+
+def schema_fingerprint(columns: Iterable[Iterable[Any]]) -> str:
+	"""Hash of ``(table, column, type, nullable, default)`` rows, in a stable order."""
+	rows = sorted([None if value is None else str(value) for value in row] for row in columns)
+	return hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+
+
+def migrate_decision(
+	recorded: Optional[Dict[str, Any]], current_apps: list[Dict[str, Any]], current_fingerprint: Optional[str]
+) -> tuple[bool, str]:
+	"""Whether a restore of an archive with `recorded` app state needs a migrate, and why.
+
+	`recorded` holds the archived ``apps`` (`code_state`), ``migrated`` (whether the
+	database had been migrated to that code) and ``schema_fingerprint``.
+	"""
+	if not recorded or not recorded.get("apps"):
+		return True, "no app versions were recorded with this archive"
+	changes = code_changes(recorded["apps"], current_apps)
+	if changes:
+		return True, "app code differs: " + "; ".join(changes)
+	if not recorded.get("migrated"):
+		return True, "the archived database had not been migrated to its app code"
+	if not (recorded.get("schema_fingerprint") and current_fingerprint):
+		return True, "no schema fingerprint to compare"
+	if recorded["schema_fingerprint"] != current_fingerprint:
+		return True, "the archived schema differs from the current site's"
+	return False, "app versions, commits and schema match the current site"
@@ -0,0 +1,165 @@
+"""ZIP bundle writers for backup archives.
+
+Kept free of Frappe imports so the bundle code can be exercised without a bench.
+"""
+
+from __future__ import annotations
+
+import io
+import time
+import zipfile
+import zlib
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from erpnext_backup_manager.integrity import HashingWriter
+
+BUNDLE_COMPRESSIONS = ("auto", "stored", "deflated", "zstd")
+PRECOMPRESSED_SUFFIXES = (".gz", ".tgz", ".zip", ".zst", ".xz", ".bz2", ".7z", ".enc")
+STREAM_CHUNK_SIZE = 1024 * 1024
+SAMPLE_SIZE = 256 * 1024
+SAMPLE_COUNT = 4
+INCOMPRESSIBLE_RATIO = 0.9
+
+# Python 3.14 added Zstandard members to zipfile; older interpreters fall back to deflate.
+ZIP_ZSTANDARD = getattr(zipfile, "ZIP_ZSTANDARD", None)
+
+
+def _fast_compress_type() -> int:
+	return ZIP_ZSTANDARD if ZIP_ZSTANDARD is not None else zipfile.ZIP_DEFLATED
+
+
+def _is_incompressible(path: Path) -> bool:
+	"""Deflate a few samples at level 1 and report whether it saved less than 10%."""
+	size = path.stat().st_size
+	if not size:
+		return False
+	offsets = sorted({int(size * index / SAMPLE_COUNT) for index in range(SAMPLE_COUNT)})
+	raw = packed = 0
+	with open(path, "rb") as handle:
+		for offset in offsets:
+			handle.seek(offset)
+			sample = handle.read(SAMPLE_SIZE)
+			if not sample:
+				continue
+			raw += len(sample)
+			packed += len(zlib.compress(sample, 1))
+	return bool(raw) and packed / raw >= INCOMPRESSIBLE_RATIO
+
+
+def member_compression(path: Path, compression: str = "auto") -> int:
+	"""Pick the zipfile compression constant for one bundle member."""
+	if compression == "stored":
+		return zipfile.ZIP_STORED
+	if compression == "deflated":
+		return zipfile.ZIP_DEFLATED
+	if compression == "zstd":
+		return _fast_compress_type()
+	if path.name.lower().endswith(PRECOMPRESSED_SUFFIXES) or _is_incompressible(path):
+		return zipfile.ZIP_STORED
+	return _fast_compress_type()
+
+
+def _existing(files: Iterable[Optional[Path]]) -> Iterator[Path]:
+	for file_path in files:
+		if file_path and file_path.exists():
+			yield file_path
+
+
+# A streamed member is either a file on disk or an (arcname, chunks) pair for content
+# that only exists as a generator, such as a tar rebuilt from the deduplicated store.
+StreamMember = Union[Optional[Path], tuple[str, Iterable[bytes]]]
+
+
+def write_bundle(
+	bundle_path: Path,
+	files: Iterable[Optional[Path]],
+	*,
+	compression: str = "auto",
+	compresslevel: int = 1,
+) -> Dict[str, Any]:
+	"""Write `files` into a ZIP at `bundle_path`, choosing the compression per member.
+
+	Returns the checksum of the ZIP, taken while it is written.
+	"""
+	with open(bundle_path, "wb") as raw:
+		writer = HashingWriter(raw)
+		with zipfile.ZipFile(writer, "w", allowZip64=True) as bundle:
+			for file_path in _existing(files):
+				compress_type = member_compression(file_path, compression)
+				bundle.write(
+					file_path,
+					arcname=file_path.name,
+					compress_type=compress_type,
+					compresslevel=None if compress_type == zipfile.ZIP_STORED else compresslevel,
+				)
+	return writer.checksum()
+
+
+class _ChunkSink(io.RawIOBase):
+	"""Non-seekable write target; zipfile then emits data descriptors instead of seeking back."""
+
+	def __init__(self) -> None:
+		super().__init__()
+		self._chunks: list[bytes] = []
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		self._chunks.append(bytes(data))
+		return len(data)
+
+	def drain(self) -> bytes:
+		data = b"".join(self._chunks)
+		self._chunks.clear()
+		return data
+
+
+def stream_bundle(
+	files: Iterable[StreamMember],
+	*,
+	compression: str = "auto",
+	compresslevel: int = 1,
+	chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+	"""Yield a ZIP of `files` chunk by chunk without writing it to disk."""
+	sink = _ChunkSink()
+	with zipfile.ZipFile(sink, "w", allowZip64=True) as bundle:
+		for member in files:
+			if isinstance(member, tuple):
+				arcname, chunks = member
+				info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+				# Generated content cannot be sampled up front; only compress it on request.
+				info.compress_type = (
+					zipfile.ZIP_STORED
+					if compression == "auto"
+					else member_compression(Path(arcname), compression)
+				)
+			elif member and member.exists():
+				info = zipfile.ZipInfo.from_file(member, arcname=member.name)
+				info.compress_type = member_compression(member, compression)
+				chunks = _read_chunks(member, chunk_size)
+			else:
+				continue
+
+			if info.compress_type != zipfile.ZIP_STORED:
+				# ZipInfo only exposes the level as `compress_level` from Python 3.13 on.
+				info._compresslevel = compresslevel
+			with bundle.open(info, "w", force_zip64=True) as target:
+				for chunk in chunks:
+					target.write(chunk)
+					data = sink.drain()
+					if data:
+						yield data
+			data = sink.drain()
+			if data:
+				yield data
+	yield sink.drain()
+
+
+def _read_chunks(path: Path, chunk_size: int) -> Iterator[bytes]:
+	with open(path, "rb") as source:
+		while chunk := source.read(chunk_size):
+			yield chunk
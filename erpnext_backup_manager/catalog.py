@@ -0,0 +1,279 @@
+"""Searchable catalog of what an archive contains.
+
+Every archive directory gets a ``catalog.sqlite`` listing the tables of its database
+dump (row count and size) and every file of its public/private file backups (path,
+size, mtime), so finding the archives that hold a table or an attachment is an
+indexed lookup rather than unpacking tarballs.
+
+- Per-table dumps: rows and sizes come from the dump manifest.
+- Single ``.sql.gz`` dumps: streamed once; rows are counted per ``INSERT``.
+- Deduplicated/incremental file backups: their manifest entries (with hashes).
+- Tars: member headers; data blocks of uncompressed tars are skipped by seeking.
+
+The catalog is built in a temporary file and renamed into place, so readers never
+see a partial one. Kept free of Frappe imports; ``python -m
+erpnext_backup_manager.catalog`` builds or searches catalogs from a shell.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import posixpath
+import re
+import sqlite3
+import time
+import uuid
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from erpnext_backup_manager.compression import decompressor, open_tar
+from erpnext_backup_manager.dump import is_dump_manifest
+from erpnext_backup_manager.dump import read_manifest as read_dump_manifest
+from erpnext_backup_manager.filestore import is_manifest, read_manifest
+from erpnext_backup_manager.restore_engine import FILE_ROOTS
+
+CATALOG_NAME = "catalog.sqlite"
+CATALOG_VERSION = 1
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE tables (
+	name TEXT PRIMARY KEY,
+	rows INTEGER NOT NULL,
+	sql_bytes INTEGER,
+	stored_bytes INTEGER,
+	data INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE files (
+	kind TEXT NOT NULL,
+	path TEXT NOT NULL,
+	name TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	mtime INTEGER NOT NULL,
+	sha256 TEXT,
+	PRIMARY KEY (kind, path)
+) WITHOUT ROWID;
+CREATE INDEX files_name ON files (name);
+"""
+STATEMENT_HEAD = re.compile(rb"(DROP TABLE IF EXISTS|CREATE TABLE|INSERT INTO) `((?:[^`]|``)+)`")
+STRING_LITERAL = re.compile(rb"'(?:[^'\\]|\\.)*'")
+# Between two row tuples of an INSERT, on one line or split across lines.
+TUPLE_SEPARATOR = re.compile(rb"\)\s*,\s*(?:\(|$)")
+INSERT_BATCH = 10_000
+FILE_URL_PREFIXES = (("/private/files/", "private"), ("/files/", "public"))
+
+
+def catalog_path(directory: Path) -> Path:
+	return directory / CATALOG_NAME
+
+
+def _scan_sql(db_path: Path) -> Iterator[tuple[str, int, Optional[int], Optional[int], int]]:
+	stats: Dict[str, list[int]] = {}
+	entry: Optional[list[int]] = None
+	in_statement = False
+	is_insert = False
+	process, stream = decompressor(db_path, 1)
+	with stream:
+		for line in stream:
+			if not in_statement:
+				match = STATEMENT_HEAD.match(line)
+				entry = None
+				if match:
+					name = match.group(2).replace(b"``", b"`").decode("utf-8", "surrogateescape")
+					entry = stats.setdefault(name, [0, 0])
+				is_insert = bool(match) and match.group(1) == b"INSERT INTO"
+				if is_insert:
+					entry[0] += 1
+			in_statement = not line.rstrip().endswith(b";")
+			if entry is not None:
+				entry[1] += len(line)
+				if is_insert:
+					# Quoted values may contain "),(" themselves.
+					values = STRING_LITERAL.sub(b"", line) if b"'" in line else line
+					entry[0] += len(TUPLE_SEPARATOR.findall(values))
+	if process and process.wait() != 0:
+		raise RuntimeError(f"Decompressing {db_path.name} failed with exit code {process.returncode}.")
+	for name, (rows, size) in stats.items():
+		yield name, rows, size, None, 1
+
+
+def dump_tables(db_path: Path) -> Iterator[tuple[str, int, Optional[int], Optional[int], int]]:
+	"""Yield ``(name, rows, sql_bytes, stored_bytes, data)`` for every table of a dump."""
+	if not is_dump_manifest(db_path):
+		yield from _scan_sql(db_path)
+		return
+	for table in read_dump_manifest(db_path)["tables"]:
+		if table["type"] == "table":
+			yield (
+				table["name"],
+				table["rows"],
+				table.get("sql_bytes"),
+				table["checksum"]["size"],
+				int(table["data"]),
+			)
+
+
+def _files_relative(member_name: str) -> Optional[str]:
+	"""Path below ``public/files`` or ``private/files`` of a tar member name."""
+	parts = PurePosixPath(member_name).parts
+	for index, part in enumerate(parts[:-2]):
+		if part in FILE_ROOTS and parts[index + 1] == "files":
+			return "/".join(parts[index + 2 :])
+	return None
+
+
+def backup_files(kind: str, path: Path) -> Iterator[tuple[str, str, str, int, int, Optional[str]]]:
+	"""Yield ``(kind, path, name, size, mtime, sha256)`` for every file of a file backup."""
+	if is_manifest(path):
+		for entry in read_manifest(path)[1]:
+			rel_path = entry["path"]
+			yield (
+				kind,
+				rel_path,
+				posixpath.basename(rel_path),
+				entry["size"],
+				entry["mtime_ns"] // 1_000_000_000,
+				entry["sha256"],
+			)
+		return
+	with open_tar(path) as archive:
+		while (member := archive.next()) is not None:
+			# The member list is only needed for random access; it would hold every header.
+			archive.members.clear()
+			rel_path = _files_relative(member.name) if member.isfile() else None
+			if rel_path:
+				yield kind, rel_path, posixpath.basename(rel_path), member.size, int(member.mtime), None
+
+
+def _insert_batched(connection: sqlite3.Connection, query: str, rows: Iterable[tuple]) -> int:
+	count = 0
+	rows = iter(rows)
+	while batch := list(itertools.islice(rows, INSERT_BATCH)):
+		connection.executemany(query, batch)
+		count += len(batch)
+	return count
+
+
+def build_catalog(
+	output: Path,
+	db_path: Optional[Path],
+	files: Dict[str, Path],
+	archive: Optional[str] = None,
+) -> Dict[str, Any]:
+	"""Write the catalog of a database dump and file backups (kind -> path) to `output`."""
+	started = time.monotonic()
+	tmp_path = output.with_name(f".{output.name}.{uuid.uuid4().hex}")
+	connection = sqlite3.connect(tmp_path)
+	try:
+		# A throwaway file until the rename: no journal or fsync needed.
+		connection.execute("PRAGMA journal_mode = OFF")
+		connection.execute("PRAGMA synchronous = OFF")
+		connection.executescript(SCHEMA)
+		tables = 0
+		if db_path:
+			tables = _insert_batched(
+				connection, "INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?)", dump_tables(db_path)
+			)
+		file_count = sum(
+			_insert_batched(
+				connection, "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", backup_files(kind, path)
+			)
+			for kind, path in files.items()
+		)
+		summary = {
+			"version": CATALOG_VERSION,
+			"archive": archive,
+			"tables": tables,
+			"files": file_count,
+			"built_at": time.time(),
+			"elapsed": round(time.monotonic() - started, 3),
+		}
+		connection.executemany(
+			"INSERT INTO meta VALUES (?, ?)", [(key, json.dumps(value)) for key, value in summary.items()]
+		)
+		connection.commit()
+		connection.close()
+		os.replace(tmp_path, output)
+	except BaseException:
+		connection.close()
+		tmp_path.unlink(missing_ok=True)
+		raise
+	return summary
+
+
+def file_condition(query: str) -> tuple[str, list[Any]]:
+	"""WHERE clause for a file search.
+
+	A file URL (``/files/a.pdf``, ``/private/files/a.pdf``) matches that exact file, a
+	pattern with ``*``/``?`` is matched against the path, anything else against the
+	file name.
+	"""
+	for prefix, kind in FILE_URL_PREFIXES:
+		if query.startswith(prefix):
+			return "kind = ? AND path = ?", [kind, query[len(prefix) :]]
+	if "*" in query or "?" in query:
+		return "path GLOB ?", [query]
+	return "name = ?", [query]
+
+
+def search(
+	catalog: Path,
+	*,
+	file: Optional[str] = None,
+	table: Optional[str] = None,
+	limit: int = 20,
+) -> Optional[Dict[str, list[Dict[str, Any]]]]:
+	"""Files and tables of one catalog matching the query; None when something is missing."""
+	connection = sqlite3.connect(f"{catalog.resolve().as_uri()}?mode=ro", uri=True)
+	connection.row_factory = sqlite3.Row
+	try:
+		result: Dict[str, list[Dict[str, Any]]] = {}
+		if table:
+			rows = connection.execute("SELECT * FROM tables WHERE name = ?", [table]).fetchall()
+			if not rows:
+				return None
+			result["tables"] = [dict(row) for row in rows]
+		if file:
+			where, values = file_condition(file)
+			rows = connection.execute(
+				f"SELECT kind, path, size, mtime, sha256 FROM files WHERE {where} LIMIT ?", [*values, limit]
+			).fetchall()
+			if not rows:
+				return None
+			result["files"] = [dict(row) for row in rows]
+		return result
+	finally:
+		connection.close()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.catalog")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	build = commands.add_parser("build", help="catalog an archive's backup files")
+	build.add_argument("--output", type=Path, required=True)
+	build.add_argument("--db", type=Path)
+	build.add_argument("--public", type=Path)
+	build.add_argument("--private", type=Path)
+	build.add_argument("--archive")
+
+	find = commands.add_parser("search", help="search catalogs")
+	find.add_argument("catalogs", type=Path, nargs="+")
+	find.add_argument("--file")
+	find.add_argument("--table")
+	args = parser.parse_args(argv)
+
+	if args.command == "build":
+		files = {kind: path for kind, path in (("public", args.public), ("private", args.private)) if path}
+		print(json.dumps(build_catalog(args.output, args.db, files, args.archive)))
+	else:
+		for catalog in args.catalogs:
+			result = search(catalog, file=args.file, table=args.table)
+			if result:
+				print(json.dumps({"catalog": str(catalog), **result}))
+
+
+if __name__ == "__main__":
+	main()
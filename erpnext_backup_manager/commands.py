@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import click
+import frappe
+from frappe.commands import pass_context
+from frappe.utils import get_bench_path, get_sites
+
+from erpnext_backup_manager import orchestrator
+
+DEFAULT_BENCH_WORKERS = 2
+REPORT_DIRNAME = os.path.join("logs", "backup_manager")
+REPORTS_KEPT = 30
+
+
+@click.command("backup-all-sites")
+@click.option("--sites", "site_names", help="Comma-separated sites to back up (default: every site)")
+@click.option("--workers", type=int, help="Sites backed up at the same time")
+@click.option("--without-files", is_flag=True, default=False, help="Database only")
+@click.option("--without-bundle", is_flag=True, default=False, help="Do not build bundles")
+@click.option("--site-timeout", type=int, help="Seconds after which a site's backup is stopped")
+@click.option("--report-dir", type=click.Path(file_okay=False), help="Where run reports are kept")
+@pass_context
+def backup_all_sites(context, site_names, workers, without_files, without_bundle, site_timeout, report_dir):
+	"""Back up every site of the bench through a bounded pool of processes."""
+	bench_path = get_bench_path()
+	sites_path = os.path.join(bench_path, "sites")
+	common = frappe.get_site_config(sites_path=sites_path)
+	workers = workers or int(common.get("backup_manager_bench_workers") or DEFAULT_BENCH_WORKERS)
+	site_timeout = site_timeout or int(common.get("backup_manager_bench_site_timeout") or 0)
+
+	configs = {
+		site: frappe.get_site_config(sites_path=sites_path, site_path=os.path.join(sites_path, site))
+		for site in (site_names.split(",") if site_names else get_sites(sites_path))
+	}
+	sites = [site for site, config in configs.items() if not config.get("backup_manager_bench_exclude")]
+	if not sites:
+		click.echo("No sites to back up.")
+		return
+
+	report_root = Path(report_dir or os.path.join(bench_path, REPORT_DIRNAME))
+	jobs = orchestrator.plan(
+		sites,
+		{site: configs[site].get("backup_manager_bench_priority") for site in sites},
+		orchestrator.latest_report(report_root),
+	)
+	run_dir = report_root / datetime.now().strftime("%Y%m%d_%H%M%S")
+	run_dir.mkdir(parents=True, exist_ok=True)
+	kwargs = {"include_files": int(not without_files), "bundle": int(not without_bundle)}
+
+	def launch(job):
+		site = job["site"]
+		with open(run_dir / f"{site}.log", "wb") as log:
+			process = subprocess.Popen(
+				[
+					sys.executable,
+					"-m",
+					"frappe.utils.bench_helper",
+					"frappe",
+					"--site",
+					site,
+					"execute",
+					"erpnext_backup_manager.api.run_site_backup",
+					"--kwargs",
+					json.dumps({"result_path": str(run_dir / f"{site}.json"), **kwargs}),
+				],
+				stdin=subprocess.DEVNULL,
+				stdout=log,
+				stderr=subprocess.STDOUT,
+				cwd=sites_path,
+				start_new_session=True,
+			)
+		click.echo(f"{site}: started ({job['kind']})")
+		return process
+
+	def collect(job, returncode, seconds):
+		site = job["site"]
+		result_path = run_dir / f"{site}.json"
+		if result_path.exists():
+			result = json.loads(result_path.read_text(encoding="utf-8"))
+			if returncode is None and result["status"] == "Failed":
+				# Stopped by --site-timeout; the site marked its archive Failed on the way out.
+				result.update(status="Timed Out", error=f"stopped after {seconds:.0f}s")
+		elif returncode is None:
+			result = {"site": site, "status": "Timed Out", "error": f"stopped after {seconds:.0f}s"}
+		else:
+			result = {"site": site, "status": "Failed", "error": f"see {run_dir / f'{site}.log'}"}
+		# The whole process, including site start-up.
+		result["seconds"] = round(seconds, 1)
+		click.echo(f"{site}: {result['status']} in {seconds:.0f}s")
+		return result
+
+	started_at = time.time()
+	results = orchestrator.run_pool(jobs, workers, launch, collect, site_timeout)
+	seconds = time.time() - started_at
+	report_path = orchestrator.write_report(run_dir, results, started_at, seconds)
+	orchestrator.prune_reports(report_root, REPORTS_KEPT)
+
+	click.echo("")
+	click.echo(orchestrator.format_report(results, seconds))
+	click.echo(f"Report: {report_path}")
+	if any(result["status"] in ("Failed", "Timed Out") for result in results):
+		sys.exit(1)
+
+
+commands = [backup_all_sites]
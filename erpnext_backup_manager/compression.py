@@ -0,0 +1,220 @@
+"""Pluggable compression for database dumps and file tars.
+
+Codecs, chosen per component in site_config:
+
+- ``gzip``: in-process zlib on one core, the format of Frappe's own backups;
+- ``pigz``: the same gzip format from ``pigz`` on several cores (in-process gzip
+  when pigz is not installed), so everything that reads ``.gz`` still reads it;
+- ``zstd``: Zstandard from the ``zstd`` binary, multi-threaded, levels 1-19;
+- ``none``: no compression, for fast local snapshots.
+
+Readers never need to be told the codec: it follows from the file name
+(``.gz``/``.tgz`` is gzip, ``.zst`` is Zstandard, anything else is plain).
+
+Kept free of Frappe imports; ``python -m erpnext_backup_manager.compression
+decompress <input> <output>`` unpacks a file for tools that only take plain input.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import gzip
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+CODECS = ("gzip", "pigz", "zstd", "none")
+# Speed first: level 1 gzip is several times faster than the default 6 for a few percent
+# more bytes, and zstd at 3 beats gzip 6 on both counts.
+DEFAULT_LEVELS = {"gzip": 1, "pigz": 1, "zstd": 3}
+LEVEL_RANGES = {"gzip": (1, 9), "pigz": (1, 9), "zstd": (1, 19)}
+SQL_SUFFIXES = {"gzip": ".sql.gz", "pigz": ".sql.gz", "zstd": ".sql.zst", "none": ".sql"}
+# `bench restore` extracts ``.tar`` and ``.tgz`` file backups itself.
+TAR_SUFFIXES = {"gzip": ".tgz", "pigz": ".tgz", "zstd": ".tar.zst", "none": ".tar"}
+PIPE_CHUNK_SIZE = 1024 * 1024
+
+
+class CompressionError(RuntimeError):
+	"""A file cannot be decompressed: the tool is missing or it failed.
+
+	Readers run inside web requests and background jobs, so this is an ordinary
+	exception; only the command-line entry points turn it into an exit status.
+	"""
+
+
+def format_of(path: Path) -> str:
+	"""Format of the data in `path` by its name: "gzip", "zstd" or "none"."""
+	name = path.name.lower()
+	if name.endswith((".gz", ".tgz")):
+		return "gzip"
+	if name.endswith(".zst"):
+		return "zstd"
+	return "none"
+
+
+def check(codec: str, level: Optional[int] = None) -> int:
+	"""Validate `codec` and `level`; returns the level to use (0 for ``none``)."""
+	if codec not in CODECS:
+		raise ValueError(f"Compression must be one of: {', '.join(CODECS)}")
+	if codec == "none":
+		return 0
+	if codec == "zstd" and not shutil.which("zstd"):
+		raise ValueError("zstd compression needs the zstd binary: sudo apt install zstd")
+	low, high = LEVEL_RANGES[codec]
+	level = int(level or DEFAULT_LEVELS[codec])
+	if not low <= level <= high:
+		raise ValueError(f"{codec} compression level must be between {low} and {high}")
+	return level
+
+
+def _compress_command(codec: str, level: int, threads: int) -> Optional[list[str]]:
+	if codec == "pigz" and shutil.which("pigz"):
+		return ["pigz", "-c", f"-{level}", "-p", str(max(threads, 1))]
+	if codec == "zstd":
+		return ["zstd", "-c", "-q", f"-{level}", f"-T{max(threads, 1)}"]
+	return None
+
+
+class CountingWriter:
+	"""Passes writes through unchanged; `tell` is the byte count, like a compressor's."""
+
+	def __init__(self, target: IO[bytes]) -> None:
+		self.target = target
+		self.size = 0
+
+	def write(self, data: bytes) -> int:
+		self.target.write(data)
+		self.size += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self.size
+
+	def close(self) -> None:
+		pass
+
+	def __enter__(self) -> CountingWriter:
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+
+class PipeWriter:
+	"""Feeds a compressor process; a thread copies its output into `target`.
+
+	`tell` counts the uncompressed bytes written, like `gzip.GzipFile.tell`.
+	"""
+
+	def __init__(self, cmd: list[str], target: IO[bytes]) -> None:
+		self.size = 0
+		self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+		self._pump = threading.Thread(
+			target=shutil.copyfileobj, args=(self.process.stdout, target, PIPE_CHUNK_SIZE), daemon=True
+		)
+		self._pump.start()
+
+	def write(self, data: bytes) -> int:
+		self.process.stdin.write(data)
+		self.size += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self.size
+
+	def close(self) -> None:
+		if self.process.stdin.closed:
+			return
+		self.process.stdin.close()
+		self._pump.join()
+		self.process.stdout.close()
+		if self.process.wait() != 0:
+			raise OSError(f"{self.process.args[0]} exited with code {self.process.returncode}")
+
+	def __enter__(self) -> PipeWriter:
+		return self
+
+	def __exit__(self, exc_type, *exc_info) -> None:
+		if exc_type is not None:
+			self.process.kill()
+		self.close()
+
+
+def open_writer(target: IO[bytes], codec: str, level: int, threads: int = 1):
+	"""A binary stream that writes `codec`-compressed data into `target` (left open on close)."""
+	if codec == "none":
+		return CountingWriter(target)
+	cmd = _compress_command(codec, level, threads)
+	if cmd:
+		return PipeWriter(cmd, target)
+	return gzip.GzipFile(fileobj=target, mode="wb", compresslevel=level, mtime=0)
+
+
+def decompressor(path: Path, threads: int) -> tuple[Optional[subprocess.Popen], IO[bytes]]:
+	"""The process (if any) and stream that produce the decompressed contents of `path`."""
+	kind = format_of(path)
+	if kind == "gzip":
+		if shutil.which("pigz"):
+			process = subprocess.Popen(["pigz", "-dc", "-p", str(threads), str(path)], stdout=subprocess.PIPE)
+			return process, process.stdout
+		return None, gzip.open(path, "rb")
+	if kind == "zstd":
+		if not shutil.which("zstd"):
+			raise CompressionError(f"{path.name} is zstd-compressed but zstd is not installed.")
+		process = subprocess.Popen(["zstd", "-dcq", str(path)], stdout=subprocess.PIPE)
+		return process, process.stdout
+	return None, open(path, "rb")
+
+
+@contextlib.contextmanager
+def open_tar(path: Path) -> Iterator[tarfile.TarFile]:
+	"""Read a tar of any codec front to back; `tarfile` itself cannot read Zstandard."""
+	if format_of(path) != "zstd":
+		with tarfile.open(path, "r:*") as archive:
+			yield archive
+		return
+	process, stream = decompressor(path, 1)
+	try:
+		with tarfile.open(fileobj=stream, mode="r|") as archive:
+			yield archive
+	finally:
+		# Readers often stop after the first members; the rest of the stream is not needed.
+		process.kill()
+		process.wait()
+		stream.close()
+
+
+def decompress(source: Path, output: Path, threads: int) -> int:
+	"""Write the decompressed contents of `source` to `output`; returns its size."""
+	process, stream = decompressor(source, threads)
+	with stream, open(output, "wb") as target:
+		shutil.copyfileobj(stream, target, PIPE_CHUNK_SIZE)
+		size = target.tell()
+	if process and process.wait() != 0:
+		raise CompressionError(f"Decompressing {source.name} failed with exit code {process.returncode}.")
+	return size
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.compression")
+	commands = parser.add_subparsers(dest="command", required=True)
+	unpack = commands.add_parser("decompress", help="write the plain contents of a compressed file")
+	unpack.add_argument("input", type=Path)
+	unpack.add_argument("output", type=Path)
+	unpack.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+	args = parser.parse_args(argv)
+
+	if args.command == "decompress":
+		try:
+			decompress(args.input, args.output, args.threads)
+		except CompressionError as exc:
+			raise SystemExit(str(exc)) from None
+
+
+if __name__ == "__main__":
+	main()
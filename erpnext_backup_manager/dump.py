@@ -0,0 +1,489 @@
+"""Per-table parallel database dumps.
+
+`new_backup()` runs one ``mysqldump`` that writes every table into a single gzip
+stream on one core. This dumper writes each table into its own
+``<table>.sql.gz`` from a pool of worker processes, plus a JSON manifest
+(``...-database.tables.json``) listing the files with their checksums.
+
+Consistency: before the workers start, a coordinating connection takes
+``LOCK TABLES ... READ`` on every table, which waits for in-flight writes and
+holds new ones back. Each worker then opens ``START TRANSACTION WITH CONSISTENT
+SNAPSHOT`` and the lock is released, so all workers read the same point in time
+while writes are paused only for the moment it takes to open the connections. When
+the lock cannot be had within ``LOCK_WAIT_TIMEOUT`` the dump goes ahead without it
+and the manifest records ``"consistent": false``.
+
+Tables matching an exclude pattern (unless an include pattern matches too) are
+dumped without rows, so the dump always restores into a working site.
+
+Every table file is self-contained (``DROP``/``CREATE`` then ``INSERT``), so tables
+can be imported in parallel, and concatenating the files gives a valid ``.sql.gz``
+for ``bench restore``. Gzip and Zstandard both allow concatenated streams, so the
+same holds for the other codecs of `compression`.
+
+`dump_single` writes the one-file dump with a codec other than Frappe's gzip:
+``mysqldump`` with Frappe's options, piped through the compressor.
+
+Kept free of Frappe imports; runs as ``python -m erpnext_backup_manager.dump`` in
+its own process so the workers can be forked safely.
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, Optional
+from urllib.parse import quote
+
+import pymysql
+import pymysql.cursors
+from pymysql.converters import escape_bytes_prefixed, escape_string
+
+from erpnext_backup_manager.compression import SQL_SUFFIXES, CompressionError, decompressor, open_writer
+from erpnext_backup_manager.integrity import HashingWriter, verify_checksum
+
+DUMP_MANIFEST_SUFFIX = "-database.tables.json"
+DUMP_FORMAT = 1
+INSERT_BATCH_BYTES = 1024 * 1024
+FETCH_ROWS = 1000
+LOCK_WAIT_TIMEOUT = 30
+READY_TIMEOUT = 120
+FILE_HEADER = (
+	"/*!40101 SET NAMES utf8mb4 */;\n"
+	"SET FOREIGN_KEY_CHECKS=0;\n"
+	"SET UNIQUE_CHECKS=0;\n"
+	"SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n"
+)
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def site_config(site_path: Path) -> Dict[str, Any]:
+	config: Dict[str, Any] = {}
+	for path in (site_path.parent / "common_site_config.json", site_path / "site_config.json"):
+		if path.exists():
+			config.update(json.loads(path.read_text(encoding="utf-8")))
+	return config
+
+
+def is_dump_manifest(path: Optional[Path]) -> bool:
+	return bool(path) and path.name.endswith(DUMP_MANIFEST_SUFFIX)
+
+
+def tables_dir(manifest_path: Path) -> Path:
+	return manifest_path.with_name(manifest_path.name[: -len(".json")])
+
+
+def sql_name(manifest_path: Path, plain: bool = False) -> str:
+	"""File name of the single dump (``.sql.gz``, ``.sql.zst``...) a dump manifest stands for."""
+	codec = "none" if plain else read_manifest(manifest_path).get("compression") or "gzip"
+	return manifest_path.name[: -len(DUMP_MANIFEST_SUFFIX)] + "-database" + SQL_SUFFIXES[codec]
+
+
+def table_file_name(table: str, codec: str = "gzip") -> str:
+	return quote(table, safe=" ") + SQL_SUFFIXES[codec]
+
+
+def read_manifest(path: Path) -> Dict[str, Any]:
+	return json.loads(path.read_text(encoding="utf-8"))
+
+
+def table_paths(manifest_path: Path) -> list[Path]:
+	directory = tables_dir(manifest_path)
+	return [directory / table["file"] for table in read_manifest(manifest_path)["tables"]]
+
+
+def dump_size(manifest_path: Path) -> int:
+	return sum(table["checksum"]["size"] for table in read_manifest(manifest_path)["tables"])
+
+
+def sql_size(manifest_path: Path) -> Optional[int]:
+	"""Uncompressed SQL behind the table files; None for manifests written before it was recorded."""
+	sizes = [table.get("sql_bytes") for table in read_manifest(manifest_path)["tables"]]
+	return None if None in sizes else sum(sizes)
+
+
+def _quote(name: str) -> str:
+	return "`" + name.replace("`", "``") + "`"
+
+
+def write_client_defaults(handle: IO[str], config: Dict[str, Any], user: str, password: str) -> None:
+	"""Option file for the ``mariadb``/``mysqldump`` clients of the site's database server."""
+	# Credentials go through a 0600 option file rather than the command line.
+	lines = ["[client]", f"user={user}", f"password={password}"]
+	if config.get("db_socket"):
+		lines.append(f"socket={config['db_socket']}")
+	else:
+		lines.append(f"host={config.get('db_host') or '127.0.0.1'}")
+		lines.append(f"port={config.get('db_port') or 3306}")
+	handle.write("\n".join(lines) + "\n")
+	handle.flush()
+
+
+def connect(config: Dict[str, Any]) -> pymysql.connections.Connection:
+	options: Dict[str, Any] = {
+		"user": config.get("db_user") or config["db_name"],
+		"password": config["db_password"],
+		"database": config["db_name"],
+		"charset": "utf8mb4",
+		# No decoders: values arrive as the server's text (bytes for binary columns) and
+		# are written back verbatim, so nothing is lost to float or date conversions.
+		"conv": {},
+	}
+	if config.get("db_socket"):
+		options["unix_socket"] = config["db_socket"]
+	else:
+		options["host"] = config.get("db_host") or "127.0.0.1"
+		options["port"] = int(config.get("db_port") or 3306)
+	return pymysql.connect(**options)
+
+
+def wants_data(table: str, exclude: list[str], include: list[str]) -> bool:
+	"""Rows are dumped unless an exclude pattern matches and no include pattern does."""
+	if any(fnmatch.fnmatchcase(table, pattern) for pattern in include):
+		return True
+	return not any(fnmatch.fnmatchcase(table, pattern) for pattern in exclude)
+
+
+def list_tables(connection, exclude: list[str], include: list[str]) -> list[Dict[str, Any]]:
+	"""Base tables and sequences, largest first so the long dumps start early."""
+	with connection.cursor() as cursor:
+		cursor.execute(
+			"SELECT TABLE_NAME, TABLE_TYPE, COALESCE(DATA_LENGTH, 0) + COALESCE(INDEX_LENGTH, 0) "
+			"FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+			"AND TABLE_TYPE IN ('BASE TABLE', 'SEQUENCE')"
+		)
+		rows = cursor.fetchall()
+	tables = [
+		{
+			"name": name,
+			"type": "sequence" if table_type == "SEQUENCE" else "table",
+			"estimated_bytes": int(size),
+			"data": wants_data(name, exclude, include),
+		}
+		for name, table_type, size in rows
+	]
+	return sorted(tables, key=lambda table: table["estimated_bytes"], reverse=True)
+
+
+def _literal(value) -> str:
+	if value is None:
+		return "NULL"
+	if isinstance(value, bytes):
+		return escape_bytes_prefixed(value)
+	return "'" + escape_string(value) + "'"
+
+
+def _write(output, text: str) -> None:
+	# Binary values are carried as surrogate escapes, the same way pymysql sends them.
+	output.write(text.encode("utf-8", "surrogateescape"))
+
+
+def _write_rows(connection, quoted: str, output) -> int:
+	rows = 0
+	prefix = f"INSERT INTO {quoted} VALUES "
+	with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+		cursor.execute(f"SELECT * FROM {quoted}")
+		batch: list[str] = []
+		size = 0
+		while chunk := cursor.fetchmany(FETCH_ROWS):
+			for row in chunk:
+				values = "(" + ",".join(map(_literal, row)) + ")"
+				batch.append(values)
+				size += len(values)
+				if size >= INSERT_BATCH_BYTES:
+					_write(output, prefix + ",\n".join(batch) + ";\n")
+					batch, size = [], 0
+			rows += len(chunk)
+		if batch:
+			_write(output, prefix + ",\n".join(batch) + ";\n")
+	return rows
+
+
+def dump_table(
+	connection, table: Dict[str, Any], directory: Path, compression: Dict[str, Any]
+) -> Dict[str, Any]:
+	"""Write one table file; `compression` holds the ``codec``, ``level`` and ``threads``."""
+	quoted = _quote(table["name"])
+	path = directory / table_file_name(table["name"], compression["codec"])
+	rows = 0
+	with open(path, "wb") as raw:
+		writer = HashingWriter(raw)
+		with open_writer(
+			writer, compression["codec"], compression["level"], compression["threads"]
+		) as output:
+			_write(output, FILE_HEADER)
+			with connection.cursor() as cursor:
+				if table["type"] == "sequence":
+					cursor.execute(f"SHOW CREATE SEQUENCE {quoted}")
+					create = cursor.fetchone()[1]
+					cursor.execute(f"SELECT next_not_cached_value FROM {quoted}")
+					next_value = cursor.fetchone()[0]
+					_write(output, f"DROP SEQUENCE IF EXISTS {quoted};\n{create};\n")
+					_write(output, f"SELECT SETVAL({quoted}, {int(next_value)}, 0);\n")
+				else:
+					cursor.execute(f"SHOW CREATE TABLE {quoted}")
+					create = cursor.fetchone()[1]
+					_write(output, f"DROP TABLE IF EXISTS {quoted};\n{create};\n")
+			if table["data"] and table["type"] == "table":
+				rows = _write_rows(connection, quoted, output)
+			sql_bytes = output.tell()
+	return {
+		"name": table["name"],
+		"type": table["type"],
+		"file": path.name,
+		"data": table["data"],
+		"rows": rows,
+		"sql_bytes": sql_bytes,
+		"checksum": writer.checksum(),
+	}
+
+
+def _worker(config, directory: Path, compression: Dict[str, Any], ready, tasks, results) -> None:
+	try:
+		connection = connect(config)
+		with connection.cursor() as cursor:
+			# Long tables are streamed; a slow consumer must not trip the server's write timeout.
+			cursor.execute("SET SESSION net_write_timeout = 3600")
+			cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+			cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+	except Exception as exc:
+		ready.put(repr(exc))
+		return
+	ready.put(None)
+	while (table := tasks.get()) is not None:
+		try:
+			results.put(dump_table(connection, table, directory, compression))
+		except Exception as exc:
+			results.put({"name": table["name"], "error": repr(exc)})
+	connection.close()
+
+
+def _lock_tables(connection, tables: list[Dict[str, Any]]) -> bool:
+	with connection.cursor() as cursor:
+		cursor.execute(f"SET SESSION lock_wait_timeout = {LOCK_WAIT_TIMEOUT}")
+		try:
+			cursor.execute("LOCK TABLES " + ", ".join(f"{_quote(table['name'])} READ" for table in tables))
+		except pymysql.err.MySQLError:
+			return False
+	return True
+
+
+def dump_database(
+	site_path: Path,
+	manifest_path: Path,
+	*,
+	workers: int,
+	exclude: list[str],
+	include: list[str],
+	codec: str = "gzip",
+	compresslevel: int = 1,
+) -> Dict[str, Any]:
+	config = site_config(site_path)
+	started = time.time()
+	directory = tables_dir(manifest_path)
+	directory.mkdir(parents=True, exist_ok=True)
+
+	coordinator = connect(config)
+	tables = list_tables(coordinator, exclude, include)
+	workers = max(1, min(workers, len(tables) or 1))
+	# The workers already share the cores; each compressor gets the cores left over.
+	compression = {
+		"codec": codec,
+		"level": compresslevel,
+		"threads": max((os.cpu_count() or 1) // workers, 1),
+	}
+	context = multiprocessing.get_context("fork")
+	ready, tasks, results = context.Queue(), context.Queue(), context.Queue()
+
+	consistent = _lock_tables(coordinator, tables) if tables else True
+	processes = [
+		context.Process(target=_worker, args=(config, directory, compression, ready, tasks, results))
+		for _ in range(workers)
+	]
+	try:
+		for process in processes:
+			process.start()
+		failures = [ready.get(timeout=READY_TIMEOUT) for _ in processes]
+	finally:
+		if consistent:
+			with coordinator.cursor() as cursor:
+				cursor.execute("UNLOCK TABLES")
+		coordinator.close()
+	if any(failures):
+		for process in processes:
+			process.kill()
+		raise SystemExit(f"Dump worker could not connect: {next(filter(None, failures))}")
+
+	for table in tables:
+		tasks.put(table)
+	for _ in processes:
+		tasks.put(None)
+
+	dumped = {}
+	errors = []
+	while len(dumped) + len(errors) < len(tables):
+		try:
+			result = results.get(timeout=5)
+		except queue.Empty:
+			if not any(process.is_alive() for process in processes):
+				raise SystemExit("Dump workers exited before every table was written.") from None
+			continue
+		if "error" in result:
+			errors.append(f"{result['name']}: {result['error']}")
+		else:
+			dumped[result["name"]] = result
+	for process in processes:
+		process.join()
+	if errors:
+		raise SystemExit("Dumping tables failed: " + "; ".join(errors[:5]))
+
+	manifest = {
+		"format": DUMP_FORMAT,
+		"database": config["db_name"],
+		"created": started,
+		"elapsed": int(time.time() - started),
+		"consistent": consistent,
+		"compression": codec,
+		"excluded_data": sorted(table["name"] for table in tables if not table["data"]),
+		# Sequences last: a sequence file only touches the sequence itself, but keeping the
+		# tables first makes the combined .sql.gz read like an ordinary dump.
+		"tables": sorted(dumped.values(), key=lambda table: (table["type"] == "sequence", table["name"])),
+	}
+	tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+	tmp_path.write_text(json.dumps(manifest, indent=1), encoding="utf-8")
+	os.replace(tmp_path, manifest_path)
+	return manifest
+
+
+def iter_sql(manifest_path: Path, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+	"""Yield the dump as one file: compressed streams may simply be concatenated."""
+	for path in table_paths(manifest_path):
+		with open(path, "rb") as handle:
+			while chunk := handle.read(chunk_size):
+				yield chunk
+
+
+def write_sql(manifest_path: Path, output: Path, plain: bool = False) -> None:
+	"""Concatenate the table files into one dump; decompressed to plain SQL with `plain`."""
+	with open(output, "wb") as target:
+		for path in table_paths(manifest_path):
+			process, source = decompressor(path, 1) if plain else (None, open(path, "rb"))
+			with source:
+				shutil.copyfileobj(source, target, STREAM_CHUNK_SIZE)
+			if process and process.wait() != 0:
+				raise SystemExit(f"Decompressing {path.name} failed with exit code {process.returncode}.")
+
+
+def _dump_binary() -> str:
+	for name in ("mariadb-dump", "mysqldump"):
+		path = shutil.which(name)
+		if path:
+			return path
+	raise SystemExit("Neither mariadb-dump nor mysqldump was found in PATH.")
+
+
+def dump_single(
+	site_path: Path, output: Path, codec: str, compresslevel: int, threads: int
+) -> Dict[str, Any]:
+	"""Dump the whole database into `output` like `new_backup()`, compressed with `codec`.
+
+	Returns the checksum of `output` with the size of the SQL as ``uncompressed_size``.
+	"""
+	config = site_config(site_path)
+	user = config.get("db_user") or config["db_name"]
+	with tempfile.NamedTemporaryFile("w", suffix=".cnf") as defaults, tempfile.TemporaryFile() as errors:
+		os.chmod(defaults.name, 0o600)
+		write_client_defaults(defaults, config, user, config["db_password"])
+		process = subprocess.Popen(
+			[
+				_dump_binary(),
+				f"--defaults-extra-file={defaults.name}",
+				# The options `new_backup()` passes.
+				"--single-transaction",
+				"--quick",
+				"--lock-tables=false",
+				config["db_name"],
+			],
+			stdout=subprocess.PIPE,
+			stderr=errors,
+		)
+		with open(output, "wb") as raw:
+			writer = HashingWriter(raw)
+			with process.stdout, open_writer(writer, codec, compresslevel, threads) as compressed:
+				shutil.copyfileobj(process.stdout, compressed, STREAM_CHUNK_SIZE)
+				sql_bytes = compressed.tell()
+		if process.wait() != 0:
+			errors.seek(0)
+			message = errors.read().decode(errors="replace").strip()
+			raise SystemExit(f"Database dump failed: {message[-2000:]}")
+	return {**writer.checksum(), "uncompressed_size": sql_bytes}
+
+
+def verify_dump(manifest_path: Path, rate: Optional[int] = None) -> list[str]:
+	"""Re-hash every table file of a dump against the manifest."""
+	directory = tables_dir(manifest_path)
+	problems = []
+	for table in read_manifest(manifest_path)["tables"]:
+		problem = verify_checksum(directory / table["file"], table["checksum"], rate)
+		if problem:
+			problems.append(problem)
+	return problems
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.dump")
+	commands = parser.add_subparsers(dest="command", required=True)
+	dump = commands.add_parser("dump", help="dump the site database table by table")
+	dump.add_argument("--site-path", type=Path, required=True)
+	dump.add_argument(
+		"--output", type=Path, required=True, help=f"manifest path ending in {DUMP_MANIFEST_SUFFIX}"
+	)
+	dump.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+	dump.add_argument("--exclude-data", action="append", default=[], help="table name pattern")
+	dump.add_argument("--include-data", action="append", default=[], help="table name pattern")
+	dump.add_argument("--compression", choices=tuple(SQL_SUFFIXES), default="gzip")
+	dump.add_argument("--compresslevel", type=int, default=1)
+	single = commands.add_parser("dump-single", help="dump the site database into one compressed file")
+	single.add_argument("--site-path", type=Path, required=True)
+	single.add_argument("--output", type=Path, required=True)
+	single.add_argument("--compression", choices=tuple(SQL_SUFFIXES), required=True)
+	single.add_argument("--compresslevel", type=int, default=1)
+	single.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+	build = commands.add_parser("build-sql", help="concatenate a table dump into one file")
+	build.add_argument("manifest", type=Path)
+	build.add_argument("output", type=Path)
+	build.add_argument("--plain", action="store_true", help="decompress the tables into plain SQL")
+	args = parser.parse_args(argv)
+
+	if args.command == "dump":
+		dump_database(
+			args.site_path,
+			args.output,
+			workers=args.workers,
+			exclude=args.exclude_data,
+			include=args.include_data,
+			codec=args.compression,
+			compresslevel=args.compresslevel,
+		)
+	elif args.command == "dump-single":
+		# The caller reads the checksum back from stdout.
+		result = dump_single(args.site_path, args.output, args.compression, args.compresslevel, args.threads)
+		print(json.dumps(result))
+	elif args.command == "build-sql":
+		try:
+			write_sql(args.manifest, args.output, args.plain)
+		except CompressionError as exc:
+			raise SystemExit(str(exc)) from None
+
+
+if __name__ == "__main__":
+	main()
@@ -4,6 +4,8 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import now_datetime
 
+from erpnext_backup_manager.api import clear_archive_list_cache, publish_archive_change
+
 
 class BackupArchive(Document):
     def before_insert(self) -> None:
@@ -11,3 +13,15 @@ class BackupArchive(Document):
             self.created_on = now_datetime()
         if not self.created_by:
             self.created_by = frappe.session.user
+
+    def on_update(self) -> None:
+        # After commit, so a concurrent listing cannot re-cache the old rows in between.
+        frappe.db.after_commit.add(clear_archive_list_cache)
+        publish_archive_change(self)
+
+    def on_trash(self) -> None:
+        frappe.db.after_commit.add(clear_archive_list_cache)
+
+    def after_delete(self) -> None:
+        # Once the row is gone, so the published totals no longer count it.
+        publish_archive_change(self, removed=True)
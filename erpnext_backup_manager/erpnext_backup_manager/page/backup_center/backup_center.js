@@ -1,5 +1,9 @@
 frappe.provide("erpnext_backup_manager.pages");
 
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+const UPLOAD_ID_STORAGE_KEY = "backup_manager_upload_id";
+
 frappe.pages["backup-center"].on_page_load = function (wrapper) {
 	const page = frappe.ui.make_app_page({
 		parent: wrapper,
@@ -16,6 +20,9 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 		this.uploadedDb = null;
 		this.uploadedPublic = null;
 		this.uploadedPrivate = null;
+		// Kept across reloads so an interrupted upload resumes where it stopped.
+		this.uploadId = localStorage.getItem(UPLOAD_ID_STORAGE_KEY);
+		this.uploading = 0;
 		this.appInstalled = this._isAppInstalled();
 		this.hasAccess = this._hasAccess();
 
@@ -29,7 +36,11 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 			return;
 		}
 		this._bindActions();
+		this._subscribeRealtime();
+		this._loadUploadStatus();
 		this.refreshArchives();
+		this.refreshMetrics();
+		this.refreshEstimate();
 		this._scrollToSection();
 	}
 
@@ -152,6 +163,8 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 							"Creates a fresh backup of database and files, then provides download links.",
 						)}</p>
 						<button class="btn btn-primary btn-backup">${__("Create Backup")}</button>
+						<div class="backup-estimate small mt-2 text-muted"></div>
+						<div class="backup-estimate-warning small text-danger hide"></div>
 						<div class="backup-downloads mt-2 text-muted"></div>
 					</div>
 					<div class="backup-card" id="section-export">
@@ -160,7 +173,7 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 							"Upload a backup file to restore this site. Current data will be archived first.",
 						)}</p>
 						<div class="backup-upload-row">
-							<span>${__("DB backup (.sql.gz)")}</span>
+							<span>${__("DB backup (.sql.gz, .sql.zst)")}</span>
 							<button class="btn btn-default btn-upload-db">${__("Upload")}</button>
 							<span class="file-name db-file-name text-muted"></span>
 						</div>
@@ -184,7 +197,20 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 								"Admin password (optional)",
 							)}">
 						</div>
+						<div class="checkbox">
+							<label>
+								<input type="checkbox" class="fast-restore">
+								${__("Fast restore (parallel decompression, streamed import)")}
+							</label>
+						</div>
+						<div class="checkbox">
+							<label>
+								<input type="checkbox" class="shadow-restore">
+								${__("Shadow restore (site stays online until a short switch-over)")}
+							</label>
+						</div>
 						<button class="btn btn-danger btn-restore">${__("Start Restore")}</button>
+						<button class="btn btn-default btn-clear-uploads">${__("Clear uploads")}</button>
 					</div>
 				</div>
 				<div class="backup-card mt-4" id="section-archive">
@@ -194,12 +220,23 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 					</div>
 					<div class="backup-archive-table"></div>
 				</div>
+				<div class="backup-card mt-4" id="section-metrics">
+					<div class="d-flex align-items-center justify-content-between mb-2">
+						<h4>${__("Backup Trends")}</h4>
+						<button class="btn btn-default btn-refresh-metrics">${__("Refresh")}</button>
+					</div>
+					<div class="backup-metrics-empty text-muted"></div>
+					<div class="backup-duration-chart"></div>
+					<div class="backup-size-chart"></div>
+				</div>
 			</div>
 			`
 		).appendTo(this.page.body);
 
 		this.$backupBtn = this.$container.find(".btn-backup");
 		this.$backupDownloads = this.$container.find(".backup-downloads");
+		this.$backupEstimate = this.$container.find(".backup-estimate");
+		this.$backupEstimateWarning = this.$container.find(".backup-estimate-warning");
 
 		this.$uploadDbBtn = this.$container.find(".btn-upload-db");
 		this.$uploadPublicBtn = this.$container.find(".btn-upload-public");
@@ -209,10 +246,17 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 		this.$privateFileName = this.$container.find(".private-file-name");
 		this.$dbRootPassword = this.$container.find(".db-root-password");
 		this.$adminPassword = this.$container.find(".admin-password");
+		this.$fastRestore = this.$container.find(".fast-restore");
+		this.$shadowRestore = this.$container.find(".shadow-restore");
 		this.$restoreBtn = this.$container.find(".btn-restore");
+		this.$clearUploadsBtn = this.$container.find(".btn-clear-uploads");
 
 		this.$archiveTable = this.$container.find(".backup-archive-table");
 		this.$refreshArchive = this.$container.find(".btn-refresh-archive");
+		this.$refreshMetrics = this.$container.find(".btn-refresh-metrics");
+		this.$metricsEmpty = this.$container.find(".backup-metrics-empty");
+		this.$durationChart = this.$container.find(".backup-duration-chart");
+		this.$sizeChart = this.$container.find(".backup-size-chart");
 		this.$installWarning = this.$container.find(".backup-install-warning");
 		this.$permissionWarning = this.$container.find(".backup-permission-warning");
 	}
@@ -223,7 +267,9 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 		this.$uploadPublicBtn.on("click", () => this._openUploader("public"));
 		this.$uploadPrivateBtn.on("click", () => this._openUploader("private"));
 		this.$restoreBtn.on("click", () => this.startRestore());
+		this.$clearUploadsBtn.on("click", () => this.clearUploads());
 		this.$refreshArchive.on("click", () => this.refreshArchives());
+		this.$refreshMetrics.on("click", () => this.refreshMetrics());
 
 		this.$archiveTable.on("click", ".btn-restore-archive", (event) => {
 			const name = $(event.currentTarget).data("name");
@@ -231,6 +277,30 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 				this.restoreFromArchive(name);
 			}
 		});
+		this.$archiveTable.on("click", ".btn-verify-archive", (event) => {
+			const name = $(event.currentTarget).data("name");
+			if (name) {
+				this.verifyArchive(name, $(event.currentTarget));
+			}
+		});
+	}
+
+	_subscribeRealtime() {
+		// Archive rows and backup progress are pushed by the server. The full list is only
+		// fetched again after a reconnect, when events may have been missed.
+		frappe.realtime.doctype_subscribe("Backup Archive");
+		frappe.realtime.on("backup_manager_archive", (data) => this._applyArchiveEvent(data));
+		frappe.realtime.on("backup_manager_progress", (data) => this._showBackupStatus(data));
+		const socket = frappe.realtime.socket;
+		if (socket && socket.io) {
+			socket.io.on("reconnect", () => {
+				frappe.realtime.doctype_subscribe("Backup Archive");
+				this.refreshArchives();
+				if (this.watchedBackup) {
+					this._loadBackupStatus(this.watchedBackup);
+				}
+			});
+		}
 	}
 
 	_isAppInstalled() {
@@ -288,6 +358,7 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 			"import": "section-import",
 			"export": "section-export",
 			"archive": "section-archive",
+			"metrics": "section-metrics",
 		};
 		const targetId = targetIds[section];
 		if (!targetId) {
@@ -305,54 +376,180 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 	}
 
 	_openUploader(type) {
-		const labels = {
-			db: __("Upload DB Backup"),
-			public: __("Upload Public Files"),
-			private: __("Upload Private Files"),
-		};
 		const allowedByType = {
-			db: [".sql", ".sql.gz", ".gz"],
-			public: [".tar", ".tar.gz", ".tgz", ".gz"],
-			private: [".tar", ".tar.gz", ".tgz", ".gz"],
+			db: [".sql", ".sql.gz", ".gz", ".sql.zst", ".zst"],
+			public: [".tar", ".tar.gz", ".tgz", ".gz", ".tar.zst", ".zst"],
+			private: [".tar", ".tar.gz", ".tgz", ".gz", ".tar.zst", ".zst"],
 		};
-		new frappe.ui.FileUploader({
-			allow_multiple: false,
-			allow_toggle_private: false,
-			allow_take_photo: false,
-			allow_web_link: false,
-			allow_google_drive: false,
-			dialog_title: labels[type] || __("Upload"),
-			restrictions: {
-				allowed_file_types: allowedByType[type] || [".sql", ".gz"],
-			},
-			on_success: (file_doc) => {
-				this._setUploadedFile(type, file_doc);
-			},
+		const $input = $(`<input type="file" accept="${(allowedByType[type] || [".sql", ".gz"]).join(",")}">`);
+		$input.on("change", () => {
+			const file = $input[0].files[0];
+			if (file) {
+				this._uploadInChunks(type, file);
+			}
 		});
+		$input.trigger("click");
 	}
 
-	_setUploadedFile(type, file_doc) {
-		const payload = {
-			file_url: file_doc.file_url,
-			file_name: file_doc.file_name || file_doc.file_url,
-		};
+	_uploadControls(type) {
+		return {
+			db: [this.$uploadDbBtn, this.$dbFileName],
+			public: [this.$uploadPublicBtn, this.$publicFileName],
+			private: [this.$uploadPrivateBtn, this.$privateFileName],
+		}[type];
+	}
 
-		if (type === "db") {
-			this.uploadedDb = payload;
-			this.$dbFileName.text(payload.file_name || "");
-			return;
+	async _uploadInChunks(type, file) {
+		// Chunks go straight into the backup archive instead of through File uploads,
+		// and the server answers every chunk with how much it has, so retries are safe.
+		const [$button, $name] = this._uploadControls(type);
+		this._setUploadedFile(type, null);
+		$button.prop("disabled", true);
+		this.uploading += 1;
+
+		let received = 0;
+		let attempt = 0;
+		try {
+			while (true) {
+				const form = new FormData();
+				form.append("kind", type);
+				form.append("filename", file.name);
+				form.append("offset", received);
+				form.append("total_size", file.size);
+				if (this.uploadId) {
+					form.append("upload_id", this.uploadId);
+				}
+				form.append("chunk", file.slice(received, received + UPLOAD_CHUNK_SIZE), file.name);
+
+				let data;
+				try {
+					data = await this._postChunk(form);
+					attempt = 0;
+				} catch (error) {
+					if (this.uploadId && received === 0 && error.retry === false) {
+						// The stored upload expired; start a new one.
+						this._setUploadId(null);
+						continue;
+					}
+					attempt += 1;
+					if (error.retry === false || attempt > UPLOAD_MAX_RETRIES) {
+						throw error;
+					}
+					$name.text(__("Connection lost, retrying..."));
+					await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
+					continue;
+				}
+
+				this._setUploadId(data.upload_id);
+				const entry = data.files[type];
+				received = entry.received;
+				$name.text(`${file.name} · ${Math.floor((received * 100) / file.size)}%`);
+				if (entry.complete) {
+					break;
+				}
+			}
+			this._setUploadedFile(type, { file_name: file.name });
+		} catch (error) {
+			$name.text("");
+			frappe.msgprint({
+				title: __("Upload failed"),
+				message: error.message,
+				indicator: "red",
+			});
+		} finally {
+			this.uploading -= 1;
+			$button.prop("disabled", false);
 		}
+	}
 
-		if (type === "public") {
-			this.uploadedPublic = payload;
-			this.$publicFileName.text(payload.file_name || "");
+	_postChunk(form) {
+		return fetch("/api/method/erpnext_backup_manager.api.upload_backup_chunk", {
+			method: "POST",
+			headers: {
+				Accept: "application/json",
+				"X-Frappe-CSRF-Token": frappe.csrf_token,
+			},
+			body: form,
+		}).then((response) =>
+			response
+				.json()
+				.catch(() => ({}))
+				.then((body) => {
+					if (!response.ok) {
+						const error = new Error(this._serverMessage(body) || response.statusText);
+						error.retry = response.status >= 500 || response.status === 429;
+						throw error;
+					}
+					return body.message;
+				})
+		);
+	}
+
+	_serverMessage(body) {
+		try {
+			return JSON.parse(body._server_messages)
+				.map((message) => JSON.parse(message).message)
+				.join("<br>");
+		} catch (e) {
+			return body.exception || "";
+		}
+	}
+
+	_loadUploadStatus() {
+		if (!this.uploadId) {
 			return;
 		}
+		frappe.call({
+			method: "erpnext_backup_manager.api.get_upload_status",
+			args: { upload_id: this.uploadId },
+			callback: (r) => {
+				const files = (r.message || {}).files || {};
+				Object.entries(files).forEach(([type, entry]) => {
+					if (entry.complete) {
+						this._setUploadedFile(type, { file_name: entry.filename });
+					} else {
+						const percent = Math.floor((entry.received * 100) / entry.total_size);
+						this._uploadControls(type)[1].text(
+							__("{0} · {1}% (select the file again to resume)", [entry.filename, percent])
+						);
+					}
+				});
+			},
+			// An expired upload is gone from the server; forget it quietly.
+			error: () => this._setUploadId(null),
+		});
+	}
+
+	clearUploads() {
+		const uploadId = this.uploadId;
+		this._setUploadId(null);
+		["db", "public", "private"].forEach((type) => this._setUploadedFile(type, null));
+		if (uploadId) {
+			frappe.call({
+				method: "erpnext_backup_manager.api.discard_upload",
+				args: { upload_id: uploadId },
+			});
+		}
+	}
 
-		if (type === "private") {
+	_setUploadId(uploadId) {
+		this.uploadId = uploadId;
+		if (uploadId) {
+			localStorage.setItem(UPLOAD_ID_STORAGE_KEY, uploadId);
+		} else {
+			localStorage.removeItem(UPLOAD_ID_STORAGE_KEY);
+		}
+	}
+
+	_setUploadedFile(type, payload) {
+		if (type === "db") {
+			this.uploadedDb = payload;
+		} else if (type === "public") {
+			this.uploadedPublic = payload;
+		} else if (type === "private") {
 			this.uploadedPrivate = payload;
-			this.$privateFileName.text(payload.file_name || "");
 		}
+		this._uploadControls(type)[1].text(payload ? payload.file_name : "");
 	}
 
 	createBackup() {
@@ -367,37 +564,220 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 			},
 			callback: (r) => {
 				const data = r.message || {};
-				const files = data.files || {};
-				const bundle = files.bundle || {};
-				const db = files.db || {};
-
-				if (bundle.url) {
-					this.$backupDownloads.html(
-						`<a href="${bundle.url}" target="_blank">${__("Download bundle")}</a>`
-					);
-					window.open(bundle.url, "_blank");
-				} else if (db.url) {
-					this.$backupDownloads.html(
-						`<a href="${db.url}" target="_blank">${__("Download DB backup")}</a>`
-					);
-				} else {
-					this.$backupDownloads.text(__("Backup created."));
+				if (!data.name) {
+					this.$backupBtn.prop("disabled", false);
+					return;
 				}
-
 				frappe.show_alert({
-					message: __("Backup created and archived."),
-					indicator: "green",
+					message: __("Backup started in the background."),
+					indicator: "blue",
 				});
-				this.refreshArchives();
+				if (data.notes) {
+					frappe.show_alert({ message: data.notes, indicator: "orange" }, 10);
+				}
+				this._watchBackup(data.name);
 			},
-			always: () => {
+			error: () => {
+				this.$backupBtn.prop("disabled", false);
+			},
+		});
+	}
+
+	_watchBackup(name) {
+		this.watchedBackup = name;
+		// Read once in case the backup moved on before the page subscribed; progress
+		// events do the rest.
+		this._loadBackupStatus(name);
+	}
+
+	_loadBackupStatus(name) {
+		frappe.call({
+			method: "erpnext_backup_manager.api.get_backup_status",
+			args: { archive_name: name },
+			callback: (r) => this._showBackupStatus(r.message || {}),
+			error: () => {
 				this.$backupBtn.prop("disabled", false);
 			},
 		});
 	}
 
+	_showBackupStatus(data) {
+		if (!data.name || data.name !== this.watchedBackup) {
+			return;
+		}
+		if (data.status === "Running") {
+			this.$backupDownloads.text(this._formatBackupProgress(data));
+			return;
+		}
+
+		this.watchedBackup = null;
+		this.$backupBtn.prop("disabled", false);
+		if (data.status === "Failed") {
+			this.$backupDownloads.text(__("Backup failed: {0}", [data.error || ""]));
+			frappe.show_alert({ message: __("Backup failed."), indicator: "red" });
+			return;
+		}
+
+		this._showBackupDownloads(data.files || {});
+		frappe.show_alert({
+			message: __("Backup created and archived."),
+			indicator: "green",
+		});
+		this.refreshMetrics();
+		this.refreshEstimate();
+	}
+
+	_formatBackupProgress(data) {
+		const phases = {
+			queued: __("Waiting for a worker"),
+			db: __("Dumping database"),
+			files: __("Archiving files"),
+			bundle: __("Building bundle"),
+			catalog: __("Cataloguing contents"),
+		};
+		const active = (data.active_phases || []).length ? data.active_phases : [data.phase];
+		const labels = active.map((phase) => phases[phase]).filter(Boolean);
+		const parts = [labels.length ? labels.join(", ") : __("Running")];
+		if (data.bytes_written) {
+			parts.push(this._formatSize(data.bytes_written));
+		}
+		if (data.eta) {
+			parts.push(__("about {0} left", [this._formatDuration(data.eta)]));
+		}
+		return parts.join(" · ");
+	}
+
+	refreshEstimate() {
+		frappe.call({
+			method: "erpnext_backup_manager.api.estimate_backup",
+			args: { include_files: 1, bundle: 1 },
+			callback: (r) => this._renderEstimate(r.message || {}),
+		});
+	}
+
+	_renderEstimate(data) {
+		this.$backupEstimate.text(
+			__("Estimated size: {0} · {1} free", [
+				this._formatSize(data.total) || "0 B",
+				this._formatSize(data.free),
+			]),
+		);
+		let warning = "";
+		if (data.preflight && data.skip_bundle) {
+			warning = __("Not enough space for the bundle; the backup will be taken without it.");
+		} else if (data.preflight && !data.fits) {
+			warning = __("Not enough disk space for this backup: {0}", [data.message]);
+		}
+		this.$backupEstimateWarning.text(warning).toggleClass("hide", !warning);
+	}
+
+	refreshMetrics() {
+		frappe.call({
+			method: "erpnext_backup_manager.api.get_backup_metrics",
+			callback: (r) => this._renderMetrics(r.message || {}),
+		});
+	}
+
+	_renderMetrics(data) {
+		const archives = data.archives || [];
+		if (archives.length < 2) {
+			this.$metricsEmpty.text(__("Trends appear once two backups have recorded their phase timings."));
+			this.$durationChart.empty();
+			this.$sizeChart.empty();
+			return;
+		}
+		this.$metricsEmpty.text("");
+
+		const labels = archives.map((row) => frappe.datetime.str_to_user(row.created_on));
+		const phaseLabels = {
+			db: __("Database"),
+			public: __("Public files"),
+			private: __("Private files"),
+			bundle: __("Bundle"),
+			catalog: __("Catalog"),
+		};
+		const toMb = (value) => Math.round(((value || 0) / (1024 * 1024)) * 10) / 10;
+
+		// Each chart is rebuilt on refresh; frappe.Chart has no way to swap its labels.
+		new frappe.Chart(this.$durationChart[0], {
+			title: __("Phase duration (seconds)"),
+			type: "line",
+			height: 240,
+			data: {
+				labels,
+				datasets: (data.phases || []).map((phase) => ({
+					name: phaseLabels[phase] || phase,
+					values: archives.map((row) => (row.phases[phase] || {}).seconds || 0),
+				})),
+			},
+			lineOptions: { dotSize: 3 },
+		});
+		new frappe.Chart(this.$sizeChart[0], {
+			title: __("Size (MB)"),
+			type: "line",
+			height: 240,
+			data: {
+				labels,
+				datasets: [
+					{
+						name: __("Database SQL"),
+						values: archives.map((row) => toMb((row.phases.db || {}).bytes_in)),
+					},
+					{ name: __("Stored on disk"), values: archives.map((row) => toMb(row.stored_bytes)) },
+				],
+			},
+			lineOptions: { dotSize: 3 },
+		});
+	}
+
+	_formatDuration(seconds) {
+		if (seconds < 60) {
+			return __("{0}s", [seconds]);
+		}
+		const minutes = Math.round(seconds / 60);
+		if (minutes < 60) {
+			return __("{0} min", [minutes]);
+		}
+		return __("{0} h {1} min", [Math.floor(minutes / 60), minutes % 60]);
+	}
+
+	_formatSize(value) {
+		if (!value) {
+			return "";
+		}
+		if (frappe.form && frappe.form.formatters && frappe.form.formatters.FileSize) {
+			return frappe.form.formatters.FileSize(value);
+		}
+		return value;
+	}
+
+	_showBackupDownloads(files) {
+		const bundle = files.bundle || {};
+		const db = files.db || {};
+
+		if (bundle.url) {
+			this.$backupDownloads.html(
+				`<a href="${bundle.url}" target="_blank">${__("Download bundle")}</a>`
+			);
+		} else if (db.url) {
+			this.$backupDownloads.html(
+				`<a href="${db.url}" target="_blank">${__("Download DB backup")}</a>`
+			);
+		} else {
+			this.$backupDownloads.text(__("Backup created."));
+		}
+	}
+
 	startRestore() {
-		if (!this.uploadedDb || !this.uploadedDb.file_url) {
+		if (this.uploading) {
+			frappe.msgprint({
+				title: __("Upload in progress"),
+				message: __("Please wait until the uploads have finished."),
+				indicator: "orange",
+			});
+			return;
+		}
+		if (!this.uploadedDb || !this.uploadId) {
 			frappe.msgprint({
 				title: __("Missing DB file"),
 				message: __("Please upload the database backup file first."),
@@ -420,27 +800,17 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 		frappe.call({
 			method: "erpnext_backup_manager.api.restore_from_upload",
 			args: {
-				db_file: this.uploadedDb.file_url,
-				public_file: this.uploadedPublic ? this.uploadedPublic.file_url : null,
-				private_file: this.uploadedPrivate ? this.uploadedPrivate.file_url : null,
+				upload_id: this.uploadId,
 				db_root_password: this.$dbRootPassword.val(),
 				admin_password: this.$adminPassword.val(),
+				restore_engine: this._restoreEngine(),
 			},
 			callback: (r) => {
 				const data = r.message || {};
-				const logUrl = data.restore_log_url;
-				let message = __("Restore started. The site will be in maintenance mode.");
-				if (logUrl) {
-					message += `<br><a href="${logUrl}" target="_blank">${__(
-						"View restore log",
-					)}</a>`;
-				}
-				frappe.msgprint({
-					title: __("Restore started"),
-					message: message,
-					indicator: "orange",
-				});
-				this.refreshArchives();
+				// The server has moved the uploaded files into the new archive.
+				this._setUploadId(null);
+				["db", "public", "private"].forEach((type) => this._setUploadedFile(type, null));
+				this._watchRestore(data.archive, data.restore_log_url);
 			},
 			always: () => {
 				this.$restoreBtn.prop("disabled", false);
@@ -448,6 +818,14 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 		});
 	}
 
+	_restoreEngine() {
+		// Unchecked leaves the choice to the site's backup_manager_restore_engine setting.
+		if (this.$shadowRestore.prop("checked")) {
+			return "shadow";
+		}
+		return this.$fastRestore.prop("checked") ? "fast" : null;
+	}
+
 	restoreFromArchive(archiveName) {
 		frappe.confirm(
 			__("Restore from archive {0}? Current data will be overwritten.", [archiveName]),
@@ -458,27 +836,134 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 						archive_name: archiveName,
 						db_root_password: this.$dbRootPassword.val(),
 						admin_password: this.$adminPassword.val(),
+						restore_engine: this._restoreEngine(),
 					},
 					callback: (r) => {
 						const data = r.message || {};
-						let message = __("Restore started from archive.");
-						if (data.restore_log_url) {
-							message += `<br><a href="${data.restore_log_url}" target="_blank">${__(
-								"View restore log",
-							)}</a>`;
-						}
-						frappe.msgprint({
-							title: __("Restore started"),
-							message,
-							indicator: "orange",
-						});
-						this.refreshArchives();
+						this._watchRestore(data.archive, data.restore_log_url);
 					},
 				});
 			}
 		);
 	}
 
+	_watchRestore(archiveName, logUrl) {
+		const phases = {
+			starting: __("Starting"),
+			prepare: __("Rebuilding file archives"),
+			maintenance: __("Enabling maintenance mode"),
+			restore: __("Restoring database and files"),
+			migrate: __("Running migrations"),
+			swap: __("Switching to the restored database"),
+			finalize: __("Disabling maintenance mode"),
+			done: __("Done"),
+		};
+		const dialog = new frappe.ui.Dialog({
+			title: __("Restore started. The site will be in maintenance mode."),
+			fields: [{ fieldtype: "HTML", fieldname: "progress" }],
+		});
+		const $status = $(`<div class="text-muted small"></div>`);
+		const $log = $(`<pre style="max-height: 360px; overflow: auto; white-space: pre-wrap;"></pre>`);
+		const logLink = logUrl ? `<a href="${logUrl}" target="_blank">${__("View restore log")}</a>` : "";
+		const $shadowActions = $(`<div class="mt-2"></div>`);
+		dialog.fields_dict.progress.$wrapper.append($status, $log, $shadowActions);
+		dialog.show();
+
+		let offset = 0;
+		const poll = () => {
+			if (!dialog.display) {
+				return;
+			}
+			frappe.call({
+				method: "erpnext_backup_manager.api.get_restore_status",
+				args: { archive_name: archiveName, offset },
+				callback: (r) => {
+					const data = r.message || {};
+					offset = data.offset || offset;
+					if (data.log) {
+						$log.append(document.createTextNode(data.log));
+						$log.scrollTop($log.prop("scrollHeight"));
+					}
+					const parts = [phases[data.phase] || data.phase || "", data.status || ""];
+					if (data.elapsed) {
+						parts.push(this._formatDuration(data.elapsed));
+					}
+					$status.html(`${parts.filter(Boolean).join(" · ")} ${logLink}`);
+					// The log is only read here; the archive row itself is updated by events.
+					if (data.status === "Restoring") {
+						setTimeout(poll, 2000);
+					} else if (data.shadow && data.shadow.state === "swapped") {
+						this._renderShadowActions($shadowActions, archiveName, data.shadow);
+					}
+				},
+				// Requests fail while the site is in maintenance mode; keep polling.
+				error: () => setTimeout(poll, 5000),
+			});
+		};
+		poll();
+	}
+
+	_renderShadowActions($wrapper, archiveName, shadow) {
+		// The database the site ran on before the switch is kept until it is discarded.
+		const $rollback = $(`<button class="btn btn-default btn-sm">${__("Roll back")}</button>`);
+		const $discard = $(
+			`<button class="btn btn-default btn-sm ml-2">${__("Discard previous database")}</button>`
+		);
+		$wrapper.empty().append(
+			$(`<div class="text-muted small mb-2"></div>`).text(
+				__("Previous database {0} is kept.", [shadow.live_db])
+			),
+			$rollback,
+			$discard
+		);
+		const run = (method, message) => {
+			$wrapper.find("button").prop("disabled", true);
+			frappe.call({
+				method,
+				args: { archive_name: archiveName },
+				callback: () => {
+					frappe.show_alert({ message, indicator: "green" });
+					$wrapper.empty();
+				},
+				always: () => $wrapper.find("button").prop("disabled", false),
+			});
+		};
+		$rollback.on("click", () =>
+			frappe.confirm(__("Switch the site back to database {0}?", [shadow.live_db]), () =>
+				// Queued; the archive row changes once the site is back on the previous database.
+				run("erpnext_backup_manager.api.rollback_shadow_restore", __("Rolling back the restore."))
+			)
+		);
+		$discard.on("click", () =>
+			frappe.confirm(__("Drop database {0}? Rolling back is no longer possible.", [shadow.live_db]), () =>
+				run("erpnext_backup_manager.api.discard_shadow_restore", __("Dropping the previous database."))
+			)
+		);
+	}
+
+	verifyArchive(archiveName, $button) {
+		$button.prop("disabled", true);
+		frappe.call({
+			method: "erpnext_backup_manager.api.verify_archive",
+			args: { archive_name: archiveName },
+			callback: (r) => {
+				const data = r.message || {};
+				if (data.verification_status === "Verified") {
+					frappe.show_alert({ message: __("Archive verified."), indicator: "green" });
+				} else {
+					frappe.msgprint({
+						title: __("Verification failed"),
+						message: (data.errors || []).map((error) => frappe.utils.escape_html(error)).join("<br>"),
+						indicator: "red",
+					});
+				}
+			},
+			always: () => {
+				$button.prop("disabled", false);
+			},
+		});
+	}
+
 	refreshArchives() {
 		if (!this._isAppInstalled()) {
 			this.$archiveTable.html(
@@ -488,80 +973,70 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 		}
 
 		this.$archiveTable.html(`<div class="text-muted">${__("Loading archive...")}</div>`);
+		// Events are ignored until the first page is in; it already holds their changes.
+		this.archivePage = null;
+		this.archiveRows = [];
+		this._loadArchivePage(null);
+	}
+
+	_loadArchivePage(cursor) {
 		frappe.call({
 			method: "erpnext_backup_manager.api.list_archives",
+			args: { cursor },
 			callback: (r) => {
-				const rows = r.message || [];
-				this._renderArchive(rows);
+				const page = r.message || {};
+				this.archivePage = page;
+				this.archiveRows = (this.archiveRows || []).concat(
+					(page.archives || []).map((row) => ({ ...row, ...this._archiveDownloads(row, page) }))
+				);
+				this._renderArchive(this.archiveRows);
 			},
 		});
 	}
 
+	_archiveDownloads(row, page) {
+		// The server sends base URLs once per page; links are expanded here per row.
+		const fileUrl = (path) => (path ? page.download_base_url + encodeURIComponent(path) : "");
+		let bundle = fileUrl(row.bundle_file_path);
+		if (
+			!bundle &&
+			(page.bundle_streamed ||
+				(row.files_mode && row.files_mode !== "Full") ||
+				row.db_dump_mode === "Per Table")
+		) {
+			bundle = page.bundle_base_url + encodeURIComponent(row.name);
+		}
+		return {
+			downloads: {
+				bundle,
+				db: fileUrl(row.db_file_path),
+				public: fileUrl(row.public_file_path),
+				private: fileUrl(row.private_file_path),
+				config: fileUrl(row.config_file_path),
+			},
+			restore_log_url: fileUrl(row.restore_log_path),
+		};
+	}
+
+	_archiveSummary() {
+		const totals = (this.archivePage && this.archivePage.totals) || {};
+		const parts = [__("{0} archives", [totals.count || 0])];
+		const size = this._formatSize(
+			(totals.db_size || 0) + (totals.public_size || 0) + (totals.private_size || 0) + (totals.bundle_size || 0)
+		);
+		if (size) {
+			parts.push(size);
+		}
+		return `<div class="text-muted small archive-summary">${parts.join(" · ")}</div>`;
+	}
+
 	_renderArchive(rows) {
 		if (!rows.length) {
 			this.$archiveTable.html(`<div class="text-muted">${__("No archived backups yet.")}</div>`);
 			return;
 		}
 
-		const formatSize = (value) => {
-			if (!value) {
-				return "";
-			}
-			if (frappe.form && frappe.form.formatters && frappe.form.formatters.FileSize) {
-				return frappe.form.formatters.FileSize(value);
-			}
-			return value;
-		};
-
-		const buildFileList = (row) => {
-			const fileDefs = [
-				{ key: "bundle", label: __("Bundle"), pathKey: "bundle_file_path", sizeKey: "bundle_size" },
-				{ key: "db", label: __("DB"), pathKey: "db_file_path", sizeKey: "db_size" },
-				{ key: "public", label: __("Public"), pathKey: "public_file_path", sizeKey: "public_size" },
-				{ key: "private", label: __("Private"), pathKey: "private_file_path", sizeKey: "private_size" },
-				{ key: "config", label: __("Config"), pathKey: "config_file_path", sizeKey: null },
-				{ key: "restore_log", label: __("Log"), pathKey: "restore_log_path", sizeKey: null },
-			];
-
-			const parts = fileDefs
-				.map((file) => {
-					const path = row[file.pathKey];
-					const url =
-						file.key === "restore_log"
-							? row.restore_log_url
-							: (row.downloads && row.downloads[file.key]) || "";
-					if (!path || !url) {
-						return "";
-					}
-					const fileName = path.split("/").pop();
-					const size = file.sizeKey ? formatSize(row[file.sizeKey]) : "";
-					const sizeLabel = size ? ` (${size})` : "";
-					return `<div><a href="${url}" target="_blank">${file.label}: ${fileName}</a>${sizeLabel}</div>`;
-				})
-				.filter(Boolean)
-				.join("");
-
-			return parts || `<div class="text-muted">${__("No files")}</div>`;
-		};
-
-		const body = rows
-			.map((row) => {
-				const restoreButton = `<button class="btn btn-xs btn-danger btn-restore-archive" data-name="${
-					row.name
-				}">${__("Restore")}</button>`;
-
-				return `
-					<tr>
-						<td>${frappe.utils.escape_html(row.title || row.name)}</td>
-						<td>${frappe.utils.escape_html(row.source || "")}</td>
-						<td>${frappe.utils.escape_html(row.status || "")}</td>
-						<td>${frappe.datetime.str_to_user(row.created_on || "")}</td>
-						<td>${buildFileList(row)}</td>
-						<td class="text-right">${restoreButton}</td>
-					</tr>
-				`;
-			})
-			.join("");
+		const body = rows.map((row) => this._archiveRowHtml(row)).join("");
 
 		this.$archiveTable.html(
 			`
@@ -578,7 +1053,132 @@ erpnext_backup_manager.pages.BackupCenter = class BackupCenter {
 				</thead>
 				<tbody>${body}</tbody>
 			</table>
+			${this._archiveSummary()}
 			`
 		);
+
+		const nextCursor = this.archivePage && this.archivePage.next_cursor;
+		if (nextCursor) {
+			$(`<button class="btn btn-xs btn-default">${__("Load more")}</button>`)
+				.appendTo(this.$archiveTable)
+				.on("click", (event) => {
+					$(event.currentTarget).prop("disabled", true);
+					this._loadArchivePage(nextCursor);
+				});
+		}
+	}
+
+	_archiveFileList(row) {
+		const fileDefs = [
+			{ key: "bundle", label: __("Bundle"), pathKey: "bundle_file_path", sizeKey: "bundle_size" },
+			{ key: "db", label: __("DB"), pathKey: "db_file_path", sizeKey: "db_size" },
+			{ key: "public", label: __("Public"), pathKey: "public_file_path", sizeKey: "public_size" },
+			{ key: "private", label: __("Private"), pathKey: "private_file_path", sizeKey: "private_size" },
+			{ key: "config", label: __("Config"), pathKey: "config_file_path", sizeKey: null },
+			{ key: "restore_log", label: __("Log"), pathKey: "restore_log_path", sizeKey: null },
+		];
+
+		const parts = fileDefs
+			.map((file) => {
+				const path = row[file.pathKey];
+				const url =
+					file.key === "restore_log"
+						? row.restore_log_url
+						: (row.downloads && row.downloads[file.key]) || "";
+				if (!url) {
+					return "";
+				}
+				// Streamed bundles have a download URL but no stored file.
+				if (!path && file.key !== "bundle") {
+					return "";
+				}
+				const fileName = path ? path.split("/").pop() : `${row.name}_bundle.zip`;
+				const size = file.sizeKey ? this._formatSize(row[file.sizeKey]) : "";
+				const sizeLabel = size ? ` (${size})` : "";
+				return `<div><a href="${url}" target="_blank">${file.label}: ${fileName}</a>${sizeLabel}</div>`;
+			})
+			.filter(Boolean)
+			.join("");
+
+		return parts || `<div class="text-muted">${__("No files")}</div>`;
+	}
+
+	_archiveRowHtml(row) {
+		const restoreButton =
+			row.status === "Running" || !row.db_file_path
+				? ""
+				: `<button class="btn btn-xs btn-danger btn-restore-archive" data-name="${
+						row.name
+				  }">${__("Restore")}</button>`;
+		const verifyButton =
+			row.status === "Running"
+				? ""
+				: `<button class="btn btn-xs btn-default btn-verify-archive" data-name="${
+						row.name
+				  }">${__("Verify")}</button>`;
+		const verification =
+			row.verification_status === "Failed"
+				? `<div class="text-danger small">${__("Verification failed")}</div>`
+				: row.verification_status === "Verified"
+				? `<div class="text-muted small">${__("Verified")}</div>`
+				: "";
+		const phase =
+			row.status === "Restoring" && row.restore_phase
+				? `<div class="text-muted small">${frappe.utils.escape_html(row.restore_phase)}</div>`
+				: "";
+
+		return `
+			<tr data-name="${frappe.utils.escape_html(row.name)}">
+				<td>${frappe.utils.escape_html(row.title || row.name)}</td>
+				<td>${frappe.utils.escape_html(row.source || "")}</td>
+				<td>${frappe.utils.escape_html(row.status || "")}${verification}${phase}</td>
+				<td>${frappe.datetime.str_to_user(row.created_on || "")}</td>
+				<td>${this._archiveFileList(row)}</td>
+				<td class="text-right">${verifyButton} ${restoreButton}</td>
+			</tr>
+		`;
+	}
+
+	_applyArchiveEvent(data) {
+		const page = this.archivePage;
+		if (!page || !this.archiveRows) {
+			// The first page has not loaded yet and will include the change.
+			return;
+		}
+		if (data.totals) {
+			page.totals = data.totals;
+		}
+		const index = this.archiveRows.findIndex((row) => row.name === data.name);
+		if (data.op === "delete") {
+			if (index >= 0) {
+				this.archiveRows.splice(index, 1);
+			}
+		} else if (index >= 0) {
+			const row = { ...this.archiveRows[index], ...data.values };
+			this.archiveRows[index] = { ...row, ...this._archiveDownloads(row, page) };
+		} else if (data.op === "insert") {
+			// Newest first, like the listing.
+			this.archiveRows.unshift({ ...data.values, ...this._archiveDownloads(data.values, page) });
+		}
+		this._patchArchiveRow(data.name);
+	}
+
+	_patchArchiveRow(name) {
+		const $body = this.$archiveTable.find("tbody");
+		if (!$body.length || !this.archiveRows.length) {
+			// Empty-list message, or the last row is gone.
+			this._renderArchive(this.archiveRows);
+			return;
+		}
+		const $row = $body.children("tr").filter((_index, tr) => tr.dataset.name === name);
+		const row = this.archiveRows.find((archive) => archive.name === name);
+		if (!row) {
+			$row.remove();
+		} else if ($row.length) {
+			$row.replaceWith(this._archiveRowHtml(row));
+		} else {
+			$body.prepend(this._archiveRowHtml(row));
+		}
+		this.$archiveTable.find(".archive-summary").replaceWith(this._archiveSummary());
 	}
 };
@@ -0,0 +1,207 @@
+"""Backup size estimates and free-space checks, made before anything is written.
+
+The estimate combines three cheap inputs:
+
+- table sizes from ``information_schema`` (read by the caller), scaled by the
+  dump-to-table ratio of recent backups;
+- the size of the file trees, from `tree_size`, which keeps a per-directory index
+  so a repeat scan stats each directory instead of every file;
+- the stored-to-logical and bundle ratios of recent archives.
+
+Without history, conservative defaults stand in for the ratios. `shortfalls` then
+compares what an operation will write with the free space of each filesystem
+involved.
+
+Kept free of Frappe imports so it can be exercised on plain data.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import statistics
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+INDEX_VERSION = 1
+# gzip of mysqldump output against InnoDB data_length; most sites land well below.
+DEFAULT_DB_RATIO = 0.35
+# The same for the other codecs of `compression`, whose output sizes differ from gzip's.
+DEFAULT_DB_RATIOS = {"zstd": 0.3, "none": 1.2}
+# tar header plus average padding per member.
+TAR_OVERHEAD_PER_FILE = 512 + 256
+# Estimates are padded by this factor before they are compared with free space.
+ESTIMATE_MARGIN = 1.15
+# Recent archives whose ratios are averaged.
+HISTORY_SIZE = 5
+
+
+def _scan_dir(path: Path, cached: Optional[Dict[str, Any]]) -> tuple[Dict[str, Any], list[str]]:
+	"""Own files and subdirectories of `path`; the index entry is reused while its mtime holds."""
+	mtime_ns = path.stat().st_mtime_ns
+	if cached and cached["mtime_ns"] == mtime_ns:
+		return cached, cached["dirs"]
+	entry = {"mtime_ns": mtime_ns, "bytes": 0, "files": 0, "dirs": []}
+	with os.scandir(path) as entries:
+		for item in entries:
+			if item.is_dir(follow_symlinks=False):
+				entry["dirs"].append(item.name)
+			elif item.is_file(follow_symlinks=False):
+				entry["bytes"] += item.stat(follow_symlinks=False).st_size
+				entry["files"] += 1
+	return entry, entry["dirs"]
+
+
+def tree_size(root: Path, index_path: Optional[Path] = None) -> Dict[str, int]:
+	"""Bytes and file count below `root`.
+
+	Adding, removing or renaming a file changes its directory's mtime, so only those
+	directories are listed again. A file rewritten in place is not noticed until
+	something else changes in its directory; Frappe never rewrites attachments.
+	"""
+	index: Dict[str, Any] = {}
+	if index_path and index_path.exists():
+		try:
+			stored = json.loads(index_path.read_text(encoding="utf-8"))
+			if stored.get("version") == INDEX_VERSION and stored.get("root") == str(root):
+				index = stored["dirs"]
+		except ValueError:
+			index = {}
+
+	fresh: Dict[str, Any] = {}
+	total = {"bytes": 0, "files": 0}
+	pending = [""] if root.is_dir() else []
+	while pending:
+		rel_path = pending.pop()
+		try:
+			entry, subdirs = _scan_dir(root / rel_path, index.get(rel_path))
+		except FileNotFoundError:
+			continue
+		fresh[rel_path] = entry
+		total["bytes"] += entry["bytes"]
+		total["files"] += entry["files"]
+		pending.extend(f"{rel_path}/{name}" if rel_path else name for name in subdirs)
+
+	if index_path:
+		index_path.parent.mkdir(parents=True, exist_ok=True)
+		tmp_path = index_path.with_name(f".{index_path.name}.{uuid.uuid4().hex}")
+		tmp_path.write_text(
+			json.dumps({"version": INDEX_VERSION, "root": str(root), "dirs": fresh}), encoding="utf-8"
+		)
+		os.replace(tmp_path, index_path)
+	return total
+
+
+def _files_size(row: Dict[str, Any]) -> int:
+	return (row.get("public_size") or 0) + (row.get("private_size") or 0)
+
+
+def _format(codec: Optional[str]) -> str:
+	# pigz writes gzip; archives from before the codec was recorded are gzip dumps and plain tars.
+	return "gzip" if codec in (None, "gzip", "pigz") else codec
+
+
+def _ratio(pairs: Iterable[tuple[Any, Any]], default: float) -> tuple[float, str]:
+	"""Median of part/whole over the history; the default when there is none."""
+	ratios = [part / whole for part, whole in pairs if part and whole]
+	if not ratios:
+		return default, "default"
+	return statistics.median(ratios), "history"
+
+
+def estimate_backup(
+	*,
+	table_bytes: Optional[int],
+	trees: Dict[str, Dict[str, int]],
+	history: list[Dict[str, Any]],
+	files_mode: str,
+	bundle: bool,
+	db_compression: str = "gzip",
+	files_compression: str = "none",
+) -> Dict[str, Any]:
+	"""Predicted bytes per backup component.
+
+	`trees` maps "public"/"private" to `tree_size` results (empty to leave files out).
+	`history` holds recent archives (newest first) with ``db_size``, ``db_table_bytes``,
+	``public_size``, ``private_size``, ``files_stored_size``, ``bundle_size`` and
+	``files_mode`` (the `files_mode` keys: tar, dedup, incremental), plus the
+	``db_compression`` and ``files_compression`` codecs and, for compressed tars,
+	``files_tar_bytes`` (the tars before compression). Ratios only come from
+	archives written in the same format.
+	"""
+	recent = history[:HISTORY_SIZE]
+	basis = {}
+	if table_bytes:
+		same_codec = [row for row in recent if _format(row.get("db_compression")) == _format(db_compression)]
+		db_ratio, basis["db"] = _ratio(
+			((row.get("db_size"), row.get("db_table_bytes")) for row in same_codec),
+			DEFAULT_DB_RATIOS.get(_format(db_compression), DEFAULT_DB_RATIO),
+		)
+		db = int(table_bytes * db_ratio)
+	elif recent:
+		db, basis["db"] = int(recent[0].get("db_size") or 0), "last backup"
+	else:
+		db, basis["db"] = 0, "unknown"
+
+	files = {}
+	for kind, tree in trees.items():
+		if files_mode == "tar":
+			files[kind] = tree["bytes"] + tree["files"] * TAR_OVERHEAD_PER_FILE
+			basis["files"] = "tree scan"
+			if files_compression != "none":
+				# Attachments are mostly compressed already; without history the tar size stands.
+				same_codec = [
+					row
+					for row in recent
+					if row.get("files_mode") == "tar"
+					and _format(row.get("files_compression") or "none") == _format(files_compression)
+				]
+				tar_ratio, basis["files"] = _ratio(
+					((_files_size(row), row.get("files_tar_bytes")) for row in same_codec), 1.0
+				)
+				files[kind] = int(files[kind] * tar_ratio)
+		else:
+			# Deduplicated and incremental backups write only what changed; a first run writes it all.
+			same_mode = [row for row in recent if row.get("files_mode") == files_mode]
+			stored_ratio, basis["files"] = _ratio(
+				((row.get("files_stored_size"), _files_size(row)) for row in same_mode), 1.0
+			)
+			files[kind] = int(tree["bytes"] * stored_ratio)
+
+	bundle_bytes = 0
+	if bundle:
+		bundle_ratio, basis["bundle"] = _ratio(
+			((row.get("bundle_size"), (row.get("db_size") or 0) + _files_size(row)) for row in recent), 1.0
+		)
+		bundle_bytes = int((db + sum(files.values())) * bundle_ratio)
+
+	return {
+		"db": db,
+		**files,
+		"bundle": bundle_bytes,
+		"total": db + sum(files.values()) + bundle_bytes,
+		"basis": basis,
+	}
+
+
+def shortfalls(needs: Iterable[tuple[Path, int]], reserve: int) -> list[Dict[str, Any]]:
+	"""Filesystems that cannot take the bytes to be written under each path and keep `reserve` free.
+
+	`needs` holds ``(path, bytes)`` pairs; paths on the same filesystem are added up.
+	"""
+	by_device: Dict[int, Dict[str, Any]] = {}
+	for path, size in needs:
+		existing = path
+		while not existing.exists():
+			existing = existing.parent
+		device = existing.stat().st_dev
+		entry = by_device.setdefault(device, {"path": str(existing), "needed": 0})
+		entry["needed"] += int(size * ESTIMATE_MARGIN)
+	problems = []
+	for entry in by_device.values():
+		entry["free"] = shutil.disk_usage(entry["path"]).free
+		if entry["needed"] and entry["needed"] + reserve > entry["free"]:
+			problems.append(entry)
+	return problems
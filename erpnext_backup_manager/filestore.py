@@ -0,0 +1,404 @@
+"""Manifest-based file backups: a content-addressed store and incremental tars.
+
+Both modes write a manifest listing path, size, mtime, mode and hash of every file.
+
+* ``dedup``: each file is kept once under ``<archive root>/store/objects/<2 hex>/<sha256>``.
+* ``incremental``: each backup writes a tar of new and changed files only; manifest
+  entries point at the tar and data offset holding the current content, so the
+  newest manifest describes the whole chain back to its base.
+
+Restores rebuild the tar that ``bench restore --with-public-files`` expects from
+the manifest.
+
+Kept free of Frappe imports: it runs in worker threads during backups and as
+``python -m erpnext_backup_manager.filestore`` from the restore script.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import uuid
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from erpnext_backup_manager.integrity import HashingWriter
+
+MANIFEST_SUFFIX = ".manifest.json.gz"
+MANIFEST_VERSION = 1
+STORE_DIRNAME = "store"
+HASH_CHUNK_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def is_manifest(path: Optional[Path]) -> bool:
+	return bool(path) and path.name.endswith(MANIFEST_SUFFIX)
+
+
+def tar_name(manifest_path: Path) -> str:
+	"""File name of the tar a manifest stands for."""
+	return manifest_path.name[: -len(MANIFEST_SUFFIX)] + ".tar"
+
+
+def delta_tar_path(manifest_path: Path) -> Path:
+	"""Where an incremental backup keeps the tar of files that changed in that run."""
+	return manifest_path.with_name(manifest_path.name[: -len(MANIFEST_SUFFIX)] + ".delta.tar")
+
+
+def blob_path(archive_root: Path, digest: str) -> Path:
+	return archive_root / STORE_DIRNAME / "objects" / digest[:2] / digest
+
+
+def scan_tree(root: Path) -> Iterator[tuple[str, os.stat_result]]:
+	"""Yield (relative posix path, stat) for every regular file below `root`."""
+	stack = [root]
+	while stack:
+		current = stack.pop()
+		try:
+			entries = list(os.scandir(current))
+		except FileNotFoundError:
+			continue
+		for entry in entries:
+			if entry.is_dir(follow_symlinks=False):
+				stack.append(Path(entry.path))
+			elif entry.is_file(follow_symlinks=False):
+				rel_path = Path(entry.path).relative_to(root).as_posix()
+				yield rel_path, entry.stat(follow_symlinks=False)
+
+
+def write_manifest(path: Path, header: Dict[str, Any], entries: list[Dict[str, Any]]) -> Dict[str, Any]:
+	"""Write the manifest atomically and return the checksum of the file written."""
+	tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+	with open(tmp_path, "wb") as raw:
+		writer = HashingWriter(raw)
+		with gzip.GzipFile(filename="", mode="wb", fileobj=writer) as packed:
+			with io.TextIOWrapper(packed, encoding="utf-8") as handle:
+				handle.write(json.dumps({"version": MANIFEST_VERSION, **header}) + "\n")
+				for entry in entries:
+					handle.write(json.dumps(entry, separators=(",", ":")) + "\n")
+	os.replace(tmp_path, path)
+	return writer.checksum()
+
+
+def read_manifest_header(path: Path) -> Dict[str, Any]:
+	with gzip.open(path, "rt", encoding="utf-8") as handle:
+		return json.loads(handle.readline())
+
+
+def read_manifest(path: Path) -> tuple[Dict[str, Any], list[Dict[str, Any]]]:
+	with gzip.open(path, "rt", encoding="utf-8") as handle:
+		header = json.loads(handle.readline())
+		entries = [json.loads(line) for line in handle if line.strip()]
+	return header, entries
+
+
+def _store_file(archive_root: Path, source: Path) -> tuple[str, int, bool]:
+	"""Copy `source` into the store, named by the hash of the bytes copied.
+
+	The file is read once, so a file changed while it is copied still gets a blob whose
+	name matches its content. Returns the digest, the size copied and whether a new blob
+	was written. Raises FileNotFoundError when `source` is gone.
+	"""
+	# On the store's filesystem, so the finished copy is renamed into place.
+	tmp_dir = archive_root / STORE_DIRNAME / "tmp"
+	tmp_dir.mkdir(parents=True, exist_ok=True)
+	tmp_path = tmp_dir / uuid.uuid4().hex
+	try:
+		with open(source, "rb") as handle, open(tmp_path, "wb") as raw:
+			writer = HashingWriter(raw)
+			shutil.copyfileobj(handle, writer, HASH_CHUNK_SIZE)
+		digest = writer.digest.hexdigest()
+		target = blob_path(archive_root, digest)
+		if target.exists():
+			return digest, writer.size, False
+		target.parent.mkdir(parents=True, exist_ok=True)
+		os.replace(tmp_path, target)
+		return digest, writer.size, True
+	finally:
+		tmp_path.unlink(missing_ok=True)
+
+
+def _load_previous(previous_manifest: Optional[Path]) -> tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+	if not previous_manifest or not previous_manifest.exists():
+		return {}, {}
+	header, entries = read_manifest(previous_manifest)
+	return header, {entry["path"]: entry for entry in entries}
+
+
+def _unchanged(cached: Optional[Dict[str, Any]], stat: os.stat_result) -> bool:
+	return bool(cached) and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns
+
+
+def snapshot_directory(
+	source: str,
+	manifest_path: Path,
+	archive_root: Path,
+	*,
+	cwd: str,
+	previous_manifest: Optional[Path] = None,
+) -> Dict[str, int]:
+	"""Store every file below `source` and write its manifest.
+
+	`source` is the same site-relative path the tar engine archives; it becomes the tar
+	member prefix on restore. Files whose size and mtime match `previous_manifest` reuse
+	the recorded hash, so unchanged files are neither read nor written.
+	"""
+	root = Path(cwd, source)
+	known = _load_previous(previous_manifest)[1]
+
+	entries = []
+	stats = {"files": 0, "bytes": 0, "new_files": 0, "new_bytes": 0}
+	for rel_path, stat in scan_tree(root):
+		cached = known.get(rel_path)
+		size = stat.st_size
+		if _unchanged(cached, stat) and blob_path(archive_root, cached["sha256"]).exists():
+			digest = cached["sha256"]
+		else:
+			try:
+				digest, size, written = _store_file(archive_root, root / rel_path)
+			except FileNotFoundError:
+				# Deleted since the scan, as the tar mode tolerates too.
+				continue
+			if written:
+				stats["new_files"] += 1
+				stats["new_bytes"] += size
+
+		entries.append(
+			{
+				"path": rel_path,
+				"size": size,
+				"mtime_ns": stat.st_mtime_ns,
+				"mode": stat.st_mode & 0o7777,
+				"sha256": digest,
+			}
+		)
+		stats["files"] += 1
+		stats["bytes"] += size
+
+	entries.sort(key=lambda entry: entry["path"])
+	manifest = write_manifest(manifest_path, {"kind": "dedup", "prefix": source, **stats}, entries)
+	return {**stats, "manifest": manifest}
+
+
+def _tar_info(prefix: str, entry: Dict[str, Any]) -> tarfile.TarInfo:
+	# GNU tar drops a leading "/" from member names; mirror it so `--strip 2` still applies.
+	info = tarfile.TarInfo(f"{prefix.rstrip('/')}/{entry['path']}".lstrip("/"))
+	info.size = entry["size"]
+	info.mtime = entry["mtime_ns"] // 1_000_000_000
+	info.mode = entry["mode"]
+	return info
+
+
+def _tar_header(prefix: str, entry: Dict[str, Any]) -> bytes:
+	return _tar_info(prefix, entry).tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+
+
+def _tar_padding(size: int) -> bytes:
+	return tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+
+
+def incremental_snapshot(
+	source: str,
+	manifest_path: Path,
+	tar_path: Path,
+	archive_root: Path,
+	*,
+	cwd: str,
+	previous_manifest: Optional[Path] = None,
+	full_every: int = 7,
+) -> Dict[str, Any]:
+	"""Tar new and changed files below `source` and write the cumulative manifest.
+
+	Files whose size and mtime match `previous_manifest` are not read; their entries are
+	carried over and keep pointing at the tar that holds them. Hashes of changed files
+	are computed while they are copied into the tar. A full base is taken when there is
+	no previous manifest or the chain has reached `full_every` increments.
+	"""
+	root = Path(cwd, source)
+	previous_header, known = _load_previous(previous_manifest)
+	chain_length = int(previous_header.get("chain_length", -1)) + 1 if known else 0
+	if chain_length >= full_every:
+		known, chain_length = {}, 0
+
+	tar_rel = tar_path.relative_to(archive_root).as_posix()
+	entries = []
+	seen = set()
+	stats = {"files": 0, "bytes": 0, "new_files": 0, "new_bytes": 0}
+	with open(tar_path, "wb") as raw:
+		# Hashed as it is written; the checksum is kept in the manifest header.
+		tar = HashingWriter(raw)
+		for rel_path, stat in scan_tree(root):
+			cached = known.get(rel_path)
+			if _unchanged(cached, stat):
+				seen.add(rel_path)
+				stats["files"] += 1
+				stats["bytes"] += stat.st_size
+				entries.append(cached)
+				continue
+			try:
+				# Opened before the header is written, so a file deleted since the scan
+				# leaves nothing in the tar; it is then recorded as deleted.
+				handle = open(root / rel_path, "rb")
+			except FileNotFoundError:
+				continue
+			seen.add(rel_path)
+			stats["files"] += 1
+			stats["bytes"] += stat.st_size
+
+			entry = {
+				"path": rel_path,
+				"size": stat.st_size,
+				"mtime_ns": stat.st_mtime_ns,
+				"mode": stat.st_mode & 0o7777,
+			}
+			tar.write(_tar_header(source, entry))
+			entry["tar"] = tar_rel
+			entry["offset"] = tar.tell()
+
+			digest = hashlib.sha256()
+			remaining = stat.st_size
+			with handle:
+				while remaining and (chunk := handle.read(min(HASH_CHUNK_SIZE, remaining))):
+					tar.write(chunk)
+					digest.update(chunk)
+					remaining -= len(chunk)
+			if remaining:
+				# The file shrank after it was scanned; pad so the header size stays true.
+				filler = tarfile.NUL * remaining
+				tar.write(filler)
+				digest.update(filler)
+			tar.write(_tar_padding(stat.st_size))
+
+			entry["sha256"] = digest.hexdigest()
+			entries.append(entry)
+			stats["new_files"] += 1
+			stats["new_bytes"] += stat.st_size
+		tar.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+
+	entries.sort(key=lambda entry: entry["path"])
+	header = {
+		"kind": "incremental",
+		"prefix": source,
+		"chain_length": chain_length,
+		"deleted": sorted(set(known) - seen),
+		"tar_checksum": tar.checksum(),
+		**stats,
+	}
+	manifest = write_manifest(manifest_path, header, entries)
+	return {**header, "manifest": manifest}
+
+
+class _EntryReader:
+	"""Opens the blob or tar holding each manifest entry, keeping tar handles open."""
+
+	def __init__(self, archive_root: Path) -> None:
+		self.archive_root = archive_root
+		self._tars: Dict[str, Any] = {}
+
+	def open(self, entry: Dict[str, Any]):
+		if "tar" not in entry:
+			return open(blob_path(self.archive_root, entry["sha256"]), "rb")
+		handle = self._tars.get(entry["tar"])
+		if handle is None:
+			handle = self._tars[entry["tar"]] = open(self.archive_root / entry["tar"], "rb")
+		handle.seek(entry["offset"])
+		return _Borrowed(handle)
+
+	def close(self) -> None:
+		for handle in self._tars.values():
+			handle.close()
+		self._tars.clear()
+
+
+class _Borrowed:
+	"""Context wrapper that leaves a shared tar handle open."""
+
+	def __init__(self, handle) -> None:
+		self.handle = handle
+
+	def __enter__(self):
+		return self.handle
+
+	def __exit__(self, *exc_info) -> None:
+		return None
+
+
+def iter_tar(manifest_path: Path, archive_root: Path, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+	"""Yield the tar a manifest describes, chunk by chunk, without staging it on disk."""
+	header, entries = read_manifest(manifest_path)
+	reader = _EntryReader(archive_root)
+	try:
+		for entry in entries:
+			yield _tar_header(header["prefix"], entry)
+			remaining = entry["size"]
+			with reader.open(entry) as source:
+				while remaining and (chunk := source.read(min(chunk_size, remaining))):
+					remaining -= len(chunk)
+					yield chunk
+			if remaining:
+				raise ValueError(f"Stored content for {entry['path']} is shorter than recorded.")
+			padding = _tar_padding(entry["size"])
+			if padding:
+				yield padding
+		yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+	finally:
+		reader.close()
+
+
+def write_tar(manifest_path: Path, archive_root: Path, output: Path) -> None:
+	with open(output, "wb") as handle:
+		for chunk in iter_tar(manifest_path, archive_root):
+			handle.write(chunk)
+
+
+def missing_content(manifest_path: Path, archive_root: Path) -> list[str]:
+	"""Blobs or tars a manifest needs that are no longer on disk."""
+	missing = set()
+	for entry in read_manifest(manifest_path)[1]:
+		if "tar" in entry:
+			if not (archive_root / entry["tar"]).exists():
+				missing.add(entry["tar"])
+		elif not blob_path(archive_root, entry["sha256"]).exists():
+			missing.add(entry["sha256"])
+	return sorted(missing)
+
+
+def content_paths(manifest_path: Path) -> set[str]:
+	"""Blobs and tars (relative to the archive root) holding the content of a manifest."""
+	paths = set()
+	for entry in read_manifest(manifest_path)[1]:
+		paths.add(entry["tar"] if "tar" in entry else blob_path(Path(), entry["sha256"]).as_posix())
+	return paths
+
+
+def referenced_blobs(manifest_paths: list[Path]) -> set[str]:
+	"""Store blobs the given manifests point at; incremental entries live in tars instead."""
+	digests: set[str] = set()
+	for manifest_path in manifest_paths:
+		if manifest_path.exists():
+			digests.update(entry["sha256"] for entry in read_manifest(manifest_path)[1])
+	return digests
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.filestore")
+	commands = parser.add_subparsers(dest="command", required=True)
+	build = commands.add_parser("build-tar", help="rebuild a file backup tar from its manifest")
+	build.add_argument("manifest", type=Path)
+	build.add_argument("archive_root", type=Path)
+	build.add_argument("output", type=Path)
+	args = parser.parse_args(argv)
+
+	if args.command == "build-tar":
+		write_tar(args.manifest, args.archive_root, args.output)
+
+
+if __name__ == "__main__":
+	main()
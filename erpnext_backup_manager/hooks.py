@@ -85,6 +85,12 @@ required_apps = []
 # before_install = "erpnext_backup_manager.install.before_install"
 # after_install = "erpnext_backup_manager.install.after_install"
 
+# Migration
+# ---------
+
+# Records the app code the database was migrated to, so restores can tell when migrate is not needed.
+after_migrate = ["erpnext_backup_manager.api.record_migration"]
+
 # Uninstallation
 # ------------
 
@@ -148,6 +154,25 @@ required_apps = []
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"erpnext_backup_manager.tasks.run_backup_schedules",
+			"erpnext_backup_manager.tasks.run_bench_backup_schedule",
+			"erpnext_backup_manager.tasks.sweep_interrupted_backups",
+		],
+	},
+	"hourly_long": [
+		"erpnext_backup_manager.tasks.replicate_archives",
+		"erpnext_backup_manager.tasks.prune_deferred_archives",
+	],
+	"daily_long": [
+		"erpnext_backup_manager.tasks.prune_archives",
+		"erpnext_backup_manager.tasks.verify_archives",
+		"erpnext_backup_manager.tasks.clean_stale_uploads",
+	],
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"erpnext_backup_manager.tasks.all"
@@ -0,0 +1,230 @@
+"""Checksums for backup artifacts.
+
+Hashes are taken while an artifact is written: Python writers go through
+`HashingWriter`, and files written by another process (the database dump) are
+followed by `FileFollower` as they grow. Gzip members are also decompressed on the
+fly so a dump cut short by a failed `mysqldump | gzip` is caught at backup time.
+
+Kept free of Frappe imports for the same reasons as `filestore`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+
+HASH_ALGORITHM = "sha256"
+CHUNK_SIZE = 1024 * 1024
+FOLLOW_INTERVAL = 0.05
+
+
+def checksum(digest: Any, size: int) -> Dict[str, Any]:
+	return {HASH_ALGORITHM: digest.hexdigest(), "size": size}
+
+
+class HashingWriter(io.RawIOBase):
+	"""Write-through wrapper that hashes and counts every byte.
+
+	It is deliberately not seekable: zipfile then writes data descriptors instead of
+	seeking back to patch local headers, which would invalidate the running hash.
+	"""
+
+	def __init__(self, raw: BinaryIO) -> None:
+		super().__init__()
+		self.raw = raw
+		self.digest = hashlib.new(HASH_ALGORITHM)
+		self.size = 0
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		self.raw.write(data)
+		self.digest.update(data)
+		self.size += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self.size
+
+	def checksum(self) -> Dict[str, Any]:
+		return checksum(self.digest, self.size)
+
+
+class GzipCheck:
+	"""Incrementally decompresses gzip data to confirm the stream is complete."""
+
+	def __init__(self) -> None:
+		self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		self.error: Optional[str] = None
+		# Decompressed bytes seen so far: the size of the SQL behind a dump.
+		self.size = 0
+
+	def update(self, data: bytes) -> None:
+		if self.error:
+			return
+		try:
+			while data:
+				self.size += len(self._decoder.decompress(data))
+				data = b""
+				if self._decoder.eof and self._decoder.unused_data:
+					# Concatenated gzip members are valid; start a decoder for the next one.
+					data = self._decoder.unused_data
+					self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		except zlib.error as exc:
+			self.error = f"invalid gzip data: {exc}"
+
+	def finish(self) -> Optional[str]:
+		if not self.error and not self._decoder.eof:
+			self.error = "gzip stream is truncated"
+		return self.error
+
+	def annotate(self, result: Dict[str, Any]) -> Dict[str, Any]:
+		"""Add the outcome of the check to a checksum: the error, or the uncompressed size."""
+		if self.finish():
+			result["error"] = self.error
+		else:
+			result["uncompressed_size"] = self.size
+		return result
+
+
+class Throttle:
+	"""Sleeps just enough to keep reads at or below `rate` bytes per second."""
+
+	def __init__(self, rate: Optional[int]) -> None:
+		self.rate = rate
+		self.started = time.monotonic()
+		self.consumed = 0
+
+	def consume(self, size: int) -> None:
+		if not self.rate:
+			return
+		self.consumed += size
+		ahead = self.consumed / self.rate - (time.monotonic() - self.started)
+		if ahead > 0:
+			time.sleep(ahead)
+
+
+def _reader_checks(path: Path) -> Optional[GzipCheck]:
+	return GzipCheck() if path.name.endswith(".gz") else None
+
+
+def hash_file(path: Path, rate: Optional[int] = None) -> str:
+	return file_checksum(path, rate)[HASH_ALGORITHM]
+
+
+def file_checksum(path: Path, rate: Optional[int] = None, *, check_gzip: bool = False) -> Dict[str, Any]:
+	"""Hash `path`, optionally rate-limited; `error` is set when a gzip stream is damaged."""
+	digest = hashlib.new(HASH_ALGORITHM)
+	gzip_check = _reader_checks(path) if check_gzip else None
+	throttle = Throttle(rate)
+	size = 0
+	with open(path, "rb") as handle:
+		while chunk := handle.read(CHUNK_SIZE):
+			digest.update(chunk)
+			if gzip_check:
+				gzip_check.update(chunk)
+			size += len(chunk)
+			throttle.consume(len(chunk))
+	result = checksum(digest, size)
+	return gzip_check.annotate(result) if gzip_check else result
+
+
+def copy_with_checksum(source: Path, target: Path) -> Dict[str, Any]:
+	"""Copy `source` to `target` in one pass, returning the checksum of the copy."""
+	gzip_check = _reader_checks(source)
+	with open(source, "rb") as reader, open(target, "wb") as raw:
+		writer = HashingWriter(raw)
+		while chunk := reader.read(CHUNK_SIZE):
+			writer.write(chunk)
+			if gzip_check:
+				gzip_check.update(chunk)
+	result = writer.checksum()
+	return gzip_check.annotate(result) if gzip_check else result
+
+
+class FileFollower(threading.Thread):
+	"""Hashes the file another process is writing into `directory`, as it is written.
+
+	The file is found by its name suffix once it appears. Call `finish()` after the
+	writer has exited; the follower drains what is left and returns the checksum. Data
+	is read back while it is still in the page cache, so no second disk pass is needed.
+	"""
+
+	def __init__(self, directory: Path, suffix: str) -> None:
+		super().__init__(daemon=True)
+		self.directory = directory
+		self.suffix = suffix
+		self.path: Optional[Path] = None
+		self.result: Optional[Dict[str, Any]] = None
+		self._done = threading.Event()
+		self._failure: Optional[BaseException] = None
+
+	def _find(self) -> Optional[Path]:
+		for path in self.directory.iterdir():
+			if path.name.endswith(self.suffix):
+				return path
+		return None
+
+	def run(self) -> None:
+		try:
+			self._follow()
+		except BaseException as exc:
+			self._failure = exc
+
+	def _follow(self) -> None:
+		while self.path is None:
+			finished = self._done.is_set()
+			self.path = self._find()
+			if self.path is None:
+				if finished:
+					return
+				time.sleep(FOLLOW_INTERVAL)
+
+		digest = hashlib.new(HASH_ALGORITHM)
+		gzip_check = _reader_checks(self.path)
+		size = 0
+		with open(self.path, "rb") as handle:
+			while True:
+				# Check before reading so the final read happens after the writer exited.
+				finished = self._done.is_set()
+				chunk = handle.read(CHUNK_SIZE)
+				if chunk:
+					digest.update(chunk)
+					if gzip_check:
+						gzip_check.update(chunk)
+					size += len(chunk)
+				elif finished:
+					break
+				else:
+					time.sleep(FOLLOW_INTERVAL)
+		self.result = checksum(digest, size)
+		if gzip_check:
+			gzip_check.annotate(self.result)
+
+	def finish(self) -> Optional[Dict[str, Any]]:
+		self._done.set()
+		self.join()
+		if self._failure:
+			raise self._failure
+		return self.result
+
+
+def verify_checksum(path: Path, expected: Dict[str, Any], rate: Optional[int] = None) -> Optional[str]:
+	"""Re-hash `path` and compare it with `expected`; returns a problem description or None."""
+	if not path.exists():
+		return f"{path.name}: file is missing"
+	size = path.stat().st_size
+	if expected.get("size") is not None and size != expected["size"]:
+		return f"{path.name}: size is {size} bytes, expected {expected['size']}"
+	actual = file_checksum(path, rate, check_gzip=True)
+	if actual.get("error"):
+		return f"{path.name}: {actual['error']}"
+	if expected.get(HASH_ALGORITHM) and actual[HASH_ALGORITHM] != expected[HASH_ALGORITHM]:
+		return f"{path.name}: {HASH_ALGORITHM} mismatch"
+	return None
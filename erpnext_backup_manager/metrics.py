@@ -0,0 +1,130 @@
+"""Timing and throughput of backup and restore phases, and their Prometheus export.
+
+A phase is one step of a backup (database dump, public/private file backups, bundle,
+catalog) or of a restore (checksum verification, upload copy, the restore script's
+own phases such as the data import and ``bench migrate``). `PhaseTimer` measures
+the wall time of each step; the caller fills in the bytes the step read and wrote,
+from which `phase_stats` derives MB/s and the compression ratio.
+
+Steps that run side by side (the database dump next to the file tars) are timed
+independently, so their durations add up to more than the backup took.
+
+`render` writes metric families in the Prometheus text exposition format.
+
+Kept free of Frappe imports.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import math
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Optional
+
+MB = 1024 * 1024
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def phase_stats(
+	phase: str,
+	seconds: float,
+	*,
+	bytes_in: Optional[int] = None,
+	bytes_out: Optional[int] = None,
+	started_at: Optional[float] = None,
+) -> Dict[str, Any]:
+	"""One phase record; throughput is measured on the input, or the output when the input is unknown."""
+	moved = bytes_in or bytes_out
+	return {
+		"phase": phase,
+		"started_at": started_at,
+		"seconds": round(seconds, 3),
+		"bytes_in": bytes_in,
+		"bytes_out": bytes_out,
+		"mb_per_sec": round(moved / MB / seconds, 2) if moved and seconds > 0 else None,
+		"compression_ratio": round(bytes_in / bytes_out, 3) if bytes_in and bytes_out else None,
+	}
+
+
+class PhaseTimer:
+	"""Collects phase records; `measure` may be used from several threads at once."""
+
+	def __init__(self) -> None:
+		self.phases: list[Dict[str, Any]] = []
+		self._lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def measure(self, phase: str) -> Iterator[Dict[str, Optional[int]]]:
+		"""Time the block; set ``bytes_in``/``bytes_out`` on the yielded dict. Failed steps are not kept."""
+		sizes: Dict[str, Optional[int]] = {"bytes_in": None, "bytes_out": None}
+		started_at = time.time()
+		started = time.monotonic()
+		yield sizes
+		self.add(phase, time.monotonic() - started, started_at=started_at, **sizes)
+
+	def add(self, phase: str, seconds: float, **values: Any) -> Dict[str, Any]:
+		stats = phase_stats(phase, seconds, **values)
+		with self._lock:
+			self.phases.append(stats)
+		return stats
+
+
+def timeline_phases(
+	marks: Iterable[Dict[str, Any]],
+	finished_at: float,
+	bytes_in: Optional[Dict[str, int]] = None,
+) -> list[Dict[str, Any]]:
+	"""Phase records from ``{"phase", "started_at"}`` marks; each phase ends where the next starts.
+
+	`bytes_in` gives the bytes read by some of the phases, by name.
+	"""
+	bytes_in = bytes_in or {}
+	marks = sorted(marks, key=lambda mark: mark["started_at"])
+	ends = [mark["started_at"] for mark in marks[1:]] + [finished_at] if marks else []
+	return [
+		phase_stats(
+			mark["phase"],
+			max(end - mark["started_at"], 0.0),
+			bytes_in=bytes_in.get(mark["phase"]),
+			started_at=mark["started_at"],
+		)
+		for mark, end in zip(marks, ends, strict=True)
+	]
+
+
+class Family(NamedTuple):
+	"""A metric family: samples are ``(labels, value)`` pairs."""
+
+	name: str
+	kind: str
+	help: str
+	samples: list[tuple[Dict[str, str], float]]
+
+
+def _escape(value: str, quote: bool = True) -> str:
+	value = value.replace("\\", "\\\\").replace("\n", "\\n")
+	return value.replace('"', '\\"') if quote else value
+
+
+def _format_value(value: float) -> str:
+	if math.isnan(value):
+		return "NaN"
+	if math.isinf(value):
+		return "+Inf" if value > 0 else "-Inf"
+	return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(families: Iterable[Family]) -> str:
+	"""Prometheus text format; families without samples are left out."""
+	lines = []
+	for family in families:
+		if not family.samples:
+			continue
+		lines.append(f"# HELP {family.name} {_escape(family.help, quote=False)}")
+		lines.append(f"# TYPE {family.name} {family.kind}")
+		for labels, value in family.samples:
+			label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+			name = f"{family.name}{{{label_text}}}" if label_text else family.name
+			lines.append(f"{name} {_format_value(value)}")
+	return "\n".join(lines) + "\n"
@@ -0,0 +1,203 @@
+"""Bench-wide backups: every site backed up through a bounded pool of processes.
+
+Each site runs in its own process (``bench --site <site> execute``), so one site's
+failure or memory use never affects another, and each still gets its own
+``Backup Archive`` record. The pool starts sites by priority, longest previous run
+first, so the slow sites do not end up alone at the tail of the window. Sites are
+classed as database-heavy or file-heavy from their previous sizes; neither class
+may take more than half of the pool while the other has sites waiting, which keeps
+dumps (CPU and database I/O) and tars (disk reads) interleaved.
+
+Every run writes a directory with one log and one result file per site and a
+``report.json`` that the next run reads back for its ordering.
+
+Kept free of Frappe imports.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import math
+import os
+import shutil
+import signal
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from erpnext_backup_manager import schedule
+
+REPORT_FILE = "report.json"
+POLL_INTERVAL = 1.0
+KINDS = ("db", "files")
+
+
+def site_kind(previous: Optional[Dict[str, Any]]) -> str:
+	"""Whichever of "db" and "files" made up more of the site's previous backup."""
+	if not previous:
+		return "db"
+	return "files" if (previous.get("files_size") or 0) > (previous.get("db_size") or 0) else "db"
+
+
+def plan(
+	sites: list[str], priorities: Dict[str, int], previous: Dict[str, Dict[str, Any]]
+) -> list[Dict[str, Any]]:
+	"""Jobs in start order: higher priority first, then the longest previous run."""
+	jobs = [
+		{
+			"site": site,
+			"priority": int(priorities.get(site) or 0),
+			"kind": site_kind(previous.get(site)),
+			"expected_seconds": (previous.get(site) or {}).get("seconds") or 0,
+		}
+		for site in sites
+	]
+	jobs.sort(key=lambda job: (-job["priority"], -job["expected_seconds"], job["site"]))
+	return jobs
+
+
+def next_job(pending: list[Dict[str, Any]], running: Counter, workers: int) -> int:
+	"""Index of the pending job to start next.
+
+	The first job whose kind holds less than half of the pool; when every waiting job is
+	of a kind already at its share, the first one anyway rather than leave a slot idle.
+	"""
+	share = max(math.ceil(workers / len(KINDS)), 1)
+	for index, job in enumerate(pending):
+		if running[job["kind"]] < share:
+			return index
+	return 0
+
+
+def _stop(process: subprocess.Popen) -> None:
+	# Started in its own session, so the dump and tar children go too.
+	try:
+		os.killpg(process.pid, signal.SIGTERM)
+		process.wait(timeout=30)
+	except subprocess.TimeoutExpired:
+		os.killpg(process.pid, signal.SIGKILL)
+		process.wait()
+	except ProcessLookupError:
+		process.wait()
+
+
+def run_pool(
+	jobs: list[Dict[str, Any]],
+	workers: int,
+	launch: Callable[[Dict[str, Any]], subprocess.Popen],
+	collect: Callable[[Dict[str, Any], Optional[int], float], Dict[str, Any]],
+	timeout: Optional[int] = None,
+) -> list[Dict[str, Any]]:
+	"""Run `jobs` at most `workers` at a time; returns what `collect` makes of each, in finish order.
+
+	`collect` gets the job, the exit code (None when the job was stopped after
+	`timeout` seconds) and its duration.
+	"""
+	workers = max(workers, 1)
+	pending = list(jobs)
+	running: Dict[subprocess.Popen, tuple[Dict[str, Any], float]] = {}
+	results = []
+	while pending or running:
+		while pending and len(running) < workers:
+			kinds = Counter(job["kind"] for job, _started in running.values())
+			job = pending.pop(next_job(pending, kinds, workers))
+			running[launch(job)] = (job, time.monotonic())
+		time.sleep(POLL_INTERVAL)
+		for process, (job, started) in list(running.items()):
+			seconds = time.monotonic() - started
+			returncode = process.poll()
+			if returncode is None:
+				if not timeout or seconds < timeout:
+					continue
+				_stop(process)
+			del running[process]
+			results.append(collect(job, returncode, seconds))
+	return results
+
+
+def latest_report(report_root: Path) -> Dict[str, Dict[str, Any]]:
+	"""Per-site results of the newest finished run under `report_root`."""
+	reports = sorted(report_root.glob(f"*/{REPORT_FILE}")) if report_root.is_dir() else []
+	if not reports:
+		return {}
+	return {row["site"]: row for row in json.loads(reports[-1].read_text(encoding="utf-8"))["sites"]}
+
+
+def prune_reports(report_root: Path, keep: int) -> None:
+	"""Delete all but the newest `keep` run directories."""
+	runs = sorted(path for path in report_root.iterdir() if path.is_dir())
+	for path in runs[: max(len(runs) - keep, 0)]:
+		shutil.rmtree(path, ignore_errors=True)
+
+
+def write_report(run_dir: Path, results: list[Dict[str, Any]], started_at: float, seconds: float) -> Path:
+	path = run_dir / REPORT_FILE
+	report = {"started_at": started_at, "seconds": round(seconds, 1), "sites": results}
+	path.write_text(json.dumps(report, indent=1), encoding="utf-8")
+	return path
+
+
+def _size(value: Optional[int]) -> str:
+	if not value:
+		return "-"
+	for unit in ("B", "KB", "MB", "GB"):
+		if value < 1024:
+			return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+		value /= 1024
+	return f"{value:.1f} TB"
+
+
+def format_report(results: list[Dict[str, Any]], seconds: float) -> str:
+	"""Plain-text table of per-site status, duration and sizes, with totals."""
+	header = ("Site", "Status", "Archive", "Time", "Database", "Files", "Bundle")
+	rows = [
+		(
+			row["site"],
+			row["status"],
+			row.get("archive") or "-",
+			f"{row['seconds']:.0f}s",
+			_size(row.get("db_size")),
+			_size(row.get("files_size")),
+			_size(row.get("bundle_size")),
+		)
+		for row in sorted(results, key=lambda row: row["site"])
+	]
+	widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows, strict=True)]
+	lines = [
+		"  ".join(str(cell).ljust(width) for cell, width in zip(line, widths, strict=True)).rstrip()
+		for line in (header, *rows)
+	]
+	statuses = Counter(row["status"] for row in results)
+	total = sum((row.get("db_size") or 0) + (row.get("files_size") or 0) for row in results)
+	lines.append("")
+	lines.append(
+		f"{len(results)} sites in {seconds:.0f}s ("
+		+ ", ".join(f"{count} {status}" for status, count in sorted(statuses.items()))
+		+ f"), {_size(total)} backed up"
+	)
+	lines.extend(f"{row['site']}: {row['error']}" for row in results if row.get("error"))
+	return "\n".join(lines)
+
+
+def claim_due_run(state_path: Path, expression: str, now: datetime) -> bool:
+	"""Record a run of the bench schedule when one is due; True for one caller per due time.
+
+	Every site's scheduler calls this, so the state file is locked while it is read and
+	updated. The first call only records `now`, like a site schedule.
+	"""
+	with open(state_path, "a+", encoding="utf-8") as handle:
+		fcntl.flock(handle, fcntl.LOCK_EX)
+		handle.seek(0)
+		text = handle.read()
+		state = json.loads(text) if text.strip() else {}
+		last_run = state.get("last_run")
+		if last_run and schedule.next_run(expression, datetime.fromisoformat(last_run)) > now:
+			return False
+		handle.seek(0)
+		handle.truncate()
+		handle.write(json.dumps({**state, "last_run": now.isoformat()}))
+		return bool(last_run)
@@ -0,0 +1,425 @@
+"""Offsite replication of archives to pluggable storage targets.
+
+A target is configured as a dict (see `make_target`) and implemented by a
+`Target` subclass:
+
+- ``local``: a directory, typically an NFS or other network mount;
+- ``sftp``: an SFTP server (needs ``paramiko``);
+- ``s3``: any S3-compatible API (AWS, MinIO, ...; needs ``boto3``).
+
+`replicate` pushes a list of files to a target with a pool of upload threads.
+Every transfer is resumable: local and SFTP targets append to a ``.part`` file that
+is renamed when complete, and S3 uploads large files as multipart uploads whose
+finished parts are recorded in a state file, so an interrupted run continues where
+it stopped. A token bucket shared by all threads caps the bandwidth of a target.
+
+Kept free of Frappe imports; the jobs in ``api`` decide what to replicate and record
+the outcome on the Backup Archive.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, Optional
+
+TARGET_TYPES = ("local", "sftp", "s3")
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 4
+DEFAULT_PART_SIZE_MB = 64
+# S3 allows at most 10,000 parts per upload and at least 5 MB per part.
+MAX_PARTS = 10_000
+MIN_PART_SIZE = 5 * 1024 * 1024
+PROGRESS_INTERVAL = 2.0
+
+
+class Throttle:
+	"""Token bucket shared by every upload thread of a target."""
+
+	def __init__(self, rate: Optional[float]) -> None:
+		self.rate = rate
+		self._lock = threading.Lock()
+		self._allowance = rate or 0.0
+		self._checked = time.monotonic()
+
+	def consume(self, amount: int) -> None:
+		if not self.rate:
+			return
+		with self._lock:
+			now = time.monotonic()
+			self._allowance = min(self.rate, self._allowance + (now - self._checked) * self.rate)
+			self._checked = now
+			self._allowance -= amount
+			delay = -self._allowance / self.rate if self._allowance < 0 else 0.0
+		if delay:
+			time.sleep(delay)
+
+
+class ReplicationState:
+	"""Resume data of one archive on one target, kept in a JSON file next to the archive."""
+
+	def __init__(self, path: Path) -> None:
+		self.path = path
+		self._lock = threading.Lock()
+		try:
+			self.data = json.loads(path.read_text(encoding="utf-8"))
+		except (FileNotFoundError, ValueError):
+			self.data = {}
+		self.data.setdefault("done", {})
+		self.data.setdefault("multipart", {})
+
+	def is_done(self, key: str, size: int) -> bool:
+		return self.data["done"].get(key) == size
+
+	def update(self, apply: Callable[[Dict[str, Any]], None]) -> None:
+		with self._lock:
+			apply(self.data)
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			tmp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}")
+			tmp_path.write_text(json.dumps(self.data), encoding="utf-8")
+			os.replace(tmp_path, self.path)
+
+
+class Target:
+	"""Base class: a place archives are copied to, addressed by ``/``-separated keys."""
+
+	def __init__(self, config: Dict[str, Any]) -> None:
+		self.name = config["name"]
+		self.prefix = str(config.get("prefix") or "").strip("/")
+		self.workers = max(1, int(config.get("workers") or DEFAULT_WORKERS))
+		rate = float(config.get("bandwidth_mb") or 0) * 1024 * 1024
+		self.throttle = Throttle(rate or None)
+
+	def remote_key(self, key: str) -> str:
+		return f"{self.prefix}/{key}" if self.prefix else key
+
+	def exists(self, key: str, size: int) -> bool:
+		"""Whether `key` is already complete on the target."""
+		raise NotImplementedError
+
+	def upload(self, path: Path, key: str, state: ReplicationState, on_bytes: Callable[[int], None]) -> None:
+		raise NotImplementedError
+
+	def close(self) -> None:
+		pass
+
+	def _send(self, reader, writer, length: int, on_bytes: Callable[[int], None]) -> None:
+		while length > 0:
+			data = reader.read(min(CHUNK_SIZE, length))
+			if not data:
+				raise OSError("Local file shrank while it was replicated.")
+			self.throttle.consume(len(data))
+			writer.write(data)
+			length -= len(data)
+			on_bytes(len(data))
+
+
+class LocalTarget(Target):
+	def __init__(self, config: Dict[str, Any]) -> None:
+		super().__init__(config)
+		self.root = Path(config["path"])
+		if not self.root.is_dir():
+			raise ValueError(f"Replication target {self.name}: {self.root} is not a directory (not mounted?)")
+
+	def _path(self, key: str) -> Path:
+		return self.root.joinpath(*PurePosixPath(self.remote_key(key)).parts)
+
+	def exists(self, key: str, size: int) -> bool:
+		try:
+			return self._path(key).stat().st_size == size
+		except FileNotFoundError:
+			return False
+
+	def upload(self, path: Path, key: str, state: ReplicationState, on_bytes: Callable[[int], None]) -> None:
+		target = self._path(key)
+		target.parent.mkdir(parents=True, exist_ok=True)
+		partial = target.with_name(target.name + PART_SUFFIX)
+		size = path.stat().st_size
+		offset = partial.stat().st_size if partial.exists() else 0
+		if offset > size:
+			partial.unlink()
+			offset = 0
+		on_bytes(offset)
+		with open(path, "rb") as reader, open(partial, "ab") as writer:
+			reader.seek(offset)
+			self._send(reader, writer, size - offset, on_bytes)
+			writer.flush()
+			os.fsync(writer.fileno())
+		os.replace(partial, target)
+
+
+class SFTPTarget(Target):
+	def __init__(self, config: Dict[str, Any]) -> None:
+		super().__init__(config)
+		try:
+			import paramiko
+		except ImportError:
+			raise ValueError("SFTP replication needs paramiko: bench pip install paramiko")
+
+		self.root = str(config.get("path") or ".").rstrip("/") or "/"
+		# Unknown host keys are refused; add the server to known_hosts first.
+		self._ssh = paramiko.SSHClient()
+		self._ssh.load_system_host_keys()
+		if config.get("known_hosts"):
+			self._ssh.load_host_keys(config["known_hosts"])
+		self._ssh.connect(
+			config["host"],
+			port=int(config.get("port") or 22),
+			username=config["username"],
+			password=config.get("password"),
+			key_filename=config.get("key_file"),
+			passphrase=config.get("key_password"),
+			timeout=30,
+		)
+		self._transport = self._ssh.get_transport()
+		self._clients = threading.local()
+		self._all_clients = []
+		self._clients_lock = threading.Lock()
+
+	def _client(self):
+		# One SFTP channel per upload thread over the shared connection.
+		client = getattr(self._clients, "client", None)
+		if client is None:
+			import paramiko
+
+			client = paramiko.SFTPClient.from_transport(self._transport)
+			self._clients.client = client
+			with self._clients_lock:
+				self._all_clients.append(client)
+		return client
+
+	def _path(self, key: str) -> str:
+		return f"{self.root}/{self.remote_key(key)}"
+
+	def _size(self, path: str) -> Optional[int]:
+		try:
+			return self._client().stat(path).st_size
+		except FileNotFoundError:
+			return None
+
+	def _makedirs(self, directory: str) -> None:
+		client = self._client()
+		missing = []
+		while directory and directory not in ("/", ".") and self._size(directory) is None:
+			missing.append(directory)
+			directory = directory.rsplit("/", 1)[0] if "/" in directory else ""
+		for path in reversed(missing):
+			try:
+				client.mkdir(path)
+			except OSError:
+				# Another thread may have created it meanwhile.
+				if self._size(path) is None:
+					raise
+
+	def exists(self, key: str, size: int) -> bool:
+		return self._size(self._path(key)) == size
+
+	def upload(self, path: Path, key: str, state: ReplicationState, on_bytes: Callable[[int], None]) -> None:
+		client = self._client()
+		target = self._path(key)
+		self._makedirs(target.rsplit("/", 1)[0])
+		partial = target + PART_SUFFIX
+		size = path.stat().st_size
+		offset = self._size(partial) or 0
+		if offset > size:
+			client.remove(partial)
+			offset = 0
+		on_bytes(offset)
+		with open(path, "rb") as reader, client.open(partial, "ab") as writer:
+			writer.set_pipelined(True)
+			reader.seek(offset)
+			self._send(reader, writer, size - offset, on_bytes)
+		client.posix_rename(partial, target)
+
+	def close(self) -> None:
+		for client in self._all_clients:
+			client.close()
+		self._ssh.close()
+
+
+class S3Target(Target):
+	def __init__(self, config: Dict[str, Any]) -> None:
+		super().__init__(config)
+		try:
+			import boto3
+			from botocore.config import Config
+		except ImportError:
+			raise ValueError("S3 replication needs boto3: bench pip install boto3")
+
+		self.bucket = config["bucket"]
+		part_size_mb = int(config.get("part_size_mb") or DEFAULT_PART_SIZE_MB)
+		self.part_size = max(MIN_PART_SIZE, part_size_mb * 1024 * 1024)
+		# Every request holds its part in memory; this bounds them across all files.
+		self._slots = threading.BoundedSemaphore(self.workers)
+		self.client = boto3.client(
+			"s3",
+			endpoint_url=config.get("endpoint_url"),
+			region_name=config.get("region"),
+			aws_access_key_id=config.get("access_key"),
+			aws_secret_access_key=config.get("secret_key"),
+			config=Config(
+				# MinIO-style servers usually have no per-bucket DNS names.
+				s3={"addressing_style": config.get("addressing_style") or "path"},
+				max_pool_connections=self.workers * 2,
+				retries={"max_attempts": 5, "mode": "standard"},
+			),
+		)
+
+	def exists(self, key: str, size: int) -> bool:
+		from botocore.exceptions import ClientError
+
+		try:
+			head = self.client.head_object(Bucket=self.bucket, Key=self.remote_key(key))
+		except ClientError as exc:
+			if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+				return False
+			raise
+		return head["ContentLength"] == size
+
+	def upload(self, path: Path, key: str, state: ReplicationState, on_bytes: Callable[[int], None]) -> None:
+		size = path.stat().st_size
+		if size > self.part_size:
+			self._upload_multipart(path, key, size, state, on_bytes)
+			return
+		with self._slots:
+			data = path.read_bytes()
+			self.throttle.consume(size)
+			self.client.put_object(Bucket=self.bucket, Key=self.remote_key(key), Body=data)
+		on_bytes(size)
+
+	def _part_size(self, size: int) -> int:
+		return max(self.part_size, -(-size // MAX_PARTS))
+
+	def _existing_parts(self, remote_key: str, upload_id: str) -> Optional[Dict[int, str]]:
+		from botocore.exceptions import ClientError
+
+		parts: Dict[int, str] = {}
+		marker = 0
+		try:
+			while True:
+				response = self.client.list_parts(
+					Bucket=self.bucket, Key=remote_key, UploadId=upload_id, PartNumberMarker=marker
+				)
+				for part in response.get("Parts", []):
+					parts[part["PartNumber"]] = part["ETag"]
+				if not response.get("IsTruncated"):
+					return parts
+				marker = response["NextPartNumberMarker"]
+		except ClientError as exc:
+			if exc.response.get("Error", {}).get("Code") == "NoSuchUpload":
+				return None
+			raise
+
+	def _upload_multipart(
+		self, path: Path, key: str, size: int, state: ReplicationState, on_bytes: Callable[[int], None]
+	) -> None:
+		remote_key = self.remote_key(key)
+		part_size = self._part_size(size)
+		count = -(-size // part_size)
+		resume = state.data["multipart"].get(key) or {}
+		parts = None
+		if resume.get("upload_id") and resume.get("part_size") == part_size and resume.get("size") == size:
+			# The server's list of parts is authoritative; the state file may be behind.
+			parts = self._existing_parts(remote_key, resume["upload_id"])
+		if parts is None:
+			upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=remote_key)["UploadId"]
+			parts = {}
+			state.update(
+				lambda data: data["multipart"].__setitem__(
+					key, {"upload_id": upload_id, "part_size": part_size, "size": size}
+				)
+			)
+		else:
+			upload_id = resume["upload_id"]
+		on_bytes(sum(min(part_size, size - (number - 1) * part_size) for number in parts))
+
+		def send(number: int) -> None:
+			offset = (number - 1) * part_size
+			length = min(part_size, size - offset)
+			with self._slots:
+				with open(path, "rb") as handle:
+					handle.seek(offset)
+					data = handle.read(length)
+				self.throttle.consume(length)
+				response = self.client.upload_part(
+					Bucket=self.bucket, Key=remote_key, UploadId=upload_id, PartNumber=number, Body=data
+				)
+			parts[number] = response["ETag"]
+			on_bytes(length)
+
+		pending = [number for number in range(1, count + 1) if number not in parts]
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			for future in [pool.submit(send, number) for number in pending]:
+				future.result()
+		self.client.complete_multipart_upload(
+			Bucket=self.bucket,
+			Key=remote_key,
+			UploadId=upload_id,
+			MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]},
+		)
+		state.update(lambda data: data["multipart"].pop(key, None))
+
+
+BACKENDS = {"local": LocalTarget, "sftp": SFTPTarget, "s3": S3Target}
+
+
+def make_target(config: Dict[str, Any]) -> Target:
+	backend = BACKENDS.get(config.get("type"))
+	if not backend:
+		raise ValueError(f"Replication target type must be one of: {', '.join(TARGET_TYPES)}")
+	return backend(config)
+
+
+def replicate(
+	target: Target,
+	files: list[tuple[Path, str]],
+	state: ReplicationState,
+	on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, int]:
+	"""Copy `files` (local path, key) to `target`, skipping what is already there.
+
+	`on_progress(done_bytes, total_bytes)` is called from the calling thread every few
+	seconds and once at the end.
+	"""
+	sizes = {key: path.stat().st_size for path, key in files}
+	total = sum(sizes.values())
+	counted = {"done": 0, "uploaded": 0, "skipped": 0}
+	lock = threading.Lock()
+
+	def add(field: str, amount: int) -> None:
+		with lock:
+			counted[field] += amount
+
+	def push(path: Path, key: str) -> None:
+		size = sizes[key]
+		if state.is_done(key, size) or target.exists(key, size):
+			add("done", size)
+			add("skipped", 1)
+		else:
+			target.upload(path, key, state, lambda amount: add("done", amount))
+			add("uploaded", 1)
+		state.update(lambda data: data["done"].__setitem__(key, size))
+
+	with ThreadPoolExecutor(max_workers=target.workers) as pool:
+		pending = {pool.submit(push, path, key) for path, key in files}
+		while pending:
+			finished, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+			for future in finished:
+				if future.exception():
+					for other in pending:
+						other.cancel()
+					raise future.exception()
+			if on_progress:
+				on_progress(min(counted["done"], total), total)
+	return {
+		"files": len(files),
+		"bytes": total,
+		"uploaded": counted["uploaded"],
+		"skipped": counted["skipped"],
+	}
@@ -0,0 +1,248 @@
+"""Fast restore engine: streams the database dump straight into the database client.
+
+`bench restore` gunzips the dump into a temporary file on one core, imports it, and
+only then extracts the file archives. This engine instead:
+
+- decompresses with ``pigz``/``zstd`` when installed (in-process gzip otherwise)
+  and pipes the SQL into ``mariadb`` without an uncompressed copy on disk;
+- extracts the public and private file tars while the SQL import runs;
+- imports per-table dumps (see `dump`) several tables at a time.
+
+With ``--db-name`` and ``--files-dir`` it restores next to the live site instead,
+into a new database and a staging folder, for the shadow restore (see `shadow`).
+
+It only covers what `bench restore` does to the database and files; the restore
+script still runs ``remove_missing_apps``, the admin password reset and
+``bench migrate`` afterwards. MariaDB sites only.
+
+Kept free of Frappe imports; started as ``python -m erpnext_backup_manager.restore_engine``
+from the bench directory.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import IO, Any, Dict, Optional
+
+from erpnext_backup_manager.compression import CompressionError, decompressor, format_of, open_tar
+from erpnext_backup_manager.dump import is_dump_manifest, site_config, table_paths, write_client_defaults
+
+PIPE_CHUNK_SIZE = 1024 * 1024
+PROGRESS_EVERY = 1024 * 1024 * 1024
+# First line of dumps from recent MariaDB versions; older clients reject it.
+SANDBOX_LINE = b"/*M!999999\\- enable the sandbox mode */"
+FILE_ROOTS = ("public", "private")
+# Concurrent table imports for per-table dumps; beyond this the server's I/O saturates.
+MAX_TABLE_IMPORTS = 8
+
+
+def log(message: str) -> None:
+	print(f"[restore_engine] {message}", flush=True)
+
+
+def _client_binary() -> str:
+	for name in ("mariadb", "mysql"):
+		path = shutil.which(name)
+		if path:
+			return path
+	raise SystemExit("Neither mariadb nor mysql client was found in PATH.")
+
+
+def _strip_components(tar_path: Path) -> int:
+	"""Leading path components before ``public``/``private``, like ``./site/`` in Frappe's tars."""
+	with open_tar(tar_path) as archive:
+		member = archive.next()
+	if member is None:
+		return 0
+	parts = member.name.split("/")
+	for index, part in enumerate(parts):
+		if part in FILE_ROOTS:
+			return index
+	raise SystemExit(f"{tar_path.name} does not contain public/ or private/ files.")
+
+
+def extract_files(tar_path: Path, site_path: Path) -> subprocess.Popen:
+	cmd = ["tar", "-xf", str(tar_path), "--strip-components", str(_strip_components(tar_path))]
+	kind = format_of(tar_path)
+	if kind == "gzip" and shutil.which("pigz"):
+		cmd.extend(["--use-compress-program", "pigz"])
+	elif kind == "zstd":
+		cmd.extend(["--use-compress-program", "zstd"])
+	log(f"extracting {tar_path.name}")
+	return subprocess.Popen(cmd, cwd=site_path)
+
+
+def _pump(source: IO[bytes], target: IO[bytes], report: bool = True) -> int:
+	total, reported = 0, 0
+	first = source.read(PIPE_CHUNK_SIZE)
+	if first.startswith(SANDBOX_LINE):
+		first = first.split(b"\n", 1)[1] if b"\n" in first else b""
+	chunk = first
+	while chunk:
+		target.write(chunk)
+		total += len(chunk)
+		if report and total - reported >= PROGRESS_EVERY:
+			reported = total
+			log(f"imported {total // (1024 * 1024)} MB of SQL")
+		chunk = source.read(PIPE_CHUNK_SIZE)
+	return total
+
+
+def _import_stream(base: list[str], db_name: str, path: Path, threads: int, report: bool = True) -> int:
+	process, stream = decompressor(path, threads)
+	with stream:
+		importer = subprocess.Popen([*base, db_name], stdin=subprocess.PIPE)
+		try:
+			total = _pump(stream, importer.stdin, report)
+		except BrokenPipeError:
+			total = 0
+		finally:
+			importer.stdin.close()
+	if importer.wait() != 0:
+		raise SystemExit(f"Importing {path.name} failed with exit code {importer.returncode}.")
+	if process and process.wait() != 0:
+		raise SystemExit(f"Decompressing {path.name} failed with exit code {process.returncode}.")
+	return total
+
+
+def _sql_string(value: str) -> str:
+	return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def _grant_site_user(base: list[str], db_name: str, user: str) -> None:
+	"""Give the site's user the same access to `db_name` it has to its own database."""
+	result = subprocess.run(
+		[*base, "-N", "-e", f"SELECT Host FROM mysql.user WHERE User = {_sql_string(user)}"],
+		capture_output=True,
+		text=True,
+		check=True,
+	)
+	for host in result.stdout.split() or ["%"]:
+		subprocess.run(
+			[
+				*base,
+				"-e",
+				f"GRANT ALL PRIVILEGES ON `{db_name}`.* TO {_sql_string(user)}@{_sql_string(host)}",
+			],
+			check=True,
+		)
+
+
+def import_database(
+	db_path: Path,
+	config: Dict[str, Any],
+	user: str,
+	password: str,
+	threads: int,
+	db_name: Optional[str] = None,
+) -> None:
+	"""Import into the site's database, or into `db_name` (granted to the site's user)."""
+	db_name = db_name or config["db_name"]
+	client = _client_binary()
+	with tempfile.NamedTemporaryFile("w", suffix=".cnf") as defaults:
+		os.chmod(defaults.name, 0o600)
+		write_client_defaults(defaults, config, user, password)
+		base = [client, f"--defaults-extra-file={defaults.name}"]
+
+		# Same clean slate as `bench restore`: tables missing from the dump must not survive.
+		log(f"recreating database {db_name}")
+		subprocess.run(
+			[
+				*base,
+				"-e",
+				f"DROP DATABASE IF EXISTS `{db_name}`; "
+				f"CREATE DATABASE `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;",
+			],
+			check=True,
+		)
+		if db_name != config["db_name"]:
+			_grant_site_user(base, db_name, config.get("db_user") or config["db_name"])
+
+		started = time.monotonic()
+		if is_dump_manifest(db_path):
+			# Every table file is self-contained, so they load side by side.
+			paths = table_paths(db_path)
+			log(f"importing {len(paths)} tables from {db_path.name}")
+			total = 0
+			with ThreadPoolExecutor(max_workers=min(threads, MAX_TABLE_IMPORTS)) as pool:
+				futures = [pool.submit(_import_stream, base, db_name, path, 1, False) for path in paths]
+				for done, future in enumerate(as_completed(futures), 1):
+					total += future.result()
+					if done % 100 == 0:
+						log(f"imported {done} of {len(paths)} tables")
+		else:
+			log(f"importing {db_path.name}")
+			total = _import_stream(base, db_name, db_path, threads)
+		log(f"imported {total // (1024 * 1024)} MB of SQL in {int(time.monotonic() - started)}s")
+
+
+def restore(
+	site_path: Path,
+	db_path: Path,
+	file_tars: list[Path],
+	db_root_username: Optional[str] = None,
+	db_root_password: Optional[str] = None,
+	threads: Optional[int] = None,
+	db_name: Optional[str] = None,
+	files_dir: Optional[Path] = None,
+) -> None:
+	config = site_config(site_path)
+	if config.get("db_type", "mariadb") != "mariadb":
+		raise SystemExit("The fast restore engine supports MariaDB sites only.")
+	threads = threads or os.cpu_count() or 1
+	if db_root_password:
+		user, password = db_root_username or "root", db_root_password
+	elif db_name and db_name != config["db_name"]:
+		# Creating another database and granting it needs the server's admin account.
+		if not config.get("root_password"):
+			raise SystemExit("Restoring into a new database needs the database root password.")
+		user, password = config.get("root_login") or "root", config["root_password"]
+	else:
+		# The site user holds all privileges on its own database, which covers DROP/CREATE.
+		user, password = config.get("db_user") or config["db_name"], config["db_password"]
+
+	extractions = [(tar, extract_files(tar, files_dir or site_path)) for tar in file_tars]
+	try:
+		import_database(db_path, config, user, password, threads, db_name)
+	finally:
+		failed = [tar.name for tar, process in extractions if process.wait() != 0]
+	if failed:
+		raise SystemExit(f"Extracting {', '.join(failed)} failed.")
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.restore_engine")
+	parser.add_argument("--site-path", type=Path, required=True)
+	parser.add_argument("--db", type=Path, required=True)
+	parser.add_argument("--files", type=Path, action="append", default=[], help="public/private files tar")
+	parser.add_argument("--db-root-username")
+	parser.add_argument("--db-root-password")
+	parser.add_argument("--threads", type=int)
+	parser.add_argument("--db-name", help="restore into this new database instead of the site's")
+	parser.add_argument("--files-dir", type=Path, help="extract the files here instead of the site folder")
+	args = parser.parse_args(argv)
+
+	try:
+		restore(
+			args.site_path,
+			args.db,
+			args.files,
+			db_root_username=args.db_root_username,
+			db_root_password=args.db_root_password,
+			threads=args.threads,
+			db_name=args.db_name,
+			files_dir=args.files_dir,
+		)
+	except CompressionError as exc:
+		raise SystemExit(str(exc)) from None
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,154 @@
+"""Runs a restore script and records its progress.
+
+The restore replaces the site database, so progress cannot live in a DocType while
+it runs. The supervisor keeps it in a small JSON status file next to the restore
+log instead: it starts the script, follows the log by byte offset for the phase
+markers the script prints (noting when each phase began), and records the exit
+code. When the script has ended it runs the finish command (``bench execute
+...finish_restore``), which writes the outcome back to the Backup Archive in the
+restored database. An optional notify command is started, without waiting for it,
+each time a phase begins, so open pages can be told without polling.
+
+Kept free of Frappe imports; started as ``python -m erpnext_backup_manager.restore_supervisor``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+PHASE_MARKER = "[backup_manager] phase: "
+POLL_INTERVAL = 1.0
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def status_path(log_path: Path) -> Path:
+	return log_path.with_name(f"{log_path.stem}.status.json")
+
+
+def phase_command(phase: str) -> str:
+	"""Shell line a restore script prints when it enters `phase`."""
+	return f"echo '{PHASE_MARKER}{phase}'"
+
+
+def read_status(path: Path) -> Dict[str, Any]:
+	try:
+		return json.loads(path.read_text(encoding="utf-8"))
+	except (FileNotFoundError, ValueError):
+		return {}
+
+
+def write_status(path: Path, **values: Any) -> Dict[str, Any]:
+	status = {**read_status(path), **values, "updated_at": time.time()}
+	tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+	tmp_path.write_text(json.dumps(status), encoding="utf-8")
+	os.replace(tmp_path, path)
+	return status
+
+
+class LogTail:
+	"""Reads only the bytes appended to a log since the previous call."""
+
+	def __init__(self, path: Path, offset: int = 0) -> None:
+		self.path = path
+		self.offset = offset
+		self._partial = b""
+
+	def read(self, limit: Optional[int] = None) -> bytes:
+		try:
+			with open(self.path, "rb") as handle:
+				handle.seek(self.offset)
+				data = handle.read(limit) if limit else handle.read()
+		except FileNotFoundError:
+			return b""
+		self.offset += len(data)
+		return data
+
+	def phases(self) -> list[str]:
+		"""Phase markers in complete lines appended since the last call."""
+		data = self._partial + self.read()
+		lines = data.split(b"\n")
+		self._partial = lines.pop()
+		marker = PHASE_MARKER.encode()
+		return [line.split(marker, 1)[1].decode(errors="replace").strip() for line in lines if marker in line]
+
+
+def supervise(
+	script: Path,
+	log: Path,
+	status: Path,
+	cwd: str,
+	finish_cmd: Optional[list[str]] = None,
+	notify_cmd: Optional[list[str]] = None,
+) -> int:
+	started_at = time.time()
+	write_status(status, state="Running", phase="starting", started_at=started_at, pid=os.getpid())
+	tail = LogTail(log, offset=log.stat().st_size if log.exists() else 0)
+	with open(log, "ab") as output:
+		child = subprocess.Popen(["bash", str(script)], stdout=output, stderr=subprocess.STDOUT, cwd=cwd)
+
+	phase = "starting"
+	# When each phase began; finish_restore turns them into per-phase timings.
+	marks = []
+	while True:
+		finished = child.poll() is not None
+		entered = [name for name in tail.phases() if name != phase]
+		if entered:
+			now = time.time()
+			# Phases that began and ended within one poll are kept, with no duration.
+			marks.extend({"phase": name, "started_at": now} for name in entered)
+			phase = entered[-1]
+			write_status(status, phase=phase, phase_started_at=now, phases=marks)
+			if notify_cmd:
+				# Best effort: it reads the status file, and a slow or failed notice changes nothing.
+				subprocess.Popen(
+					notify_cmd,
+					stdin=subprocess.DEVNULL,
+					stdout=subprocess.DEVNULL,
+					stderr=subprocess.DEVNULL,
+					cwd=cwd,
+				)
+		if finished:
+			break
+		time.sleep(POLL_INTERVAL)
+
+	exit_code = child.returncode
+	write_status(
+		status,
+		state="Restored" if exit_code == 0 else "Failed",
+		phase=phase,
+		exit_code=exit_code,
+		finished_at=time.time(),
+		elapsed=int(time.time() - started_at),
+	)
+	if finish_cmd:
+		with open(log, "ab") as output:
+			result = subprocess.run(finish_cmd, stdout=output, stderr=subprocess.STDOUT, cwd=cwd)
+		write_status(status, finish_exit_code=result.returncode)
+	return exit_code
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.restore_supervisor")
+	parser.add_argument("--script", type=Path, required=True)
+	parser.add_argument("--log", type=Path, required=True)
+	parser.add_argument("--cwd", required=True)
+	parser.add_argument("--finish", help="JSON list: command to run once the script has ended")
+	parser.add_argument("--notify", help="JSON list: command to start whenever a phase begins")
+	args = parser.parse_args(argv)
+
+	finish_cmd = json.loads(args.finish) if args.finish else None
+	notify_cmd = json.loads(args.notify) if args.notify else None
+	raise SystemExit(
+		supervise(args.script, args.log, status_path(args.log), args.cwd, finish_cmd, notify_cmd)
+	)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,115 @@
+"""Retention policy: which archives to keep.
+
+Grandfather-father-son tiers in the style of ``restic forget``: ``keep_daily=7``
+keeps the newest archive of each of the 7 most recent days that have one, and the
+same for ISO weeks and months. ``keep_last`` keeps the newest N outright. An
+optional byte budget then drops the oldest kept archives until the rest fits.
+
+Kept free of Frappe imports so the policy can be exercised on plain data.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Archives are plain dicts with:
+#   name (str), created (datetime), bytes (int), valid (bool: a usable backup),
+#   previous (Optional[str]: archive an incremental backup builds on),
+#   in_use (bool, optional: being written or restored; kept with its chain).
+Archive = Dict[str, Any]
+
+# Reasons that keep an archive even when over the byte budget.
+UNDROPPABLE = {"newest", "in use", "chain"}
+
+TIERS: Dict[str, Callable[[datetime], Any]] = {
+	"daily": lambda created: created.date(),
+	"weekly": lambda created: created.isocalendar()[:2],
+	"monthly": lambda created: (created.year, created.month),
+}
+
+
+def _tier_keeps(valid: list[Archive], period: Callable[[datetime], Any], count: int) -> list[Archive]:
+	kept, seen = [], set()
+	for archive in valid:
+		if len(seen) >= count:
+			break
+		bucket = period(archive["created"])
+		if bucket not in seen:
+			seen.add(bucket)
+			kept.append(archive)
+	return kept
+
+
+def _pin_chains(archives: Dict[str, Archive], reasons: Dict[str, list[str]]) -> None:
+	"""Keep every archive an incremental backup still reads its unchanged files from."""
+	for name in list(reasons):
+		previous = archives[name].get("previous")
+		while previous and previous in archives:
+			reasons.setdefault(previous, [])
+			if "chain" not in reasons[previous]:
+				reasons[previous].append("chain")
+			previous = archives[previous].get("previous")
+
+
+def plan(
+	archives: list[Archive],
+	*,
+	keep_last: int = 0,
+	keep_daily: int = 0,
+	keep_weekly: int = 0,
+	keep_monthly: int = 0,
+	max_total_bytes: Optional[int] = None,
+) -> Dict[str, Any]:
+	"""Split `archives` into kept ones (with the rules that kept them) and ones to prune.
+
+	Invalid archives (failed backups) never satisfy a rule and are always pruned. The
+	newest valid archive and archives in use are never pruned, not even to meet
+	`max_total_bytes`.
+	"""
+	ordered = sorted(archives, key=lambda archive: archive["created"], reverse=True)
+	by_name = {archive["name"]: archive for archive in ordered}
+	valid = [archive for archive in ordered if archive["valid"]]
+
+	base: Dict[str, list[str]] = {}
+	for archive in valid[:keep_last]:
+		base.setdefault(archive["name"], []).append("last")
+	for tier, count in (("daily", keep_daily), ("weekly", keep_weekly), ("monthly", keep_monthly)):
+		for archive in _tier_keeps(valid, TIERS[tier], count):
+			base.setdefault(archive["name"], []).append(tier)
+	if valid:
+		base.setdefault(valid[0]["name"], []).append("newest")
+	for archive in ordered:
+		if archive.get("in_use"):
+			base.setdefault(archive["name"], []).append("in use")
+
+	def pinned() -> Dict[str, list[str]]:
+		reasons = {name: list(rules) for name, rules in base.items()}
+		_pin_chains(by_name, reasons)
+		return reasons
+
+	reasons = pinned()
+	if max_total_bytes is not None:
+		while sum(by_name[name]["bytes"] for name in reasons) > max_total_bytes:
+			# Oldest first; an archive a kept increment still depends on cannot go yet.
+			droppable = [
+				archive["name"]
+				for archive in reversed(ordered)
+				if archive["name"] in base and not UNDROPPABLE & set(reasons[archive["name"]])
+			]
+			if not droppable:
+				break
+			del base[droppable[0]]
+			reasons = pinned()
+
+	keep = [
+		dict(archive, reasons=reasons[archive["name"]]) for archive in ordered if archive["name"] in reasons
+	]
+	prune = [archive for archive in ordered if archive["name"] not in reasons]
+	return {
+		"keep": keep,
+		"prune": prune,
+		"bytes_kept": sum(archive["bytes"] for archive in keep),
+		"bytes_freed": sum(archive["bytes"] for archive in prune),
+	}
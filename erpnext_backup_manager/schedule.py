@@ -0,0 +1,60 @@
+"""Cron timing and host load probes for scheduled backups.
+
+Kept free of Frappe imports; the scheduler job in ``tasks`` combines these with the
+database thread count and the backup lock.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from croniter import croniter
+
+PROC_STAT = "/proc/stat"
+
+
+def validate_cron(expression: str) -> bool:
+	return croniter.is_valid(expression)
+
+
+def next_run(expression: str, after: datetime) -> datetime:
+	return croniter(expression, after).get_next(datetime)
+
+
+def backoff_delay(attempt: int, base: int, cap: int) -> int:
+	"""Seconds to wait before retry number `attempt` (1-based): base, 2*base, 4*base ... cap."""
+	return min(base * 2 ** max(attempt - 1, 0), cap)
+
+
+def load_per_cpu() -> Optional[float]:
+	"""One-minute load average divided by the CPU count; None where unsupported."""
+	try:
+		return os.getloadavg()[0] / (os.cpu_count() or 1)
+	except (AttributeError, OSError):
+		return None
+
+
+def _cpu_times() -> Optional[list[int]]:
+	try:
+		with open(PROC_STAT, encoding="ascii") as handle:
+			return [int(value) for value in handle.readline().split()[1:]]
+	except (OSError, ValueError):
+		return None
+
+
+def io_wait_percent(interval: float = 0.5) -> Optional[float]:
+	"""Share of CPU time spent waiting for I/O over `interval` seconds (Linux only)."""
+	before = _cpu_times()
+	if not before or len(before) < 5:
+		return None
+	time.sleep(interval)
+	after = _cpu_times()
+	if not after or len(after) != len(before):
+		return None
+	deltas = [new - old for new, old in zip(after, before, strict=True)]
+	total = sum(deltas)
+	# Field 5 of the "cpu" line is iowait.
+	return 100.0 * deltas[4] / total if total else 0.0
@@ -0,0 +1,189 @@
+"""Streaming extraction of single tables from a database backup.
+
+A selective restore only needs a handful of tables, but a ``.sql.gz`` dump has no
+index. `iter_table_statements` decompresses the dump as a stream and keeps just the
+``DROP TABLE``/``CREATE TABLE``/``INSERT`` statements of the wanted tables; the rest
+is read past without being held in memory or written to disk. ``mysqldump`` writes
+each table in one piece, so reading stops as soon as every wanted table has been
+passed. Per-table dumps (see `dump`) are cheaper still: only the files of the wanted
+tables are opened.
+
+`load_tables` renames the statements onto scratch tables (``_restore_<id>_<table>``)
+before running them, so the live tables are never written here; copying rows from
+the scratch tables into the site is left to the caller.
+
+Kept free of Frappe imports; ``python -m erpnext_backup_manager.selective`` prints the
+SQL of the chosen tables for use with the ``mariadb`` client.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import re
+import sys
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from erpnext_backup_manager.compression import decompressor
+from erpnext_backup_manager.dump import is_dump_manifest, read_manifest, tables_dir
+from erpnext_backup_manager.restore_engine import SANDBOX_LINE
+
+STATEMENT_HEAD = re.compile(r"(DROP TABLE IF EXISTS|CREATE TABLE|INSERT INTO) `((?:[^`]|``)+)`")
+SCRATCH_PREFIX = "_restore_"
+MAX_TABLE_NAME = 64
+# Statements per transaction while loading scratch tables.
+COMMIT_EVERY = 100
+SESSION_SETUP = (
+	"SET SESSION FOREIGN_KEY_CHECKS=0",
+	"SET SESSION UNIQUE_CHECKS=0",
+	"SET SESSION SQL_MODE='NO_AUTO_VALUE_ON_ZERO'",
+)
+
+
+def _quote(name: str) -> str:
+	return "`" + name.replace("`", "``") + "`"
+
+
+def scratch_table(restore_id: str, table: str) -> str:
+	"""Name of the scratch copy of `table`; hashed when the prefixed name would be too long."""
+	name = f"{SCRATCH_PREFIX}{restore_id}_{table}"
+	if len(name) > MAX_TABLE_NAME:
+		name = f"{SCRATCH_PREFIX}{restore_id}_{hashlib.sha1(table.encode()).hexdigest()[:16]}"
+	return name
+
+
+def rename_statement(statement: str, name: str) -> str:
+	return STATEMENT_HEAD.sub(lambda match: f"{match.group(1)} {_quote(name)}", statement, count=1)
+
+
+def _lines(path: Path) -> Iterator[str]:
+	process, stream = decompressor(path, 1)
+	try:
+		# Binary values are not valid UTF-8; surrogate escapes carry them through to pymysql.
+		with io.TextIOWrapper(stream, encoding="utf-8", errors="surrogateescape", newline="\n") as text:
+			first = text.readline()
+			if not first.startswith(SANDBOX_LINE.decode()):
+				yield first
+			yield from text
+	except GeneratorExit:
+		# The reader stopped early; a decompressor left running would block on the full pipe.
+		if process:
+			process.kill()
+			process.wait()
+		raise
+	if process and process.wait() != 0:
+		raise RuntimeError(f"Decompressing {path.name} failed with exit code {process.returncode}.")
+
+
+def _sources(db_path: Path, tables: set[str]) -> list[Path]:
+	if not is_dump_manifest(db_path):
+		return [db_path]
+	directory = tables_dir(db_path)
+	return [
+		directory / entry["file"]
+		for entry in read_manifest(db_path)["tables"]
+		if entry["name"] in tables and entry["type"] == "table"
+	]
+
+
+def iter_table_statements(db_path: Path, tables: Iterable[str]) -> Iterator[tuple[str, str]]:
+	"""Yield ``(table, statement)`` for the DROP/CREATE/INSERT statements of `tables`.
+
+	String values in a dump never hold a raw newline, so a statement ends at the first
+	line ending in ``;``.
+	"""
+	wanted = set(tables)
+	for source in _sources(db_path, wanted):
+		seen: set[str] = set()
+		current: Optional[str] = None
+		keep = False
+		statement: list[str] = []
+		in_statement = False
+		lines = _lines(source)
+		for line in lines:
+			if not in_statement:
+				match = STATEMENT_HEAD.match(line)
+				if not match:
+					continue
+				table = match.group(2).replace("``", "`")
+				if table != current and current in wanted and seen >= wanted:
+					# mysqldump writes every table in one piece: nothing wanted is left.
+					break
+				current = table
+				keep = table in wanted
+				if keep:
+					seen.add(table)
+			in_statement = not line.rstrip().endswith(";")
+			if keep:
+				statement.append(line)
+				if not in_statement:
+					yield current, "".join(statement).rstrip()[:-1]
+					statement = []
+		lines.close()
+
+
+def load_tables(
+	connection,
+	db_path: Path,
+	scratch: Dict[str, str],
+	on_table: Optional[Callable[[str], None]] = None,
+) -> Dict[str, int]:
+	"""Create the scratch tables named in `scratch` (table -> scratch name) from the dump.
+
+	Returns the statements run per table; tables missing from the dump are absent.
+	"""
+	statements: Dict[str, int] = {}
+	pending = 0
+	with connection.cursor() as cursor:
+		for query in SESSION_SETUP:
+			cursor.execute(query)
+		for table, statement in iter_table_statements(db_path, scratch):
+			if table not in statements:
+				statements[table] = 0
+				if on_table:
+					on_table(table)
+			cursor.execute(rename_statement(statement, scratch[table]))
+			statements[table] += 1
+			pending += 1
+			if pending >= COMMIT_EVERY:
+				connection.commit()
+				pending = 0
+	connection.commit()
+	return statements
+
+
+def count_rows(connection, table: str) -> int:
+	with connection.cursor() as cursor:
+		cursor.execute(f"SELECT COUNT(*) FROM {_quote(table)}")
+		return int(cursor.fetchone()[0])
+
+
+def drop_tables(connection, names: Iterable[str]) -> None:
+	with connection.cursor() as cursor:
+		for name in names:
+			if not name.startswith(SCRATCH_PREFIX):
+				raise ValueError(f"{name} is not a scratch table.")
+			cursor.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+	connection.commit()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.selective")
+	parser.add_argument("db", type=Path, help=".sql.gz dump or per-table dump manifest")
+	parser.add_argument("--table", action="append", required=True, dest="tables")
+	parser.add_argument("--rename", metavar="RESTORE_ID", help="write into scratch tables for this id")
+	args = parser.parse_args(argv)
+
+	output = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="surrogateescape")
+	output.write("".join(f"{query};\n" for query in SESSION_SETUP))
+	for table, statement in iter_table_statements(args.db, args.tables):
+		if args.rename:
+			statement = rename_statement(statement, scratch_table(args.rename, table))
+		output.write(statement + ";\n")
+	output.flush()
+
+
+if __name__ == "__main__":
+	main()
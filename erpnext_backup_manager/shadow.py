@@ -0,0 +1,218 @@
+"""Shadow-database restores: import next to the live site, then switch over.
+
+The restore script imports the archive into a new database and its files into a
+staging folder while the site keeps serving from the live ones. It migrates the new
+database through a temporary site folder (``<site>.shadow``) whose config points at
+it, and only then enters maintenance mode to `swap`: the site config is pointed at
+the new database and the staged files are renamed into place, which takes seconds
+whatever the size of the site.
+
+The previous database and files are left as they were, so `rollback` switches back
+just as quickly. `discard` deletes whichever side is no longer in use. Names and
+paths are kept in a state file written when the restore script is built.
+
+Kept free of Frappe imports; the script calls
+``python -m erpnext_backup_manager.shadow <command> --state <file>``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from erpnext_backup_manager.dump import connect, site_config
+from erpnext_backup_manager.restore_engine import FILE_ROOTS
+
+STATE_SUFFIX = ".shadow.json"
+SHADOW_SITE_SUFFIX = ".shadow"
+# A database restored this way is renamed again by the next shadow restore; the
+# suffix is replaced rather than stacked, which keeps names under MariaDB's 64 characters.
+SHADOW_DB_SUFFIX = re.compile(r"_r\d{14}$")
+DB_NAME_PREFIX_LENGTH = 40
+
+
+def log(message: str) -> None:
+	print(f"[shadow] {message}", flush=True)
+
+
+def state_path(log_path: Path) -> Path:
+	return log_path.with_name(f"{log_path.stem}{STATE_SUFFIX}")
+
+
+def shadow_db_name(db_name: str, timestamp: str) -> str:
+	return f"{SHADOW_DB_SUFFIX.sub('', db_name)[:DB_NAME_PREFIX_LENGTH]}_r{timestamp}"
+
+
+def new_state(site_path: Path, config: Dict[str, Any], timestamp: str) -> Dict[str, Any]:
+	"""State of a shadow restore about to start; `timestamp` is ``%Y%m%d%H%M%S``."""
+	return {
+		"state": "prepared",
+		"site_path": str(site_path),
+		"shadow_site_path": str(site_path.with_name(f"{site_path.name}{SHADOW_SITE_SUFFIX}")),
+		"live_db": config["db_name"],
+		"shadow_db": shadow_db_name(config["db_name"], timestamp),
+		# Frappe connects as db_name when db_user is unset; the switch must not change the user.
+		"db_user": config.get("db_user") or config["db_name"],
+		"staging_dir": str(site_path / f".restore_{timestamp}"),
+		"previous_dir": str(site_path / f".previous_{timestamp}"),
+	}
+
+
+def read_state(path: Path) -> Dict[str, Any]:
+	return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_state(path: Path, state: Dict[str, Any]) -> None:
+	tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+	tmp_path.write_text(json.dumps({**state, "updated_at": time.time()}), encoding="utf-8")
+	os.replace(tmp_path, path)
+
+
+def _update_site_config(site_path: Path, **values: Any) -> None:
+	"""Set keys in the site's own ``site_config.json``, replacing the file in one step."""
+	path = site_path / "site_config.json"
+	config = json.loads(path.read_text(encoding="utf-8"))
+	config.update(values)
+	tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+	tmp_path.write_text(json.dumps(config, indent=1, sort_keys=True), encoding="utf-8")
+	shutil.copymode(path, tmp_path)
+	os.replace(tmp_path, path)
+
+
+def _drop_database(state: Dict[str, Any], db_name: str) -> None:
+	# The site's user holds all privileges on both databases, DROP included.
+	config = {**site_config(Path(state["site_path"])), "db_user": state["db_user"], "db_name": db_name}
+	connection = connect(config)
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
+	finally:
+		connection.close()
+	log(f"dropped database {db_name}")
+
+
+def prepare(path: Path) -> Dict[str, Any]:
+	"""Create the staging folder and the temporary site folder that points at the shadow database."""
+	state = read_state(path)
+	site_path = Path(state["site_path"])
+	staging = Path(state["staging_dir"])
+	shadow_site = Path(state["shadow_site_path"])
+	shutil.rmtree(shadow_site, ignore_errors=True)
+	shadow_site.mkdir()
+	config = json.loads((site_path / "site_config.json").read_text(encoding="utf-8"))
+	config.update(
+		db_name=state["shadow_db"],
+		db_user=state["db_user"],
+		maintenance_mode=0,
+		# The bench scheduler and bench-wide backups see every site folder.
+		pause_scheduler=1,
+		backup_manager_bench_exclude=1,
+	)
+	(shadow_site / "site_config.json").write_text(json.dumps(config, indent=1), encoding="utf-8")
+	for name in ("locks", "logs"):
+		(shadow_site / name).mkdir()
+	for root in FILE_ROOTS:
+		(staging / root).mkdir(parents=True, exist_ok=True)
+		os.symlink(staging / root, shadow_site / root)
+	log(f"prepared {shadow_site.name} on database {state['shadow_db']}")
+	return state
+
+
+def swap(path: Path) -> Dict[str, Any]:
+	"""Point the site at the shadow database and rename the staged files into place."""
+	state = read_state(path)
+	site_path = Path(state["site_path"])
+	_update_site_config(site_path, db_name=state["shadow_db"], db_user=state["db_user"])
+	for root in FILE_ROOTS:
+		staged = Path(state["staging_dir"]) / root / "files"
+		if not staged.exists():
+			# The archive had no backup of these files; the current ones stay.
+			continue
+		live = site_path / root / "files"
+		previous = Path(state["previous_dir"]) / root / "files"
+		previous.parent.mkdir(parents=True, exist_ok=True)
+		if live.exists():
+			os.rename(live, previous)
+		os.rename(staged, live)
+	shutil.rmtree(state["shadow_site_path"], ignore_errors=True)
+	state["state"] = "swapped"
+	write_state(path, state)
+	log(f"switched {site_path.name} from {state['live_db']} to {state['shadow_db']}")
+	return state
+
+
+def abort(path: Path) -> Optional[Dict[str, Any]]:
+	"""Remove a shadow restore that did not reach the swap; does nothing after it."""
+	state = read_state(path)
+	if state["state"] != "prepared":
+		return None
+	shutil.rmtree(state["shadow_site_path"], ignore_errors=True)
+	shutil.rmtree(state["staging_dir"], ignore_errors=True)
+	try:
+		_drop_database(state, state["shadow_db"])
+	except Exception as exc:
+		# Not created yet, or the server is down; the name is in the state file.
+		log(f"could not drop {state['shadow_db']}: {exc}")
+	state["state"] = "aborted"
+	write_state(path, state)
+	return state
+
+
+def rollback(path: Path) -> Dict[str, Any]:
+	"""Switch back to the database and files the site had before the restore."""
+	state = read_state(path)
+	if state["state"] != "swapped":
+		raise ValueError(f"Nothing to roll back: the restore is {state['state']}.")
+	site_path = Path(state["site_path"])
+	_update_site_config(site_path, db_name=state["live_db"], db_user=state["db_user"])
+	for root in FILE_ROOTS:
+		previous = Path(state["previous_dir"]) / root / "files"
+		if not previous.exists():
+			continue
+		live = site_path / root / "files"
+		# The restored files go back to staging, so `discard` removes the right side.
+		staged = Path(state["staging_dir"]) / root / "files"
+		staged.parent.mkdir(parents=True, exist_ok=True)
+		os.rename(live, staged)
+		os.rename(previous, live)
+	state["state"] = "rolled_back"
+	write_state(path, state)
+	log(f"switched {site_path.name} back to {state['live_db']}")
+	return state
+
+
+def discard(path: Path) -> Dict[str, Any]:
+	"""Delete the side not in use: the previous database and files, or the rolled-back restore."""
+	state = read_state(path)
+	if state["state"] == "swapped":
+		db_name, directory = state["live_db"], state["previous_dir"]
+	elif state["state"] == "rolled_back":
+		db_name, directory = state["shadow_db"], state["staging_dir"]
+	else:
+		raise ValueError(f"Nothing to discard: the restore is {state['state']}.")
+	_drop_database(state, db_name)
+	shutil.rmtree(directory, ignore_errors=True)
+	state["state"] = "discarded"
+	write_state(path, state)
+	return state
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+	parser = argparse.ArgumentParser(prog="python -m erpnext_backup_manager.shadow")
+	parser.add_argument("command", choices=("prepare", "swap", "abort", "rollback", "discard"))
+	parser.add_argument("--state", type=Path, required=True)
+	args = parser.parse_args(argv)
+	{"prepare": prepare, "swap": swap, "abort": abort, "rollback": rollback, "discard": discard}[
+		args.command
+	](args.state)
+
+
+if __name__ == "__main__":
+	main()
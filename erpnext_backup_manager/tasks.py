@@ -0,0 +1,71 @@
+import frappe
+
+from erpnext_backup_manager.api import (
+	_verify_archive,
+	_verify_rate,
+	fail_interrupted_backups,
+	queue_pending_replications,
+	remove_stale_uploads,
+	run_deferred_retention,
+	run_retention,
+	run_scheduled_backups,
+	start_bench_backup,
+)
+
+DEFAULT_VERIFY_BATCH = 3
+
+
+def verify_archives() -> None:
+	"""Re-hash the least recently verified archives at the configured read rate."""
+	if not int(frappe.conf.get("backup_manager_verify_enabled", 1)):
+		return
+
+	batch = int(frappe.conf.get("backup_manager_verify_batch") or DEFAULT_VERIFY_BATCH)
+	names = frappe.get_all(
+		"Backup Archive",
+		filters={"status": ("in", ["Ready", "Restored"])},
+		order_by="verified_on asc, creation asc",
+		limit=batch,
+		pluck="name",
+	)
+	for name in names:
+		try:
+			_verify_archive(frappe.get_doc("Backup Archive", name), _verify_rate())
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title=f"Backup archive verification failed: {name}")
+
+
+def prune_archives() -> None:
+	"""Apply the configured retention policy; does nothing when no rule is set."""
+	run_retention(dry_run=False)
+
+
+def prune_deferred_archives() -> None:
+	"""Retry a retention run that was put off by a running backup or restore."""
+	run_deferred_retention()
+
+
+def clean_stale_uploads() -> None:
+	"""Remove chunked uploads that were abandoned before a restore used them."""
+	remove_stale_uploads()
+
+
+def replicate_archives() -> None:
+	"""Copy recent archives to replication targets that lack them and retry failed copies."""
+	queue_pending_replications()
+
+
+def run_backup_schedules() -> None:
+	"""Start the backups whose cron schedule is due, unless the host is too busy."""
+	run_scheduled_backups()
+
+
+def sweep_interrupted_backups() -> None:
+	"""Mark backups Failed whose process was killed while they were Running."""
+	fail_interrupted_backups()
+
+
+def run_bench_backup_schedule() -> None:
+	"""Start the bench-wide backup of all sites when its cron schedule is due."""
+	start_bench_backup()
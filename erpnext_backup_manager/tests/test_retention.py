@@ -0,0 +1,92 @@
+import unittest
+from datetime import datetime, timedelta
+
+from erpnext_backup_manager import retention
+
+NOW = datetime(2026, 3, 16, 2, 0)
+
+
+def archive(name, days_ago, previous=None, size=10, valid=True, in_use=False):
+	return {
+		"name": name,
+		"created": NOW - timedelta(days=days_ago),
+		"bytes": size,
+		"valid": valid,
+		"previous": previous,
+		"in_use": in_use,
+	}
+
+
+def kept(plan):
+	return {row["name"]: row["reasons"] for row in plan["keep"]}
+
+
+def pruned(plan):
+	return [row["name"] for row in plan["prune"]]
+
+
+class TestRetentionPlan(unittest.TestCase):
+	def test_tiers_keep_newest_per_period(self):
+		archives = [archive(f"d{day}-{hour}", day + hour / 24) for day in range(5) for hour in range(2)]
+		plan = retention.plan(archives, keep_daily=3)
+		self.assertEqual(set(kept(plan)), {"d0-0", "d1-0", "d2-0"})
+		self.assertEqual(len(plan["prune"]), 7)
+
+	def test_failed_backups_are_pruned(self):
+		plan = retention.plan([archive("ok", 2), archive("failed", 1, valid=False)], keep_last=5)
+		self.assertEqual(kept(plan), {"ok": ["last", "newest"]})
+		self.assertEqual(pruned(plan), ["failed"])
+
+	def test_increment_pins_its_chain(self):
+		archives = [
+			archive("base", 3),
+			archive("inc1", 2, previous="base"),
+			archive("inc2", 1, previous="inc1"),
+			archive("other", 4),
+		]
+		plan = retention.plan(archives, keep_last=1)
+		self.assertEqual(kept(plan), {"inc2": ["last", "newest"], "inc1": ["chain"], "base": ["chain"]})
+		self.assertEqual(pruned(plan), ["other"])
+
+	def test_in_use_archive_and_its_chain_are_kept(self):
+		# A running increment is not a usable backup yet, but its base must stay.
+		archives = [
+			archive("base", 3),
+			archive("full", 2),
+			archive("running", 0, previous="base", valid=False, in_use=True),
+		]
+		plan = retention.plan(archives, keep_last=1)
+		self.assertEqual(kept(plan), {"running": ["in use"], "full": ["last", "newest"], "base": ["chain"]})
+		self.assertEqual(pruned(plan), [])
+
+	def test_in_use_is_never_dropped_for_the_budget(self):
+		archives = [archive("restoring", 5, size=100, in_use=True), archive("new", 0, size=100)]
+		plan = retention.plan(archives, keep_last=2, max_total_bytes=50)
+		self.assertEqual(set(kept(plan)), {"restoring", "new"})
+
+	def test_budget_drops_oldest_first(self):
+		archives = [archive(f"a{day}", day, size=10) for day in range(5)]
+		plan = retention.plan(archives, keep_last=5, max_total_bytes=30)
+		self.assertEqual(set(kept(plan)), {"a0", "a1", "a2"})
+		self.assertEqual(pruned(plan), ["a3", "a4"])
+		self.assertEqual(plan["bytes_kept"], 30)
+		self.assertEqual(plan["bytes_freed"], 20)
+
+	def test_budget_drops_increment_before_its_base(self):
+		# The base is oldest, but it cannot go while the kept increment reads from it.
+		archives = [
+			archive("base", 4, size=10),
+			archive("inc", 3, previous="base", size=10),
+			archive("mid", 2, size=10),
+			archive("new", 0, size=10),
+		]
+		plan = retention.plan(archives, keep_last=4, max_total_bytes=20)
+		self.assertEqual(set(kept(plan)), {"mid", "new"})
+		self.assertEqual(pruned(plan), ["inc", "base"])
+
+	def test_budget_keeps_newest_even_when_over(self):
+		plan = retention.plan(
+			[archive("big", 0, size=100), archive("old", 1)], keep_last=2, max_total_bytes=5
+		)
+		self.assertEqual(kept(plan), {"big": ["last", "newest"]})
+		self.assertEqual(pruned(plan), ["old"])
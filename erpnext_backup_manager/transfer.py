@@ -0,0 +1,75 @@
+"""Placing existing files into the archive without copying their bytes.
+
+Uploaded backups can be many gigabytes, and copying them into the archive doubles
+disk usage before a restore has even started. `place_file` tries the cheapest way
+to make a file appear at its archive path: a rename (when the caller gives the
+source up), a hardlink, a reflink (copy-on-write clone on btrfs/XFS), and an
+in-kernel ``copy_file_range``. It returns None when only a plain byte copy is
+left, which the caller performs while hashing.
+
+Kept free of Frappe imports for the same reasons as `filestore`.
+"""
+
+from __future__ import annotations
+
+import errno
+import fcntl
+import os
+from pathlib import Path
+from typing import Optional
+
+# ioctl(dest_fd, FICLONE, src_fd) from <linux/fs.h>.
+FICLONE = 0x40049409
+COPY_RANGE_CHUNK = 1024 * 1024 * 1024
+
+
+def _reflink(source: Path, target: Path) -> bool:
+	with open(source, "rb") as reader, open(target, "wb") as writer:
+		try:
+			fcntl.ioctl(writer.fileno(), FICLONE, reader.fileno())
+			return True
+		except OSError:
+			pass
+	target.unlink()
+	return False
+
+
+def _copy_range(source: Path, target: Path) -> bool:
+	if not hasattr(os, "copy_file_range"):
+		return False
+	with open(source, "rb") as reader, open(target, "wb") as writer:
+		try:
+			while os.copy_file_range(reader.fileno(), writer.fileno(), COPY_RANGE_CHUNK):
+				pass
+			return True
+		except OSError:
+			pass
+	target.unlink()
+	return False
+
+
+def place_file(source: Path, target: Path, *, move: bool = False) -> Optional[str]:
+	"""Make `source` available at `target` without a userspace copy.
+
+	Returns the method used ("rename", "link", "reflink" or "copy_range"), or None
+	when the file has to be copied. With `move`, `source` may be renamed away.
+	"""
+	if move:
+		try:
+			os.rename(source, target)
+			return "rename"
+		except OSError as exc:
+			if exc.errno != errno.EXDEV:
+				raise
+	try:
+		os.link(source, target)
+		return "link"
+	except OSError as exc:
+		# Other filesystem, or a hardlink the kernel refuses (protected_hardlinks, FAT).
+		if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+			raise
+	if _reflink(source, target):
+		return "reflink"
+	if _copy_range(source, target):
+		return "copy_range"
+	return None